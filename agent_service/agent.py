@@ -1,40 +1,250 @@
+import importlib
 import os
+import threading
 import uuid
 import logging
-from typing import Dict, Any, List
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
 
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import AIMessage, ToolMessage, BaseMessage
 
 # [1] Wildcard companion packages are imported here. Since we're using langgraph, we need to import the langgraph package
 from wildcard_core.tool_registry.tools.rest_api.types import ApiKeyAuthConfig, BearerAuthConfig, AuthType
 from wildcard_core.tool_search.utils.api_service import APIService
-from wildcard_langgraph import create_tool_selection_agent
 from wildcard_core import ToolSearchClient
 
+from utils.ToolSearchCache import ToolSearchCache, normalize_query
+from utils.LLMScheduler import LLMScheduler, SchedulingChatModel
+from utils.HistoryCompactor import HistoryCompactor, summarize_with_model
+from utils.LLMResponseCache import CachingChatModel, LLMResponseCache
+from utils.ParallelToolNode import parallelize_tool_node
+
+if TYPE_CHECKING:
+    from langgraph.graph.graph import CompiledGraph
+    from wildcard_langgraph import DynamicToolSelectState
+
+# Resolved once, before anything below (or main.py) reads the environment
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
+
+
+# The model, HTTP client and compiled graph are stateless across conversations, so they are
+# built once per process and shared. Only the ToolSearchClient (which carries per-user API
+# auth) and the initial state that references it are created per thread.
+_shared_agent: Optional[Tuple["CompiledGraph", "DynamicToolSelectState"]] = None
+# The warm pool builds agents on a worker thread while requests may build one inline
+_shared_agent_lock = threading.Lock()
+
+
+def get_shared_agent() -> Tuple["CompiledGraph", "DynamicToolSelectState"]:
+    if _shared_agent is not None:
+        return _shared_agent
+    with _shared_agent_lock:
+        if _shared_agent is None:
+            _build_shared_agent()
+    return _shared_agent
+
+
+def _build_shared_agent():
+    global _shared_agent
+    tool_search_cache.load()
+    if history_compactor is not None:
+        # May download the tokenizer's vocabulary; this runs on the warm pool's thread
+        history_compactor.load_encoding()
+
+    # [2] The ToolSearchClient is used to search for tools that the agent can use. This one is only
+    # the template the graph is compiled with; every thread gets its own via new_tool_search_client().
+    tool_search_client = new_tool_search_client()
+
+    agent_factory = load_factory("AGENT_FACTORY")
+    if agent_factory is not None:
+        # e.g. the offline fake agent the benchmarks run against
+        agent, initial_state = agent_factory(tool_search_client)
+    else:
+        # Imported here: langchain_openai and the graph builder dominate import time, and this
+        # runs on the warm pool's thread rather than during startup
+        from langchain_openai import ChatOpenAI
+        from wildcard_langgraph import create_tool_selection_agent
+
+        # [4] Initialize the agent. We're using the ChatOpenAI model here.
+        openai_api_key = os.getenv("OPENAI_API_KEY")
+        # With the scheduler on, rate limit retries go through its queue instead of the client's own backoff
+        max_retries = 0 if llm_scheduler is not None else 2
+        model = cached_model(scheduled_model(ChatOpenAI(model="gpt-4o", temperature=0, api_key=openai_api_key, max_retries=max_retries)))
+
+        # [5] Here's the fun part. Tweak this prompt to change the behavior of the agent
+        task_system_prompt = """You are an autonomous personal assistant.
+        """
+
+        # [6] Create the agent enabled with our tool search client.
+        agent, initial_state = create_tool_selection_agent(model, tool_search_client, task_system_prompt)
+
+    # Run the tool calls of one AI message concurrently. TOOL_CONCURRENCY=1 keeps them sequential.
+    tool_concurrency = int(os.getenv("TOOL_CONCURRENCY", "8"))
+    if tool_concurrency > 1:
+        agent = parallelize_tool_node(
+            agent,
+            node_name=os.getenv("TOOL_NODE_NAME", "tools"),
+            max_concurrency=tool_concurrency,
+            timeout=float(os.getenv("TOOL_TIMEOUT", "60")),
+        )
+
+    # [7] Optionally swap the in-process checkpointer for a durable one so threads survive restarts.
+    checkpointer = get_checkpointer()
+    if checkpointer is not None:
+        agent.checkpointer = checkpointer
+
+    _shared_agent = (agent, initial_state)
+
+
+def close_shared_agent():
+    if _shared_agent is None:
+        # Nothing was loaded, so saving would overwrite the persisted cache with an empty one
+        return
+    tool_search_cache.save()
+    if llm_response_cache is not None:
+        llm_response_cache.close()
+    close = getattr(_shared_agent[0].checkpointer, "close", None)
+    if close is not None:
+        close()
+
+
+def load_factory(env_var: str):
+    """
+    Resolves a "module:attribute" reference from env_var, or None when it isn't set.
+    AGENT_FACTORY replaces create_tool_selection_agent (called with the template
+    ToolSearchClient, returns (agent, initial_state)); TOOL_SEARCH_CLIENT_FACTORY
+    replaces the ToolSearchClient constructor.
+    """
+    spec = os.getenv(env_var)
+    if not spec:
+        return None
+    module, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def get_checkpointer():
+    """
+    Returns the checkpointer selected by CHECKPOINT_BACKEND, or None to keep the
+    graph's own saver. Both backends keep the newest CHECKPOINT_KEEP_LAST
+    checkpoints of each thread; 0 keeps them all.
+    """
+    backend = os.getenv("CHECKPOINT_BACKEND", "memory").lower()
+    keep_last = int(os.getenv("CHECKPOINT_KEEP_LAST", "20")) or None
+    if backend == "memory":
+        if not keep_last:
+            return None
+        from utils.MemoryCheckpointer import MemoryCheckpointer
+
+        # The graph's default MemorySaver never prunes, and it is shared by every thread
+        return MemoryCheckpointer(keep_last=keep_last)
+    if backend == "sqlite":
+        from utils.SqliteCheckpointer import SqliteCheckpointer
+
+        return SqliteCheckpointer(
+            path=os.getenv("CHECKPOINT_PATH", os.path.join(os.path.dirname(__file__), "checkpoints.sqlite")),
+            batch_size=int(os.getenv("CHECKPOINT_BATCH_SIZE", "64")),
+            flush_interval=float(os.getenv("CHECKPOINT_FLUSH_INTERVAL", "1.0")),
+            keep_last=keep_last,
+        )
+    raise ValueError(f"Unsupported CHECKPOINT_BACKEND: {backend}")
+
+
+# Tool discovery results don't depend on a thread's OAuth credentials, so one cache is
+# shared by every thread's client. TOOL_SEARCH_CACHE_TTL=0 disables it.
+tool_search_cache = ToolSearchCache(
+    max_entries=int(os.getenv("TOOL_SEARCH_CACHE_MAX_ENTRIES", "4096")),
+    ttl=float(os.getenv("TOOL_SEARCH_CACHE_TTL", "900")),
+    persist_path=os.getenv("TOOL_SEARCH_CACHE_PATH") or None,
+)
+
+
+# Every thread's LLM calls share one rate limit and concurrency budget. LLM_SCHEDULER=0 disables it.
+llm_scheduler = LLMScheduler(
+    requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+    initial_concurrency=int(os.getenv("LLM_CONCURRENCY", "8")),
+    min_concurrency=int(os.getenv("LLM_MIN_CONCURRENCY", "1")),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "64")),
+    latency_target=float(os.getenv("LLM_LATENCY_TARGET", "0")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+) if os.getenv("LLM_SCHEDULER", "1") != "0" else None
+
+
+def scheduled_model(model):
+    if llm_scheduler is None:
+        return model
+    return SchedulingChatModel(model=model, scheduler=llm_scheduler)
+
+
+# Opt-in with LLM_CACHE=1: replays identical temperature-0 calls. LLM_CACHE_PATH adds the disk tier.
+llm_response_cache = LLMResponseCache(
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+    path=os.getenv("LLM_CACHE_PATH") or None,
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+) if os.getenv("LLM_CACHE", "0") == "1" else None
+
+
+def cached_model(model):
+    # Outside the scheduler, so cache hits don't wait for (or count against) the rate limits
+    if llm_response_cache is None:
+        return model
+    return CachingChatModel(model=model, response_cache=llm_response_cache)
+
+
+_summary_model = None
+
+
+async def summarize_history(previous_summary: str, messages: List[BaseMessage]) -> str:
+    global _summary_model
+    if _summary_model is None:
+        from langchain_openai import ChatOpenAI
+
+        _summary_model = scheduled_model(ChatOpenAI(
+            model=os.getenv("HISTORY_SUMMARY_MODEL"), temperature=0, api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=0 if llm_scheduler is not None else 2,
+        ))
+    return await summarize_with_model(_summary_model, previous_summary, messages)
+
+
+# Bounds the history each run sends to the model. Old turns are summarized with
+# HISTORY_SUMMARY_MODEL when set, otherwise dropped. HISTORY_MAX_TOKENS=0 disables it.
+history_compactor = HistoryCompactor(
+    max_tokens=int(os.getenv("HISTORY_MAX_TOKENS", "32000")),
+    keep_recent_turns=int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "4")),
+    tool_output_limit=int(os.getenv("HISTORY_TOOL_OUTPUT_LIMIT", "2000")),
+    summarize=summarize_history if os.getenv("HISTORY_SUMMARY_MODEL") else None,
+) if int(os.getenv("HISTORY_MAX_TOKENS", "32000")) > 0 else None
+
+
+class CachedToolSearchClient(ToolSearchClient):
+    async def search(self, query: str, *args, **kwargs):
+        key = (getattr(self, "api_key", None), normalize_query(query), repr(args), repr(sorted(kwargs.items())))
+        return await tool_search_cache.get_or_fetch(
+            key, lambda: super(CachedToolSearchClient, self).search(query, *args, **kwargs)
+        )
+
+
+def new_tool_search_client() -> ToolSearchClient:
+    client_factory = load_factory("TOOL_SEARCH_CLIENT_FACTORY")
+    if client_factory is not None:
+        return client_factory()
+
+    client_class = CachedToolSearchClient if tool_search_cache.ttl > 0 else ToolSearchClient
+    tool_search_client = client_class(api_key='alpha-api-access')
 
-def get_agent():
-    load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
-    
-    # [2] The ToolSearchClient is used to search for tools that the agent can use. Let's create one here.
-    tool_search_client = ToolSearchClient(api_key='alpha-api-access')
-    
     # [3] Register necessary API authentications if you have them
     # tool_search_client.register_api_auth(
     #     APIService.NEW_YORK_TIMES,
     #     ApiKeyAuthConfig(type=AuthType.API_KEY, key_value=os.getenv("NYT_API_KEY"))
     # )
-    
-    # [4] Initialize the agent. We're using the ChatOpenAI model here.
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    model = ChatOpenAI(model="gpt-4o", temperature=0, api_key=openai_api_key)
+    return tool_search_client
 
-    # [5] Here's the fun part. Tweak this prompt to change the behavior of the agent
-    task_system_prompt = """You are an autonomous personal assistant.
-    """
 
-    # [6] Create the agent enabled with our tool search client.
-    agent, initial_state = create_tool_selection_agent(model, tool_search_client, task_system_prompt)
+def get_agent():
+    agent, initial_state = get_shared_agent()
+
+    # Per-thread state: a fresh client so OAuth credentials never leak between threads.
+    tool_search_client = new_tool_search_client()
+    initial_state = {**initial_state, "tool_search_client": tool_search_client}
     return agent, initial_state, tool_search_client
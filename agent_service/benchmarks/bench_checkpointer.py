@@ -0,0 +1,111 @@
+"""
+Per-turn checkpoint overhead: in-memory saver vs SqliteCheckpointer.
+
+Runs a small tool-calling shaped graph (agent -> tools -> agent) without any
+LLM or network calls, so the time measured is graph + checkpointer overhead.
+
+    cd agent_service
+    python -m benchmarks.bench_checkpointer --threads 20 --turns 25
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Annotated, Any, Dict, List, TypedDict
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import END, START, StateGraph, add_messages
+
+from utils.SqliteCheckpointer import SqliteCheckpointer
+
+
+class BenchState(TypedDict):
+    messages: Annotated[list, add_messages]
+
+
+def build_graph(checkpointer, payload_bytes: int):
+    tool_output = "x" * payload_bytes
+
+    def agent(state: BenchState) -> Dict[str, Any]:
+        last = state["messages"][-1]
+        if isinstance(last, HumanMessage):
+            return {"messages": [AIMessage(content="", tool_calls=[{"id": f"call-{len(state['messages'])}", "name": "lookup", "args": {}}])]}
+        return {"messages": [AIMessage(content="done")]}
+
+    def tools(state: BenchState) -> Dict[str, Any]:
+        call = state["messages"][-1].tool_calls[0]
+        return {"messages": [ToolMessage(content=tool_output, tool_call_id=call["id"], name=call["name"])]}
+
+    def route(state: BenchState) -> str:
+        last = state["messages"][-1]
+        return "tools" if isinstance(last, AIMessage) and last.tool_calls else END
+
+    graph = StateGraph(BenchState)
+    graph.add_node("agent", agent)
+    graph.add_node("tools", tools)
+    graph.add_edge(START, "agent")
+    graph.add_conditional_edges("agent", route, ["tools", END])
+    graph.add_edge("tools", "agent")
+    return graph.compile(checkpointer=checkpointer)
+
+
+async def run_turns(graph, threads: int, turns: int) -> List[float]:
+    latencies = []
+    for turn in range(turns):
+        for thread in range(threads):
+            config = {"configurable": {"thread_id": f"bench-{thread}"}}
+            started = time.perf_counter()
+            await graph.ainvoke({"messages": [HumanMessage(content=f"turn {turn}")]}, config)
+            # What process_agent_request does after every run
+            await graph.aget_state(config)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "turns": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[int(len(ordered) * 0.95) - 1] * 1000,
+        "p99_ms": ordered[int(len(ordered) * 0.99) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=25)
+    parser.add_argument("--payload-bytes", type=int, default=4096, help="Size of each fake tool output")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--keep-last", type=int, default=20)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    results["memory"] = summarize(await run_turns(build_graph(MemorySaver(), args.payload_bytes), args.threads, args.turns))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        saver = SqliteCheckpointer(path, batch_size=args.batch_size, keep_last=args.keep_last)
+        results["sqlite"] = summarize(await run_turns(build_graph(saver, args.payload_bytes), args.threads, args.turns))
+        results["sqlite"]["flushes"] = saver.flushes
+        saver.close()
+        results["sqlite"]["file_bytes"] = sum(
+            os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)
+        )
+
+    results["sqlite_overhead_ms"] = results["sqlite"]["mean_ms"] - results["memory"]["mean_ms"]
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
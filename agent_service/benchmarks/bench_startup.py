@@ -0,0 +1,170 @@
+"""
+Cold start of the agent service: import time, time until /health and /ready
+answer, and the latency of the first message on a fresh thread.
+
+Each run starts a new `uvicorn main:app` process. By default the agent is the
+offline fake from benchmarks.fake_agent so no API keys are needed; --real uses
+the configured model and tool search client.
+
+    cd agent_service
+    python -m benchmarks.bench_startup --runs 5 --output startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from typing import Any, Dict, List, Tuple
+
+import websockets
+
+AGENT_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def service_env(args, port: int) -> Dict[str, str]:
+    env = {
+        **os.environ,
+        "SERVER_URL": f"http://127.0.0.1:{port}",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "AGENT_WARM_POOL_SIZE": str(args.warm_pool_size),
+    }
+    if not args.real:
+        env["AGENT_FACTORY"] = "benchmarks.fake_agent:build_agent"
+        env["TOOL_SEARCH_CLIENT_FACTORY"] = "benchmarks.fake_agent:FakeToolSearchClient"
+        env.setdefault("FAKE_LLM_LATENCY", "0")
+        env.setdefault("FAKE_TOKEN_LATENCY", "0")
+        env.setdefault("FAKE_SEARCH_LATENCY", "0")
+        env.setdefault("FAKE_TOOL_LATENCY", "0")
+    return env
+
+
+def measure_imports(env: Dict[str, str], top: int) -> Tuple[float, List[Dict[str, Any]]]:
+    """Cumulative import time of main, and the slowest modules imported directly under it."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=AGENT_SERVICE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    total = 0.0
+    modules: List[Dict[str, Any]] = []
+    children: List[Dict[str, Any]] = []
+    # -X importtime lists a module after everything it imported, indented two spaces per level
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        if not indent:
+            if name == "main":
+                total = int(cumulative) / 1e6
+                modules = children
+            children = []
+        elif len(indent) == 2:
+            children.append({"module": name, "cumulative_s": int(cumulative) / 1e6})
+    modules.sort(key=lambda module: module["cumulative_s"], reverse=True)
+    return total, modules[:top]
+
+
+def status_of(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+async def wait_for_status(url: str, server: subprocess.Popen, started: float, timeout: float) -> float:
+    while time.perf_counter() - started < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            if await asyncio.to_thread(status_of, url) == 200:
+                return time.perf_counter() - started
+        except OSError:
+            pass
+        await asyncio.sleep(0.01)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+async def first_message_latency(port: int) -> float:
+    async with websockets.connect(f"ws://127.0.0.1:{port}/ws/{uuid.uuid4()}") as websocket:
+        started = time.perf_counter()
+        await websocket.send(json.dumps({"message": "Hello"}))
+        while True:
+            frame = json.loads(await websocket.recv())
+            if "messages" in frame:
+                return time.perf_counter() - started
+            if frame.get("event") == "error":
+                raise RuntimeError(frame["data"].get("error"))
+
+
+async def measure_startup(args) -> Dict[str, float]:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=AGENT_SERVICE_DIR, env=service_env(args, port),
+    )
+    try:
+        health_s = await wait_for_status(f"http://127.0.0.1:{port}/health", server, started, args.timeout)
+        ready_s = await wait_for_status(f"http://127.0.0.1:{port}/ready", server, started, args.timeout)
+        first_message_s = await first_message_latency(port)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return {"health_s": health_s, "ready_s": ready_s, "first_message_s": first_message_s}
+
+
+def median(values: List[float]) -> float:
+    return statistics.median(values) if values else 0.0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--warm-pool-size", type=int, default=4)
+    parser.add_argument("--real", action="store_true", help="Use the configured model and tool search client")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    import_times = []
+    slowest: List[Dict[str, Any]] = []
+    startups = []
+    for _ in range(args.runs):
+        total, slowest = measure_imports(service_env(args, 0), args.top)
+        import_times.append(total)
+        startups.append(await measure_startup(args))
+
+    results = {
+        "runs": args.runs,
+        "warm_pool_size": args.warm_pool_size,
+        "fake_agent": not args.real,
+        "import_main_s": median(import_times),
+        "time_to_health_s": median([run["health_s"] for run in startups]),
+        "time_to_ready_s": median([run["ready_s"] for run in startups]),
+        "first_message_s": median([run["first_message_s"] for run in startups]),
+        "slowest_imports": slowest,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,252 @@
+"""
+Offline stand-ins for the LLM, the ToolSearchClient and the tool selection graph.
+
+Selected through the factory hooks in agent.py:
+
+    AGENT_FACTORY=benchmarks.fake_agent:build_agent
+    TOOL_SEARCH_CLIENT_FACTORY=benchmarks.fake_agent:FakeToolSearchClient
+
+Every run is deterministic: a human message is answered with FAKE_TOOL_CALLS tool
+calls, then a text answer of FAKE_RESPONSE_TOKENS tokens once the tool results are
+in. With FAKE_OAUTH_SERVICE set (comma-separated for several), the tools node raises
+the same OAuthCredentialsRequiredInfo interrupt as the real graph until the thread's
+client holds credentials for the services, and initiate_oauth plays the auth service by
+posting the completion webhook back to the server after FAKE_OAUTH_LATENCY seconds.
+With FAKE_LLM_MAX_CONCURRENCY set, the model answers calls beyond that many in
+flight with a 429 like a rate limited provider. The model is wrapped by the LLM
+scheduler and the response cache the same way as the real one.
+"""
+import asyncio
+import json
+import os
+import time
+import urllib.request
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Annotated, Any, AsyncIterator, Dict, Iterator, List, Optional, Set, TypedDict
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.errors import NodeInterrupt
+from langgraph.graph import END, START, StateGraph, add_messages
+from pydantic import BaseModel
+
+from wildcard_core.auth.oauth_helper import OAuthCredentialsRequiredInfo
+from wildcard_core.events.types import WildcardEvent
+from wildcard_core.tool_search.utils.api_service import APIService
+
+from agent import cached_model, scheduled_model
+
+
+@dataclass
+class FakeConfig:
+    llm_latency: float = 0.2
+    token_latency: float = 0.01
+    response_tokens: int = 40
+    tool_calls: int = 1
+    tool_latency: float = 0.05
+    tool_output_bytes: int = 2048
+    search_latency: float = 0.05
+    oauth_service: str = ""
+    oauth_latency: float = 0.1
+    llm_max_concurrency: int = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeConfig":
+        return cls(
+            llm_latency=float(os.getenv("FAKE_LLM_LATENCY", cls.llm_latency)),
+            token_latency=float(os.getenv("FAKE_TOKEN_LATENCY", cls.token_latency)),
+            response_tokens=int(os.getenv("FAKE_RESPONSE_TOKENS", cls.response_tokens)),
+            tool_calls=int(os.getenv("FAKE_TOOL_CALLS", cls.tool_calls)),
+            tool_latency=float(os.getenv("FAKE_TOOL_LATENCY", cls.tool_latency)),
+            tool_output_bytes=int(os.getenv("FAKE_TOOL_OUTPUT_BYTES", cls.tool_output_bytes)),
+            search_latency=float(os.getenv("FAKE_SEARCH_LATENCY", cls.search_latency)),
+            oauth_service=os.getenv("FAKE_OAUTH_SERVICE", cls.oauth_service),
+            oauth_latency=float(os.getenv("FAKE_OAUTH_LATENCY", cls.oauth_latency)),
+            llm_max_concurrency=int(os.getenv("FAKE_LLM_MAX_CONCURRENCY", cls.llm_max_concurrency)),
+        )
+
+
+fake_config = FakeConfig.from_env()
+
+# Keeps the simulated auth service callbacks alive until they've been posted
+_callbacks: Set[asyncio.Task] = set()
+
+
+def _service_name(api_service: Any) -> str:
+    return str(getattr(api_service, "value", api_service))
+
+
+class FakeToolSearchClient(BaseModel):
+    # A pydantic model, like the state it lives in, so checkpointers can serialize it
+    api_key: str = "fake"
+    authorized_services: List[str] = []
+
+    async def search(self, query: str, *args, **kwargs) -> List[Dict[str, Any]]:
+        await asyncio.sleep(fake_config.search_latency)
+        return [{"name": "fake_tool", "description": f"Fake tool for {query!r}"}]
+
+    def is_authorized(self, api_service: Any) -> bool:
+        return _service_name(api_service) in self.authorized_services
+
+    async def initiate_oauth(self, flows: Any, api_service: Any, required_scopes: Any, webhook_url: str) -> str:
+        task = asyncio.create_task(_complete_oauth(webhook_url, _service_name(api_service)))
+        _callbacks.add(task)
+        task.add_done_callback(_callbacks.discard)
+        return f"https://auth.invalid/authorize?service={_service_name(api_service)}"
+
+    def handle_webhook_callback(self, data: Any):
+        service = _service_name(data.api_service)
+        if service not in self.authorized_services:
+            self.authorized_services.append(service)
+
+
+async def _complete_oauth(webhook_url: str, api_service: str):
+    await asyncio.sleep(fake_config.oauth_latency)
+    body = json.dumps({
+        "event": WildcardEvent.END_OAUTH_FLOW.value,
+        "data": {
+            "api_service": api_service,
+            "token_type": "Bearer",
+            "access_token": "fake-token",
+            "scope": ["fake"],
+            "expires_at": int(time.time()) + 3600,
+        },
+    }).encode()
+    request = urllib.request.Request(webhook_url, data=body, headers={"Content-Type": "application/json"})
+    await asyncio.to_thread(urllib.request.urlopen, request, timeout=30)
+
+
+def oauth_required(api_service: str) -> OAuthCredentialsRequiredInfo:
+    # Skip validation where the type allows it; the fake client ignores flows and scopes
+    build = getattr(OAuthCredentialsRequiredInfo, "model_construct", OAuthCredentialsRequiredInfo)
+    return build(api_service=APIService(api_service), flows={}, required_scopes=["fake"])
+
+
+def _is_user_turn(messages: List[BaseMessage]) -> bool:
+    # main.py passes user messages as role dicts, which arrive as ChatMessage rather than HumanMessage
+    return not isinstance(messages[-1], (AIMessage, ToolMessage))
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+_llm_in_flight = 0
+
+
+class FakeChatModel(BaseChatModel):
+    llm_latency: float = 0.0
+    token_latency: float = 0.0
+    response_tokens: int = 10
+    tool_calls: int = 0
+    max_concurrency: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    @contextmanager
+    def _provider_slot(self) -> Iterator[None]:
+        global _llm_in_flight
+        if self.max_concurrency and _llm_in_flight >= self.max_concurrency:
+            raise FakeRateLimitError(f"Rate limited: {_llm_in_flight} calls in flight")
+        _llm_in_flight += 1
+        try:
+            yield
+        finally:
+            _llm_in_flight -= 1
+
+    def _plan(self, messages: List[BaseMessage]) -> AIMessage:
+        if _is_user_turn(messages) and self.tool_calls:
+            return AIMessage(content="", tool_calls=[
+                {"id": f"call-{len(messages)}-{index}", "name": "fake_tool", "args": {"query": messages[-1].content, "index": index}}
+                for index in range(self.tool_calls)
+            ])
+        return AIMessage(content=" ".join(f"token{index}" for index in range(self.response_tokens)))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = self._plan(messages)
+        time.sleep(self.llm_latency + self.token_latency * len(message.content.split()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = self._plan(messages)
+        with self._provider_slot():
+            await asyncio.sleep(self.llm_latency + self.token_latency * len(message.content.split()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._plan(messages)
+        with self._provider_slot():
+            await asyncio.sleep(self.llm_latency)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"id": call["id"], "name": call["name"], "args": json.dumps(call["args"]), "index": index}
+                for index, call in enumerate(message.tool_calls)
+            ]))
+            finish_reason = "tool_calls"
+        else:
+            for index, token in enumerate(message.content.split()):
+                await asyncio.sleep(self.token_latency)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token if index == 0 else " " + token))
+            finish_reason = "stop"
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", response_metadata={"finish_reason": finish_reason}))
+
+
+class FakeAgentState(TypedDict):
+    messages: Annotated[list, add_messages]
+    tool_search_client: Any
+
+
+def build_agent(tool_search_client: FakeToolSearchClient):
+    """
+    Same contract as create_tool_selection_agent: returns (compiled graph, initial state).
+    """
+    model = cached_model(scheduled_model(FakeChatModel(
+        llm_latency=fake_config.llm_latency,
+        token_latency=fake_config.token_latency,
+        response_tokens=fake_config.response_tokens,
+        tool_calls=fake_config.tool_calls,
+        max_concurrency=fake_config.llm_max_concurrency,
+    )))
+    tool_output = "x" * fake_config.tool_output_bytes
+
+    async def agent(state: FakeAgentState, config: RunnableConfig) -> Dict[str, Any]:
+        if _is_user_turn(state["messages"]):
+            await state["tool_search_client"].search(state["messages"][-1].content)
+        return {"messages": [await model.bind_tools([]).ainvoke(state["messages"], config)]}
+
+    async def tools(state: FakeAgentState) -> Dict[str, Any]:
+        client = state["tool_search_client"]
+        missing = [service for service in fake_config.oauth_service.split(",") if service and not client.is_authorized(service)]
+        if missing:
+            # One interrupt per node: each missing service is asked for on its own resume
+            raise NodeInterrupt(oauth_required(missing[0]))
+        results = []
+        for call in state["messages"][-1].tool_calls:
+            await asyncio.sleep(fake_config.tool_latency)
+            results.append(ToolMessage(content=tool_output, tool_call_id=call["id"], name=call["name"]))
+        return {"messages": results}
+
+    def route(state: FakeAgentState) -> str:
+        last = state["messages"][-1]
+        return "tools" if isinstance(last, AIMessage) and last.tool_calls else END
+
+    graph = StateGraph(FakeAgentState)
+    graph.add_node("agent", agent)
+    graph.add_node("tools", tools)
+    graph.add_edge(START, "agent")
+    graph.add_conditional_edges("agent", route, ["tools", END])
+    graph.add_edge("tools", "agent")
+    return graph.compile(checkpointer=MemorySaver()), {"messages": [], "tool_search_client": tool_search_client}
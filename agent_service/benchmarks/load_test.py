@@ -0,0 +1,344 @@
+"""
+Offline load test of the agent service over its WebSocket API.
+
+Starts main:app under uvicorn in a child process with the fake LLM, tool search
+client and graph from benchmarks.fake_agent, then drives --sessions concurrent
+headless cli_chat_app clients through --turns turns each, including the OAuth
+interrupt/webhook round trip when --oauth-service is set. No OpenAI or tool
+search quota is used.
+
+    cd agent_service
+    python -m benchmarks.load_test --sessions 50 --turns 5 --output results.json
+
+Reports throughput, turn latency and time-to-first-byte percentiles, server RSS
+per active thread and the server's event-loop lag as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import msgpack
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from cli_chat_app import ChatClient  # noqa: E402
+
+
+class HeadlessChatClient(ChatClient):
+    """
+    ChatClient that renders nothing and records per-turn timings. The OAuth
+    consent step is played by the fake auth service, so the client only waits
+    for end_oauth_flow and, unless the server resumes by itself, resumes like
+    the interactive one does.
+    """
+
+    def __init__(self, ws_url: str, stream: bool, protocol_query: str, compress: bool = True):
+        super().__init__()
+        self.ws_url = ws_url
+        self.stream = stream
+        self.protocol_query = protocol_query
+        self.compress = compress
+        # Payload bytes after permessage-deflate is undone, i.e. what gets decoded
+        self.bytes_received = 0
+        self.turn_done = asyncio.Event()
+        # Runs sent on this turn whose final response hasn't arrived yet
+        self.pending_runs = 0
+        self.first_frame_at: Optional[float] = None
+        self.latencies: List[float] = []
+        self.ttfbs: List[float] = []
+        self.oauth_flows = 0
+        self.errors: List[str] = []
+
+    async def handle_event(self, websocket, message):
+        if self.first_frame_at is None:
+            self.first_frame_at = time.perf_counter()
+        self.bytes_received += len(message)
+        data = msgpack.unpackb(message) if isinstance(message, bytes) else json.loads(message)
+        event = data.get("event")
+        event_data = data.get("data", {})
+
+        if event == "start_oauth_flow":
+            self.in_oauth_flow = True
+            self.oauth_flows += 1
+        elif event == "end_oauth_flow":
+            if not event_data.get("pending_services"):
+                self.in_oauth_flow = False
+                self.pending_runs += 1
+                if not event_data.get("auto_resume"):
+                    await websocket.send(json.dumps({
+                        "event": "resume_execution",
+                        "data": event_data.get("data", {}),
+                        "stream": self.stream,
+                    }))
+        elif event in ("error", "busy", "cancelled"):
+            self.errors.append(f"{event}: {event_data.get('error', '')}".strip())
+            self.in_oauth_flow = False
+            self.pending_runs = 0
+        elif event in ("agent_delta", "cancel", "interrupt", "pong", "hello"):
+            pass
+        else:
+            self.pending_runs -= 1
+            if event == "agent_response":
+                await websocket.send(json.dumps({"event": "ack", "data": {"seq": data["seq"]}}))
+
+        if self.pending_runs <= 0 and not self.in_oauth_flow:
+            self.turn_done.set()
+
+    async def run_session(self, turns: int, think_time: float, turn_timeout: float, hold: asyncio.Event, finished: "asyncio.Queue[None]"):
+        uri = f"{self.ws_url}{self.thread_id}?{self.protocol_query}"
+        async with websockets.connect(uri, max_size=None, compression="deflate" if self.compress else None) as websocket:
+            listen_task = asyncio.create_task(self.listen_messages(websocket))
+            try:
+                for turn in range(turns):
+                    self.turn_done.clear()
+                    self.first_frame_at = None
+                    self.pending_runs = 1
+                    started = time.perf_counter()
+                    await self.send_message(websocket, f"Benchmark turn {turn}: look something up for me")
+                    try:
+                        await asyncio.wait_for(self.turn_done.wait(), turn_timeout)
+                    except asyncio.TimeoutError:
+                        self.errors.append(f"timeout after {turn_timeout}s")
+                        break
+                    self.latencies.append(time.perf_counter() - started)
+                    if self.first_frame_at is not None:
+                        self.ttfbs.append(self.first_frame_at - started)
+                    await asyncio.sleep(think_time)
+            finally:
+                finished.put_nowait(None)
+                # Keep the thread active until every session is done so RSS covers all of them
+                await hold.wait()
+                listen_task.cancel()
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    ordered = sorted(values)
+    return {
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[max(int(len(ordered) * 0.95) - 1, 0)] * 1000,
+        "p99_ms": ordered[max(int(len(ordered) * 0.99) - 1, 0)] * 1000,
+    }
+
+
+def read_rss_kb(pid: int) -> Dict[str, int]:
+    """VmRSS and VmHWM (peak) of pid from /proc, in kB. Empty where /proc isn't available."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+def http_get(url: str) -> str:
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.read().decode()
+
+
+def scrape_gauges(metrics_text: str, prefix: str) -> Dict[str, float]:
+    gauges = {}
+    for line in metrics_text.splitlines():
+        if line.startswith(prefix) and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            gauges[name[len(prefix):].lstrip("_")] = float(value)
+    return gauges
+
+
+async def wait_until_healthy(base_url: str, server: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            await asyncio.to_thread(http_get, f"{base_url}/health")
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server not healthy after {timeout}s")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_load(args) -> Dict[str, Any]:
+    port = args.port or free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "AGENT_FACTORY": "benchmarks.fake_agent:build_agent",
+        "TOOL_SEARCH_CLIENT_FACTORY": "benchmarks.fake_agent:FakeToolSearchClient",
+        "SERVER_URL": base_url,
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_TOKEN_LATENCY": str(args.token_latency),
+        "FAKE_RESPONSE_TOKENS": str(args.response_tokens),
+        "FAKE_TOOL_CALLS": str(args.tool_calls),
+        "FAKE_TOOL_LATENCY": str(args.tool_latency),
+        "FAKE_TOOL_OUTPUT_BYTES": str(args.tool_output_bytes),
+        "FAKE_SEARCH_LATENCY": str(args.search_latency),
+        "FAKE_OAUTH_SERVICE": args.oauth_service,
+        "FAKE_OAUTH_LATENCY": str(args.oauth_latency),
+        "FAKE_LLM_MAX_CONCURRENCY": str(args.llm_max_concurrency),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.load_test", "--serve", "--port", str(port)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+    )
+    try:
+        await wait_until_healthy(base_url, server)
+        rss_baseline = read_rss_kb(server.pid)
+
+        protocol_query = f"protocol={args.protocol}&encoding={args.encoding}&tool_output={args.tool_output}"
+        clients = [
+            HeadlessChatClient(f"ws://127.0.0.1:{port}/ws/", args.stream, protocol_query, args.deflate)
+            for _ in range(args.sessions)
+        ]
+        hold = asyncio.Event()
+        finished: asyncio.Queue = asyncio.Queue()
+
+        async def start(index: int, client: HeadlessChatClient):
+            if args.ramp:
+                await asyncio.sleep(args.ramp * index / args.sessions)
+            await client.run_session(args.turns, args.think_time, args.turn_timeout, hold, finished)
+
+        started = time.perf_counter()
+        sessions = asyncio.gather(*(start(i, c) for i, c in enumerate(clients)), return_exceptions=True)
+        for _ in clients:
+            await finished.get()
+        duration = time.perf_counter() - started
+
+        rss_loaded = read_rss_kb(server.pid)
+        metrics_text = await asyncio.to_thread(http_get, f"{base_url}/metrics")
+        hold.set()
+        failures = [repr(result) for result in await sessions if isinstance(result, BaseException)]
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    latencies = [latency for client in clients for latency in client.latencies]
+    errors = [error for client in clients for error in client.errors] + failures
+    per_thread_kb = None
+    if "VmRSS" in rss_baseline and "VmRSS" in rss_loaded:
+        per_thread_kb = (rss_loaded["VmRSS"] - rss_baseline["VmRSS"]) / max(args.sessions, 1)
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "serve")},
+        "sessions": args.sessions,
+        "turns_completed": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:10],
+        "oauth_flows": sum(client.oauth_flows for client in clients),
+        "bytes_received_per_turn": sum(client.bytes_received for client in clients) / max(len(latencies), 1),
+        "duration_s": duration,
+        "throughput_turns_per_s": len(latencies) / duration if duration else 0.0,
+        "turn_latency": percentiles(latencies),
+        "ttfb": percentiles([ttfb for client in clients for ttfb in client.ttfbs]),
+        "rss": {
+            "baseline_kb": rss_baseline.get("VmRSS"),
+            "loaded_kb": rss_loaded.get("VmRSS"),
+            "peak_kb": rss_loaded.get("VmHWM"),
+            "per_thread_kb": per_thread_kb,
+        },
+        "event_loop_lag": scrape_gauges(metrics_text, "bench_event_loop_lag"),
+        "llm_scheduler": scrape_gauges(metrics_text, "llm_scheduler"),
+    }
+
+
+async def sample_loop_lag(samples: deque, interval: float):
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(time.perf_counter() - expected, 0.0))
+
+
+async def serve(port: int, lag_interval: float):
+    import uvicorn
+
+    import main
+
+    samples: deque = deque(maxlen=100_000)
+
+    def loop_lag_stats() -> Dict[str, float]:
+        values = sorted(samples)
+        if not values:
+            return {}
+        return {
+            "mean_ms": statistics.fmean(values) * 1000,
+            "p99_ms": values[max(int(len(values) * 0.99) - 1, 0)] * 1000,
+            "max_ms": values[-1] * 1000,
+            "samples": len(values),
+        }
+
+    main.registry.register_stats("bench_event_loop_lag", loop_lag_stats)
+    sampler = asyncio.create_task(sample_loop_lag(samples, lag_interval))
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    try:
+        await server.serve()
+    finally:
+        sampler.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent WebSocket sessions (one thread each)")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Pause between a session's turns, seconds")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Spread session starts over this many seconds")
+    parser.add_argument("--turn-timeout", type=float, default=120.0)
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="Don't ask for agent_delta frames")
+    parser.add_argument("--protocol", type=int, default=1, choices=(1, 2))
+    parser.add_argument("--encoding", default="json", choices=("json", "msgpack"), help="Protocol 2 frame encoding")
+    parser.add_argument("--tool-output", default="truncate", choices=("full", "truncate", "omit"), help="Protocol 2 tool output mode")
+    parser.add_argument("--no-deflate", dest="deflate", action="store_false", help="Don't offer permessage-deflate")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake model time to first token, seconds")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Fake model time per streamed token, seconds")
+    parser.add_argument("--response-tokens", type=int, default=40)
+    parser.add_argument("--tool-calls", type=int, default=1, help="Tool calls the fake model makes per turn")
+    parser.add_argument("--tool-latency", type=float, default=0.05)
+    parser.add_argument("--tool-output-bytes", type=int, default=2048)
+    parser.add_argument("--search-latency", type=float, default=0.05)
+    parser.add_argument("--oauth-service", default="", help="Comma-separated APIService values whose tools need OAuth; empty disables the flow")
+    parser.add_argument("--oauth-latency", type=float, default=0.1, help="Delay before the fake auth service calls the webhook")
+    parser.add_argument("--llm-max-concurrency", type=int, default=0, help="Fake provider answers calls beyond this many in flight with 429; 0 never does")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--lag-interval", type=float, default=0.01, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(args.port, args.lag_interval))
+        return
+
+    results = asyncio.run(run_load(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
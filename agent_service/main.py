@@ -1,26 +1,64 @@
-from utils.ConnectionManager import ConnectionManager
-from agent import get_agent
-
-from typing import Any, Dict, List, Optional, Tuple
+from utils.ConnectionManager import ConnectionManager, SlowConsumerPolicy
+from utils.AgentPool import AgentPool
+from utils.RunScheduler import QueueFullError, RunScheduler
+from utils.WorkerCluster import WorkerCluster
+from utils.Logging import configure_logging
+from utils.Metrics import CONTENT_TYPE, registry, span
+from utils.SpanCallbackHandler import SpanCallbackHandler
+from utils.MessageOutbox import MessageOutbox
+from utils.WireProtocol import ProtocolOptions, response_frame
+from utils.WarmPool import WarmPool
+from utils.Offload import LoopLagMonitor, Offloader
+from utils.AdmissionController import AdmissionController, OverloadedError
+from agent import close_shared_agent, get_agent, get_shared_agent, history_compactor, llm_response_cache, llm_scheduler, tool_search_cache
+
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 from urllib.parse import urljoin
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from enum import Enum
+import asyncio
 import json
+import logging
+import math
 import os
+import time
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from langchain_core.messages import BaseMessage, ChatMessage
-from langgraph.graph.graph import CompiledGraph
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ChatMessage, ToolMessage
 
 
-from wildcard_core import ToolSearchClient
 from wildcard_core.auth.oauth_helper import OAuthCredentialsRequiredInfo
 from wildcard_core.events.types import WebhookOAuthCompletion, WebhookRequest, WildcardEvent, OAuthCompletionData
-from wildcard_core.tool_search.utils.api_service import APIService
-from wildcard_langgraph import DynamicToolSelectState
 
-app = FastAPI()
+if TYPE_CHECKING:
+    # Annotations only; the graph libraries are loaded when the warm pool builds the agent
+    from langgraph.graph.graph import CompiledGraph
+    from wildcard_core import ToolSearchClient
+    from wildcard_langgraph import DynamicToolSelectState
+
+configure_logging(os.getenv("LOG_LEVEL", "INFO"), os.getenv("LOG_FORMAT", "text"))
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_monitor.start()
+    await cluster.start()
+    warm_pool.start()
+    try:
+        yield
+    finally:
+        await warm_pool.stop()
+        await run_scheduler.shutdown()
+        await cluster.stop()
+        # Durable checkpointers buffer writes; make sure the last batch reaches disk
+        await asyncio.to_thread(close_shared_agent)
+        offloader.shutdown()
+        await loop_monitor.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -32,10 +70,103 @@ app.add_middleware(
 )
 
 # Thread ID -> (agent, initial_state, tool_search_client)
-agentMap: Dict[str, Tuple[CompiledGraph, DynamicToolSelectState, ToolSearchClient]] = {} 
+# The compiled agent is shared by every thread; the pool only bounds the per-thread part.
+agentPool: "AgentPool[Tuple[CompiledGraph, DynamicToolSelectState, ToolSearchClient]]" = AgentPool(
+    max_entries=int(os.getenv("AGENT_POOL_MAX_ENTRIES", "1024")),
+    idle_ttl=float(os.getenv("AGENT_POOL_IDLE_TTL", "3600")) or None,
+    max_bytes=int(os.getenv("AGENT_POOL_MAX_BYTES", "0")) or None,
+    on_evict=lambda thread_id, _: on_agent_evicted(thread_id),
+)
+
+# Entries built ahead of a thread's first message; the first build also compiles the shared graph
+warm_pool = WarmPool(
+    factory=get_agent,
+    size=int(os.getenv("AGENT_WARM_POOL_SIZE", "4")),
+    warmup=get_shared_agent,
+)
+
+# Which uvicorn worker owns which thread_id, and the bus used to reach the owner.
+# Defaults to a single local worker; WORKER_REGISTRY=sqlite shares it across workers.
+cluster = WorkerCluster.from_env()
 
 # Initialize ConnectionManager
-manager = ConnectionManager()
+manager = ConnectionManager(
+    max_queue=int(os.getenv("WS_OUTBOUND_QUEUE", "256")),
+    send_timeout=float(os.getenv("WS_SEND_TIMEOUT", "10")),
+    # drop_oldest, drop_newest, disconnect or coalesce (see coalesce_deltas)
+    policy=os.getenv("WS_SLOW_CONSUMER_POLICY", SlowConsumerPolicy.DROP_OLDEST.value),
+)
+
+# Synchronous work in request handling (SDK callbacks, agent construction, encoding whole
+# responses) runs on this pool instead of the event loop
+offloader = Offloader(
+    max_workers=int(os.getenv("OFFLOAD_MAX_WORKERS", "8")),
+    max_pending=int(os.getenv("OFFLOAD_MAX_PENDING", "256")),
+)
+manager.offload = offloader.run
+
+# Reports the event loop's lag and logs the stack of whatever blocks it past the threshold
+loop_monitor = LoopLagMonitor(
+    interval=float(os.getenv("LOOP_LAG_INTERVAL", "0.1")),
+    stall_threshold=float(os.getenv("LOOP_STALL_THRESHOLD", "0.5")),
+)
+
+# Frames for threads owned here are relayed to other workers holding their sockets, and vice versa
+manager.relay = cluster.relay
+cluster.deliver_local = manager.deliver
+
+# Per-thread seq numbers of messages sent to clients; protocol 2 responses only carry new ones
+outbox = MessageOutbox(max_entries=int(os.getenv("OUTBOX_MAX_MESSAGES", "256")))
+TOOL_OUTPUT_LIMIT = int(os.getenv("TOOL_OUTPUT_LIMIT", "512"))
+
+# Resume an interrupted run as soon as the OAuth webhooks of all its services arrived,
+# instead of waiting for the client to send resume_execution
+AUTO_RESUME_AFTER_OAUTH = os.getenv("AUTO_RESUME_AFTER_OAUTH", "1") != "0"
+# thread_id -> {"services": services still waiting for their webhook, "stream": stream flag of the run}
+pending_oauth: Dict[str, Dict[str, Any]] = {}
+
+def on_agent_evicted(thread_id: str):
+    cluster.release(thread_id)
+    outbox.drop(thread_id)
+    pending_oauth.pop(thread_id, None)
+    admission.drop(thread_id)
+    if llm_response_cache is not None:
+        llm_response_cache.drop(thread_id)
+
+# Runs of one thread_id execute one at a time, in arrival order
+run_scheduler = RunScheduler(max_queue_depth=int(os.getenv("RUN_QUEUE_DEPTH", "8")))
+
+# Across threads: at most MAX_IN_FLIGHT_RUNS runs at once (0 disables), the rest wait up to
+# RUN_QUEUE_TIMEOUT seconds in a queue of RUN_ADMISSION_QUEUE before being shed as "busy".
+# THREAD_MESSAGES_PER_MINUTE (0 disables) limits new messages per thread.
+admission = AdmissionController(
+    max_in_flight=int(os.getenv("MAX_IN_FLIGHT_RUNS", "64")),
+    max_queue=int(os.getenv("RUN_ADMISSION_QUEUE", "256")),
+    queue_timeout=float(os.getenv("RUN_QUEUE_TIMEOUT", "30")),
+    messages_per_minute=float(os.getenv("THREAD_MESSAGES_PER_MINUTE", "60")),
+    message_burst=float(os.getenv("THREAD_MESSAGE_BURST", "10")) or None,
+)
+
+# Times tool and model calls inside runs; node timings come from the "updates" stream
+span_callbacks = SpanCallbackHandler()
+node_seconds = registry.histogram("agent_node_seconds", "Latency of graph node executions.", ["node"])
+
+registry.register_stats("agent_pool", lambda: agentPool.stats())
+registry.register_stats("ws", lambda: manager.metrics())
+registry.register_stats("run_scheduler", lambda: run_scheduler.stats())
+registry.register_stats("admission", lambda: admission.stats())
+registry.register_stats("cluster", lambda: cluster.stats())
+registry.register_stats("tool_search_cache", lambda: tool_search_cache.stats())
+registry.register_stats("outbox", lambda: outbox.stats())
+registry.register_stats("warm_pool", lambda: warm_pool.stats())
+registry.register_stats("offload", lambda: offloader.stats())
+registry.register_stats("event_loop", lambda: loop_monitor.stats())
+if llm_scheduler is not None:
+    registry.register_stats("llm_scheduler", lambda: llm_scheduler.stats())
+if history_compactor is not None:
+    registry.register_stats("history_compactor", lambda: history_compactor.stats())
+if llm_response_cache is not None:
+    registry.register_stats("llm_cache", lambda: llm_response_cache.stats())
 
 class RunAgentRequest(BaseModel):
     thread_id: str
@@ -46,15 +177,51 @@ class RunAgentResponse(BaseModel):
     messages: List[BaseMessage]
     wildcard_event: Optional[Dict[WildcardEvent, Any]]
 
-def register_new_agent(thread_id: str):
-    agent, initial_state, tool_search_client = get_agent()
-    agentMap[thread_id] = (agent, initial_state, tool_search_client)
+class RunBatchRequest(BaseModel):
+    requests: List[RunAgentRequest]
+    # At most this many of the batch's runs at once; RUN_BATCH_CONCURRENCY still caps the process
+    concurrency: Optional[int] = Field(default=None, ge=1)
+
+# HTTP runs wait for the result, so a forwarded one gets a longer bus timeout than control messages
+RUN_TIMEOUT = float(os.getenv("RUN_TIMEOUT", "600"))
+RUN_BATCH_CONCURRENCY = int(os.getenv("RUN_BATCH_CONCURRENCY", "16"))
+batch_semaphore = asyncio.Semaphore(RUN_BATCH_CONCURRENCY)
+
+# Incremental frames sent while a run is in progress when the client asks for "stream": true.
+# The regular RunAgentResponse is still sent once the run completes.
+AGENT_DELTA_EVENT = "agent_delta"
+
+class StreamDeltaType(str, Enum):
+    TOKEN = "token"
+    TOOL_CALL_START = "tool_call_start"
+    TOOL_CALL_END = "tool_call_end"
+    FINAL = "final"
+
+async def register_new_agent(thread_id: str):
+    # Built off the loop when the warm pool is empty (the first build also compiles the graph)
+    agent_info = await warm_pool.take_async(offloader.run)
+    if thread_id in agentPool:
+        # Registered by another request while this one was building
+        return agentPool.get(thread_id)
+    agentPool.put(thread_id, agent_info)
+    return agent_info
 
-def find_agent_info(thread_id: str, allow_register: bool = False):
-    agent_info = agentMap.get(thread_id, None)
+async def thread_owner(thread_id: str) -> str:
+    """
+    The worker that owns thread_id. A thread nobody owns yet is claimed by this worker.
+    """
+    owner = await cluster.resolve(thread_id)
+    if not cluster.is_local(owner) and thread_id in agentPool:
+        # Taken over by another worker: serving the local copy too would split the thread
+        logger.warning("Thread is owned by another worker, dropping local state", extra={"thread_id": thread_id, "owner": owner})
+        agentPool.pop(thread_id)
+        on_agent_evicted(thread_id)
+    return owner
+
+async def find_agent_info(thread_id: str, allow_register: bool = False):
+    agent_info = agentPool.get(thread_id)
     if agent_info is None and allow_register:
-        register_new_agent(thread_id)
-        agent_info = agentMap[thread_id]
+        agent_info = await register_new_agent(thread_id)
     elif agent_info is None:
         raise Exception(f"Agent info not found for thread_id: {thread_id}")
        
@@ -63,83 +230,101 @@ def find_agent_info(thread_id: str, allow_register: bool = False):
 async def process_agent_request(request: RunAgentRequest) -> RunAgentResponse:
     config = {"configurable": {"thread_id": request.thread_id}}
     resuming_interrupt = request.additional_params.get("resuming_interrupt", False)
+    stream = request.additional_params.get("stream", False)
     state = None
     
-    agent, initial_state, tool_search_client = find_agent_info(request.thread_id, allow_register=True)
+    agent, initial_state, tool_search_client = await find_agent_info(request.thread_id, allow_register=True)
 
-    print(f"TOOL SEARCH CLIENT:", tool_search_client)
+    # Snapshots can hold long histories: only stringify them when DEBUG is on
+    logger.debug("Tool search client: %s", tool_search_client)
 
-    state_snapshot = await agent.aget_state(config)
-    print(f"State snapshot:", state_snapshot)
+    with span("aget_state"):
+        state_snapshot = await agent.aget_state(config)
+    logger.debug("State snapshot: %s", state_snapshot)
 
     if "messages" not in state_snapshot.values:
-        print("No messages found in state snapshot. Using initial state.")
+        logger.debug("No messages found in state snapshot. Using initial state.")
         state = initial_state
-        print(f"AFTER UPDATING INITIAL STATE:", state)
     elif resuming_interrupt:
-        print("Resuming interrupt")
-        state_history = agent.aget_state_history(config)
-        all_states = [state async for state in state_history]
-        
-        print(f"All states:", all_states)
-        await agent.aupdate_state(config, {"tool_search_client": tool_search_client})
+        if not state_snapshot.next:
+            # Already resumed, e.g. by the webhook before an older client sent resume_execution
+            return RunAgentResponse.model_construct(messages=[], wildcard_event=None)
+        # The snapshot above is the latest checkpoint, which is all a resume needs
+        logger.info("Resuming interrupt", extra={"thread_id": request.thread_id})
+        with span("aupdate_state"):
+            await agent.aupdate_state(config, {"tool_search_client": tool_search_client})
         state = None
         
     else:
-        state = {**state_snapshot.values}
+        # Durable checkpointers don't store the client (it carries OAuth credentials)
+        state = {**state_snapshot.values, "tool_search_client": tool_search_client}
+        if history_compactor is not None:
+            await compact_history(agent, config, state["messages"])
 
-    print(f"State BEFORE stream:", state)
+    logger.debug("State before stream: %s", state)
 
     async def run_agent(next_state_payload, _state, _config):
-        print("RUN AGENT - CONFIG", _config)
+        logger.debug("Run agent config: %s", _config)
 
         async def stream_agent_messages(_next_state_payload, _state, _config):
             messages = []
-            async for s in agent.astream(_next_state_payload, _config, stream_mode="values"):
-                msg = dict(s).get("messages", [])
-                if msg:
-                    messages.append(msg[-1])
-                    msg[-1].pretty_print()
-
-            response_state = await agent.aget_state(_config)
+            # "values" gives the per-step state used to build the final response, "updates"
+            # marks node boundaries for timing, and when streaming "messages" yields LLM
+            # token chunks and tool results as they are produced.
+            stream_modes = ["values", "updates", "messages"] if stream else ["values", "updates"]
+            # thread_id (from configurable) and llm_priority reach the LLM scheduler as run metadata
+            run_config = {
+                **_config,
+                "callbacks": [span_callbacks],
+                "metadata": {
+                    "llm_priority": int(request.additional_params.get("priority", 0)),
+                    # "use", "refresh" or "bypass" for this run only; unset follows the thread's mode
+                    "llm_cache": request.additional_params.get("llm_cache"),
+                },
+            }
+            step_started = time.perf_counter()
+            with span("astream"):
+                async for mode, chunk in agent.astream(_next_state_payload, run_config, stream_mode=stream_modes):
+                    if mode == "messages":
+                        await send_stream_delta(request.thread_id, *chunk)
+                        continue
+                    if mode == "updates":
+                        now = time.perf_counter()
+                        for node in chunk:
+                            if not node.startswith("__"):
+                                node_seconds.observe(now - step_started, node=node)
+                        step_started = now
+                        continue
+                    msg = dict(chunk).get("messages", [])
+                    if msg:
+                        messages.append(msg[-1])
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("%s", msg[-1].pretty_repr())
+
+            with span("aget_state"):
+                response_state = await agent.aget_state(_config)
             return messages, response_state
 
         _new_messages, _response_state = await stream_agent_messages(next_state_payload, _state, _config)
 
-        # Handle interrupts
+        # Handle interrupts: every service the paused tasks need, one flow each
+        oauth_required: Dict[str, OAuthCredentialsRequiredInfo] = {}
         for task in _response_state.tasks:
-            if not task.interrupts:
-                continue
             for interrupt in task.interrupts:
-                if isinstance(interrupt.value, OAuthCredentialsRequiredInfo):
-                    print("Initiating OAuth flow for", interrupt.value)
-                    authorization_url = await tool_search_client.initiate_oauth(
-                        flows=interrupt.value.flows,
-                        api_service=interrupt.value.api_service,
-                        required_scopes=interrupt.value.required_scopes,
-                        webhook_url=join_url_parts(
-                            settings.serverUrl,
-                            app.url_path_for("agent_webhook", thread_id=request.thread_id)
-                        )
-                    )
-
-                    await manager.send_message(
-                        request.thread_id,
-                        json.dumps({
-                            "event": WildcardEvent.START_OAUTH_FLOW,
-                            "data": {
-                                "flow_type": "authorizationCode",
-                                "authorization_url": authorization_url,
-                            }
-                        })
-                    )
-
-                    return RunAgentResponse(
-                        messages=_new_messages,
-                        wildcard_event=None
-                    )
-
-        return RunAgentResponse(
+                # The parallel tool node raises the interrupts of all its calls as one list
+                for value in interrupt.value if isinstance(interrupt.value, list) else [interrupt.value]:
+                    if isinstance(value, OAuthCredentialsRequiredInfo):
+                        oauth_required.setdefault(service_key(value.api_service), value)
+        if oauth_required:
+            oauth_flows = await start_oauth_flows(request.thread_id, tool_search_client, oauth_required, stream)
+            # Also in the response, for HTTP callers that have no socket to receive the events
+            return RunAgentResponse.model_construct(
+                messages=_new_messages,
+                wildcard_event={WildcardEvent.START_OAUTH_FLOW: {**oauth_flows[0], "flows": oauth_flows}}
+            )
+
+        # The messages come straight from the graph state; re-validating them is pure overhead
+        return RunAgentResponse.model_construct(
             messages=_new_messages,
             wildcard_event=None
         )
@@ -149,47 +334,316 @@ async def process_agent_request(request: RunAgentRequest) -> RunAgentResponse:
 
     return await run_agent(final_payload, state, config)
 
+def service_key(api_service: Any) -> str:
+    return str(getattr(api_service, "value", api_service))
+
+async def start_oauth_flows(
+    thread_id: str,
+    tool_search_client: "ToolSearchClient",
+    oauth_required: Dict[str, OAuthCredentialsRequiredInfo],
+    stream: bool,
+) -> List[Dict[str, Any]]:
+    """
+    Start the OAuth flows of all services concurrently and send a START_OAUTH_FLOW
+    event for each. With auto-resume the thread is resumed once all of them completed.
+    """
+    webhook_url = join_url_parts(settings.serverUrl, app.url_path_for("agent_webhook", thread_id=thread_id))
+    if AUTO_RESUME_AFTER_OAUTH:
+        # Recorded first: a fast webhook may arrive before every flow has been started
+        pending_oauth[thread_id] = {"services": set(oauth_required), "stream": stream}
+    logger.info("Initiating OAuth flows", extra={"thread_id": thread_id, "api_services": list(oauth_required)})
+    try:
+        with span("initiate_oauth", flows=len(oauth_required)):
+            authorization_urls = await asyncio.gather(*(
+                tool_search_client.initiate_oauth(
+                    flows=info.flows,
+                    api_service=info.api_service,
+                    required_scopes=info.required_scopes,
+                    webhook_url=webhook_url,
+                )
+                for info in oauth_required.values()
+            ))
+    except BaseException:
+        pending_oauth.pop(thread_id, None)
+        raise
+
+    oauth_flows = []
+    for api_service, authorization_url in zip(oauth_required, authorization_urls):
+        oauth_flow = {
+            "flow_type": "authorizationCode",
+            "authorization_url": authorization_url,
+            "api_service": api_service,
+        }
+        await manager.send_message(thread_id, json.dumps({"event": WildcardEvent.START_OAUTH_FLOW, "data": oauth_flow}))
+        oauth_flows.append(oauth_flow)
+    return oauth_flows
+
+async def compact_history(agent: "CompiledGraph", config: Dict[str, Any], messages: List[BaseMessage]):
+    """
+    Write the compacted history to the checkpoint before the run, so the model sees it
+    and later turns start from it instead of compacting the same messages again.
+    """
+    with span("compact_history"):
+        updates = await history_compactor.compact(messages)
+        if updates:
+            await agent.aupdate_state(config, {"messages": updates})
+
+async def send_stream_delta(thread_id: str, message: BaseMessage, metadata: Dict[str, Any]):
+    """
+    Push one incremental frame for a chunk produced by stream_mode="messages".
+    """
+    node = metadata.get("langgraph_node")
+    if isinstance(message, AIMessageChunk):
+        for tool_call in message.tool_call_chunks:
+            # Only the first chunk of a tool call carries its name.
+            if tool_call.get("name"):
+                await send_delta(thread_id, StreamDeltaType.TOOL_CALL_START, {
+                    "message_id": message.id,
+                    "tool_call_id": tool_call.get("id"),
+                    "name": tool_call["name"],
+                    "node": node,
+                })
+        if isinstance(message.content, str) and message.content:
+            await send_delta(thread_id, StreamDeltaType.TOKEN, {
+                "message_id": message.id,
+                "content": message.content,
+                "node": node,
+            })
+        if message.response_metadata.get("finish_reason"):
+            await send_delta(thread_id, StreamDeltaType.FINAL, {
+                "message_id": message.id,
+                "finish_reason": message.response_metadata["finish_reason"],
+                "node": node,
+            })
+    elif isinstance(message, ToolMessage):
+        await send_delta(thread_id, StreamDeltaType.TOOL_CALL_END, {
+            "message_id": message.id,
+            "tool_call_id": message.tool_call_id,
+            "name": message.name,
+            "status": message.status,
+            "node": node,
+        })
+
+def coalesce_deltas(older: Any, newer: Any) -> Optional[Dict[str, Any]]:
+    """
+    With WS_SLOW_CONSUMER_POLICY=coalesce, token deltas of one message queued for
+    a client that is behind are sent as one delta with their content joined.
+    """
+    if not (isinstance(older, dict) and isinstance(newer, dict)):
+        return None
+    if older.get("event") != AGENT_DELTA_EVENT or newer.get("event") != AGENT_DELTA_EVENT:
+        return None
+    queued, incoming = older["data"], newer["data"]
+    if queued["type"] != StreamDeltaType.TOKEN.value or incoming["type"] != StreamDeltaType.TOKEN.value:
+        return None
+    if queued["message_id"] != incoming["message_id"]:
+        return None
+    # A new dict: the queued frame may be shared with the thread's other sockets
+    return {**older, "data": {**queued, "content": queued["content"] + incoming["content"]}}
+
+manager.coalesce = coalesce_deltas
+
+async def send_delta(thread_id: str, delta_type: StreamDeltaType, data: Dict[str, Any]):
+    # Deltas are advisory (the final response carries the full messages), so they may be
+    # shed for a client that can't keep up
+    await manager.send_message_json(thread_id, {
+        "event": AGENT_DELTA_EVENT,
+        "data": {"type": delta_type.value, **data},
+    }, droppable=True)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
 @app.get("/health")
 async def health():
-    return JSONResponse({"message": "Agent service is healthy."})
+    return JSONResponse({
+        "message": "Agent service is healthy.",
+        "agent_pool": agentPool.stats(),
+        "connections": manager.metrics(),
+        "cluster": cluster.stats(),
+        "tool_search_cache": tool_search_cache.stats(),
+        "outbox": outbox.stats(),
+        "warm_pool": warm_pool.stats(),
+        "offload": offloader.stats(),
+        "run_scheduler": run_scheduler.stats(),
+        "admission": admission.stats(),
+        "event_loop": {**loop_monitor.stats(), "recent_stalls": loop_monitor.recent_stalls()},
+        "llm_scheduler": llm_scheduler.stats() if llm_scheduler is not None else None,
+        "llm_cache": llm_response_cache.stats() if llm_response_cache is not None else None,
+    })
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 503 until the shared agent is built and the warm pool has been filled.
+    """
+    return JSONResponse({"ready": warm_pool.ready, **warm_pool.stats()}, status_code=200 if warm_pool.ready else 503)
+
+@app.post("/run")
+async def run(request: RunAgentRequest):
+    """
+    Run the agent on one request and return its RunAgentResponse.
+    """
+    return JSONResponse(await run_agent_request(request))
+
+@app.post("/run/batch")
+async def run_batch(batch: RunBatchRequest):
+    """
+    Run many requests concurrently and stream one NDJSON line per request as it
+    finishes: {"index", "thread_id", "status": "ok", "response"} or
+    {"index", "thread_id", "status": "error", "status_code", "error"}.
+    """
+    return StreamingResponse(stream_batch_results(batch), media_type="application/x-ndjson")
+
+async def stream_batch_results(batch: RunBatchRequest):
+    results: asyncio.Queue = asyncio.Queue()
+    pending = iter(enumerate(batch.requests))
+
+    async def worker():
+        for index, run_request in pending:
+            async with batch_semaphore:
+                results.put_nowait(await run_batch_item(index, run_request))
+
+    concurrency = min(batch.concurrency or RUN_BATCH_CONCURRENCY, len(batch.requests))
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for _ in batch.requests:
+            yield await offloader.run(json.dumps, await results.get()) + "\n"
+    finally:
+        # The client went away: runs already started finish in the scheduler, nothing new starts
+        for task in workers:
+            task.cancel()
+
+async def run_batch_item(index: int, run_request: RunAgentRequest) -> Dict[str, Any]:
+    result = {"index": index, "thread_id": run_request.thread_id}
+    try:
+        return {**result, "status": "ok", "response": await run_agent_request(run_request)}
+    except HTTPException as e:
+        retry_after = (e.headers or {}).get("Retry-After")
+        return {**result, "status": "error", "status_code": e.status_code, "error": e.detail,
+                **({"retry_after": int(retry_after)} if retry_after else {})}
+    except Exception as e:
+        logger.exception("Batch run failed", extra={"thread_id": run_request.thread_id})
+        return {**result, "status": "error", "status_code": 500, "error": str(e)}
+
+async def run_agent_request(run_request: RunAgentRequest) -> Dict[str, Any]:
+    """
+    Run to completion on the owning worker and return the response as JSON-ready data.
+    HTTP runs share the per-thread scheduler with WebSocket runs, so a thread still
+    runs one request at a time.
+    """
+    thread_id = run_request.thread_id
+    owner = await thread_owner(thread_id)
+    if not cluster.is_local(owner):
+        result = await cluster.forward(owner, "run_sync", thread_id, timeout=RUN_TIMEOUT, request=run_request.model_dump(mode="json"))
+        if "error" in result:
+            raise HTTPException(status_code=result.get("status_code", 502), detail=result["error"], headers=result.get("headers"))
+        return result["response"]
+    try:
+        admission.check(thread_id, new_message=not is_resume(run_request))
+        future = run_scheduler.submit(thread_id, lambda: admitted_run(run_request))
+        response = await future
+    except QueueFullError as e:
+        if not is_resume(run_request):
+            admission.refund(thread_id)
+        raise too_many_requests(str(e), admission.retry_after())
+    except OverloadedError as e:
+        raise too_many_requests(str(e), e.retry_after)
+    return await offloader.run(response.model_dump, mode="json")
+
+async def on_forwarded_run_sync(message: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return {"response": await run_agent_request(RunAgentRequest(**message["request"]))}
+    except HTTPException as e:
+        return {"error": e.detail, "status_code": e.status_code, "headers": e.headers}
+    except Exception as e:
+        return {"error": str(e), "status_code": 500}
+
+cluster.on("run_sync", on_forwarded_run_sync)
+
+def too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(math.ceil(retry_after))})
 
 @app.post("/webhook/{thread_id}")
 async def agent_webhook(request: WebhookRequest[Any], thread_id: str):
     """
     Handle webhook callbacks from the auth_service.
     """
-    _, _, tool_search_client = find_agent_info(thread_id)
-    print(f"CALLBACK REQUEST: {request}")
+    owner = await thread_owner(thread_id)
+    if not cluster.is_local(owner):
+        # The OAuth callback reached a worker that doesn't hold this thread's client
+        result = await cluster.forward(owner, "webhook", thread_id, payload=request.model_dump(mode="json"))
+        if "error" in result:
+            raise HTTPException(status_code=result.get("status_code", 502), detail=result["error"])
+        return result
+    return await handle_agent_webhook(request, thread_id)
+
+async def handle_agent_webhook(request: WebhookRequest[Any], thread_id: str):
+    _, _, tool_search_client = await find_agent_info(thread_id)
+    logger.info("Webhook callback", extra={"thread_id": thread_id, "webhook_event": str(request.event)})
     if request.event == WildcardEvent.END_OAUTH_FLOW:
         oauth_completion = WebhookOAuthCompletion(
             event=request.event,
             data=OAuthCompletionData(**request.data)
         )
-        tool_search_client.handle_webhook_callback(oauth_completion.data)
-
-        print("UPDATED CLIENT:", tool_search_client)
-
-        # Notify the client via WebSocket about the resume execution
-        if thread_id in manager.active_connections:
-            await manager.send_message(thread_id, json.dumps({
-                "event": WildcardEvent.END_OAUTH_FLOW,
-                "data": {
-                    "next_messages": [],
-                    "additional_params": {"resuming_interrupt": True}
-                }
-            }))
-
-        return {"status": "success"}
+        await offloader.run(tool_search_client.handle_webhook_callback, oauth_completion.data)
+
+        logger.debug("Updated client: %s", tool_search_client)
+
+        pending = pending_oauth.get(thread_id)
+        if pending is not None:
+            pending["services"].discard(service_key(oauth_completion.data.api_service))
+        auto_resume = pending is not None and not pending["services"]
+
+        # Notify the client via WebSocket. Without auto_resume it resumes the run itself.
+        await manager.send_message(thread_id, json.dumps({
+            "event": WildcardEvent.END_OAUTH_FLOW,
+            "data": {
+                "next_messages": [],
+                "additional_params": {"resuming_interrupt": True},
+                "auto_resume": pending is not None,
+                "pending_services": sorted(pending["services"]) if pending is not None else [],
+            }
+        }))
+
+        if auto_resume:
+            del pending_oauth[thread_id]
+            # Runs in the background; the response reaches the sockets, or the outbox until a client reconnects
+            await schedule_agent_run(RunAgentRequest(
+                thread_id=thread_id,
+                next_messages=[],
+                additional_params={"resuming_interrupt": True, "stream": pending["stream"]},
+            ))
+
+        return {"status": "success", "resumed": auto_resume}
     else:
         raise HTTPException(status_code=400, detail=f"Unsupported event: {request.event}")
 
+async def on_forwarded_webhook(message: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return await handle_agent_webhook(WebhookRequest[Any](**message["payload"]), message["thread_id"])
+    except HTTPException as e:
+        return {"error": e.detail, "status_code": e.status_code}
+
+cluster.on("webhook", on_forwarded_webhook)
+
 @app.websocket("/ws/{thread_id}")
 async def websocket_endpoint(websocket: WebSocket, thread_id: str):
-    await manager.connect(thread_id, websocket)
+    # This coroutine is the connection's reader: runs are handed to the per-thread
+    # scheduler so pings, cancel and interrupt are handled while an agent run is in flight.
+    try:
+        options = ProtocolOptions.from_query(websocket.query_params, TOOL_OUTPUT_LIMIT)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+    connection = await manager.connect(thread_id, websocket, options)
     try:
+        if options.version >= 2:
+            await send_hello(connection, websocket.query_params.get("resume_from"))
         while True:
             data = await websocket.receive_json()
-            print(f"Received from {thread_id}: {data}")
+            logger.debug("Received from %s: %s", thread_id, data)
             try:
                 event = data.get("event", None)
                 if event is None:
@@ -203,22 +657,28 @@ async def websocket_endpoint(websocket: WebSocket, thread_id: str):
                     run_request = RunAgentRequest(
                         thread_id=thread_id,
                         next_messages=[{"role": "user", "content": user_message}],
-                        additional_params={}
+                        additional_params={"stream": bool(data.get("stream", False))}
                     )
-
-                    # Process the agent request and send back the response
-                    response = await process_agent_request(run_request)
-                    print(f"RESPONSE: {response}")
-                    await manager.send_message(thread_id, response.model_dump_json())
+                    await dispatch_agent_run(run_request)
                 elif event == "resume_execution":
                     run_request = RunAgentRequest(
                         thread_id=thread_id,
                         next_messages= data.get("data", {}).get("next_messages", []),
-                        additional_params={"resuming_interrupt": True}
+                        additional_params={"resuming_interrupt": True, "stream": bool(data.get("stream", False))}
                     )
-                    response = await process_agent_request(run_request)
-                    await manager.send_message(thread_id, response.model_dump_json())
-                
+                    await dispatch_agent_run(run_request)
+                elif event in ("cancel", "interrupt", "ping"):
+                    # cancel: stop the in-flight run and drop any queued messages for this thread
+                    # interrupt: stop only the in-flight run, queued messages still run
+                    result = await thread_control(thread_id, event)
+                    reply = "pong" if event == "ping" else event
+                    manager.deliver(thread_id, json.dumps({"event": reply, "data": result}))
+                elif event == "ack":
+                    await thread_control(thread_id, event, data.get("data", {}))
+                elif event == "llm_cache":
+                    # {"event": "llm_cache", "data": {"mode": "use" | "refresh" | "bypass"}}
+                    result = await thread_control(thread_id, event, data.get("data", {}))
+                    manager.deliver(thread_id, json.dumps({"event": event, "data": result}))
                 else:
                     raise HTTPException(status_code=400, detail=f"Unsupported event: {data['event']}")
                     
@@ -227,7 +687,150 @@ async def websocket_endpoint(websocket: WebSocket, thread_id: str):
             except Exception as e:
                 await manager.send_message(thread_id, json.dumps({"event": "error", "data": {"error": str(e)}}))
     except WebSocketDisconnect:
-        manager.disconnect(thread_id)
+        pass
+    finally:
+        # Only this socket: other connections on the same thread_id stay open
+        manager.disconnect(thread_id, websocket)
+        if thread_id not in manager.active_connections:
+            cluster.socket_closed(thread_id)
+
+async def dispatch_agent_run(run_request: RunAgentRequest):
+    """
+    Run locally if this worker owns the thread, otherwise hand the run to the owner,
+    which relays its frames back to the sockets connected here.
+    """
+    owner = await thread_owner(run_request.thread_id)
+    if cluster.is_local(owner):
+        await schedule_agent_run(run_request)
+        return
+    result = await cluster.forward(owner, "run", run_request.thread_id, subscribe=True, request=run_request.model_dump(mode="json"))
+    if "error" in result:
+        manager.deliver(run_request.thread_id, json.dumps({"event": "error", "data": {"error": result["error"]}}))
+
+async def on_forwarded_run(message: Dict[str, Any]) -> Dict[str, Any]:
+    await schedule_agent_run(RunAgentRequest(**message["request"]))
+    return {"status": "scheduled"}
+
+async def send_hello(connection, resume_from: Optional[str]):
+    """
+    Tell a protocol 2 client what was negotiated and the thread's latest seq, then
+    replay the messages after resume_from to this socket only.
+    """
+    thread_id = connection.thread_id
+    replay = await thread_control(thread_id, "replay", {"seq": int(resume_from) if resume_from is not None else None})
+    connection.enqueue({"event": "hello", "data": {**connection.options.describe(), "last_seq": replay["last_seq"]}})
+    if replay["messages"]:
+        connection.enqueue(response_frame(replay["last_seq"], replay["messages"], replay=True))
+
+async def thread_control(thread_id: str, event: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    owner = await thread_owner(thread_id)
+    if cluster.is_local(owner):
+        return run_control(thread_id, event, data)
+    return await cluster.forward(owner, "control", thread_id, subscribe=True, event=event, data=data)
+
+def run_control(thread_id: str, event: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    data = data or {}
+    if event == "ack":
+        return {"acked": outbox.ack(thread_id, int(data.get("seq", 0)))}
+    if event == "replay":
+        seq = data.get("seq")
+        return {"last_seq": outbox.last_seq(thread_id), "messages": outbox.since(thread_id, int(seq)) if seq is not None else []}
+    if event == "cancel":
+        return {"cancelled": run_scheduler.cancel(thread_id)}
+    if event == "interrupt":
+        return {"interrupted": run_scheduler.interrupt(thread_id)}
+    if event == "llm_cache":
+        if llm_response_cache is None:
+            return {"mode": None, "error": "The LLM response cache is disabled."}
+        if data.get("mode"):
+            llm_response_cache.set_mode(thread_id, data["mode"])
+        return {"mode": llm_response_cache.mode(thread_id)}
+    return {
+        "running": run_scheduler.is_running(thread_id),
+        "queued": run_scheduler.queue_depth(thread_id),
+    }
+
+async def on_forwarded_control(message: Dict[str, Any]) -> Dict[str, Any]:
+    return run_control(message["thread_id"], message["event"], message.get("data"))
+
+cluster.on("run", on_forwarded_run)
+cluster.on("control", on_forwarded_control)
+
+async def schedule_agent_run(run_request: RunAgentRequest):
+    """
+    Queue a run behind any in-flight run of the same thread, or reply "busy" if the
+    thread's queue is full. The response is sent by the run itself when it completes.
+    """
+    thread_id = run_request.thread_id
+    try:
+        admission.check(thread_id, new_message=not is_resume(run_request))
+    except OverloadedError as e:
+        await send_busy(thread_id, e.reason, str(e), e.retry_after)
+        return
+
+    async def run_and_reply():
+        try:
+            response = await admitted_run(run_request)
+            logger.debug("Response: %s", response)
+            # One dict for every protocol: each socket's writer encodes the variant it negotiated
+            legacy = await offloader.run(response.model_dump, mode="json")
+            new_messages = outbox.append(thread_id, legacy["messages"])
+            await manager.send_message_json(thread_id, response_frame(outbox.last_seq(thread_id), new_messages, legacy, legacy["wildcard_event"]))
+        except asyncio.CancelledError:
+            await close_dangling_tool_calls(thread_id)
+            await manager.send_message(thread_id, json.dumps({"event": "cancelled", "data": {}}))
+            raise
+        except OverloadedError as e:
+            await send_busy(thread_id, e.reason, str(e), e.retry_after)
+        except Exception as e:
+            await manager.send_message(thread_id, json.dumps({"event": "error", "data": {"error": str(e)}}))
+
+    try:
+        run_scheduler.submit(thread_id, run_and_reply)
+    except QueueFullError as e:
+        if not is_resume(run_request):
+            admission.refund(thread_id)
+        await send_busy(thread_id, "thread_queue_full", str(e), admission.retry_after(), queue_depth=e.queue_depth)
+
+def is_resume(run_request: RunAgentRequest) -> bool:
+    return bool(run_request.additional_params.get("resuming_interrupt", False))
+
+async def admitted_run(run_request: RunAgentRequest) -> RunAgentResponse:
+    # Holds one of the MAX_IN_FLIGHT_RUNS slots. A resumed run continues accepted work, so it's never shed.
+    # A shed run gets its thread's rate limit token back
+    async with admission.slot(shed=not is_resume(run_request), thread_id=run_request.thread_id):
+        return await process_agent_request(run_request)
+
+async def send_busy(thread_id: str, reason: str, error: str, retry_after: float, **fields: Any):
+    await manager.send_message(thread_id, json.dumps({"event": "busy", "data": {
+        "error": error,
+        "reason": reason,
+        "retry_after": math.ceil(retry_after),
+        **fields,
+    }}))
+
+async def close_dangling_tool_calls(thread_id: str):
+    """
+    A run cancelled between the model's tool call and the tool result leaves an AIMessage
+    whose tool_calls have no ToolMessage, which the model API rejects on the next turn.
+    Answer those calls with an error result so the thread stays usable.
+    """
+    agent_info = agentPool.get(thread_id)
+    if agent_info is None:
+        return
+    agent = agent_info[0]
+    config = {"configurable": {"thread_id": thread_id}}
+    try:
+        state_snapshot = await agent.aget_state(config)
+        messages = state_snapshot.values.get("messages", [])
+        if not messages or not isinstance(messages[-1], AIMessage) or not messages[-1].tool_calls:
+            return
+        await agent.aupdate_state(config, {"messages": [
+            ToolMessage(content="Cancelled by user.", tool_call_id=tool_call["id"], name=tool_call["name"], status="error")
+            for tool_call in messages[-1].tool_calls
+        ]})
+    except Exception as e:
+        logger.warning("Failed to close dangling tool calls: %s", e, extra={"thread_id": thread_id})
 
 def join_url_parts(base_url: str, *parts: str) -> str:
     """
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service imports its modules relative to agent_service/ (e.g. "from utils.X import Y")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
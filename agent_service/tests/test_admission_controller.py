@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from utils.AdmissionController import AdmissionController, OverloadedError
+
+
+def test_second_message_within_the_limit_is_rate_limited():
+    admission = AdmissionController(messages_per_minute=1)
+    admission.check("t")
+    with pytest.raises(OverloadedError) as e:
+        admission.check("t")
+    assert e.value.reason == "rate_limited"
+
+
+def test_queue_full_rejection_does_not_use_up_the_rate_limit():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=0, messages_per_minute=1)
+        async with admission.slot():
+            with pytest.raises(OverloadedError) as e:
+                admission.check("t")
+            assert e.value.reason == "queue_full"
+        # Retrying once the server has room is admitted, not rate limited
+        admission.check("t")
+        assert admission.rejected == {"queue_full": 1}
+
+    asyncio.run(scenario())
+
+
+def test_run_shed_by_slot_gets_its_token_back():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=0, messages_per_minute=1)
+        admission.check("t")
+        # Another run takes the last slot between check() and slot()
+        async with admission.slot():
+            with pytest.raises(OverloadedError) as e:
+                async with admission.slot(thread_id="t"):
+                    pass
+            assert e.value.reason == "queue_full"
+        admission.check("t")
+
+    asyncio.run(scenario())
+
+
+def test_run_timed_out_in_the_queue_gets_its_token_back():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.05, messages_per_minute=1)
+        async with admission.slot():
+            admission.check("t")
+            with pytest.raises(OverloadedError) as e:
+                async with admission.slot(thread_id="t"):
+                    pass
+            assert e.value.reason == "queue_timeout"
+        admission.check("t")
+
+    asyncio.run(scenario())
+
+
+def test_refund_is_capped_at_the_burst():
+    admission = AdmissionController(messages_per_minute=1)
+    admission.check("t")
+    admission.refund("t")
+    admission.refund("t")
+    admission.check("t")
+    with pytest.raises(OverloadedError):
+        admission.check("t")
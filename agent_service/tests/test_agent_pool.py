@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+
+from utils.AgentPool import AgentPool
+from utils.WarmPool import WarmPool
+
+
+def test_least_recently_used_entry_is_evicted_past_max_entries():
+    evicted = []
+    pool = AgentPool(max_entries=2, idle_ttl=None, on_evict=lambda thread_id, entry: evicted.append(thread_id))
+    pool.put("a", "agent a")
+    pool.put("b", "agent b")
+    assert pool.get("a") == "agent a"
+    pool.put("c", "agent c")
+
+    assert evicted == ["b"]
+    assert "b" not in pool and "a" in pool and "c" in pool
+    assert pool.stats()["evictions"] == 1
+
+
+def test_idle_entries_expire():
+    evicted = []
+    pool = AgentPool(idle_ttl=0.05, on_evict=lambda thread_id, entry: evicted.append(thread_id))
+    pool.put("a", "agent a")
+    time.sleep(0.1)
+
+    assert pool.get("a") is None
+    assert evicted == ["a"]
+    assert pool.stats()["expirations"] == 1
+
+
+def test_memory_cap_evicts_but_keeps_the_newest_entry():
+    pool = AgentPool(idle_ttl=None, max_bytes=100, sizeof=lambda entry: 60)
+    pool.put("a", "agent a")
+    pool.put("b", "agent b")
+    assert len(pool) == 1 and "b" in pool
+    pool.put("c", "agent c")
+    assert len(pool) == 1 and "c" in pool
+
+
+def test_pop_does_not_call_on_evict():
+    evicted = []
+    pool = AgentPool(on_evict=lambda thread_id, entry: evicted.append(thread_id))
+    pool.put("a", "agent a")
+    assert pool.pop("a") == "agent a"
+    assert not evicted and "a" not in pool
+
+
+def test_warm_pool_builds_off_the_event_loop():
+    built_on = []
+
+    def build():
+        built_on.append(threading.get_ident())
+        return object()
+
+    async def scenario():
+        pool = WarmPool(build, size=2)
+        # Empty pool: the build runs on a worker thread
+        await pool.take_async()
+        assert built_on[-1] != threading.get_ident()
+        assert pool.misses == 1
+
+        pool.start()
+        deadline = time.monotonic() + 5
+        while not pool.ready and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert pool.ready
+        await pool.take_async()
+        assert pool.hits == 1
+        assert threading.get_ident() not in built_on
+        await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_warm_pool_retries_failed_builds():
+    attempts = []
+
+    def build():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("model unavailable")
+        return object()
+
+    async def scenario():
+        pool = WarmPool(build, size=1, retry_delay=0.01)
+        pool.start()
+        deadline = time.monotonic() + 5
+        while not pool.ready and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert pool.ready and pool.errors == 1
+        await pool.stop()
+
+    asyncio.run(scenario())
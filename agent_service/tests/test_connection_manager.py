@@ -0,0 +1,91 @@
+import asyncio
+
+from utils.ConnectionManager import ConnectionManager, SlowConsumerPolicy
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+        self.unblocked = asyncio.Event()
+        self.unblocked.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await self.unblocked.wait()
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def token(message_id, content):
+    return {"event": "agent_delta", "data": {"type": "token", "message_id": message_id, "content": content}}
+
+
+def join_tokens(older, newer):
+    if older["data"]["message_id"] != newer["data"]["message_id"]:
+        return None
+    return {**older, "data": {**older["data"], "content": older["data"]["content"] + newer["data"]["content"]}}
+
+
+def test_writer_error_closes_the_connection():
+    async def scenario():
+        manager = ConnectionManager()
+
+        async def failing_offload(fn, *args):
+            raise TypeError("not serializable")
+
+        manager.offload = failing_offload
+        websocket = FakeWebSocket()
+        connection = await manager.connect("t1", websocket)
+
+        await manager.send_message_json("t1", {"event": "agent_response", "data": {}})
+        await asyncio.wait_for(connection._writer, 1)
+        await asyncio.sleep(0)
+
+        assert connection.closed
+        assert "t1" not in manager.active_connections
+        assert websocket.close_code == 1011
+        # Later frames for the thread aren't queued on the dead connection
+        assert not connection.enqueue({"event": "status"})
+
+    asyncio.run(scenario())
+
+
+def test_coalesce_policy_merges_token_deltas_while_the_writer_is_behind():
+    async def scenario():
+        manager = ConnectionManager(max_queue=4, policy=SlowConsumerPolicy.COALESCE)
+        manager.coalesce = join_tokens
+        websocket = FakeWebSocket()
+        websocket.unblocked.clear()
+        connection = await manager.connect("t1", websocket)
+
+        await manager.send_message_json("t1", token("m1", "a"), droppable=True)
+        await asyncio.sleep(0)  # The writer takes "a" and blocks sending it
+        for content in "bcd":
+            await manager.send_message_json("t1", token("m1", content), droppable=True)
+        await manager.send_message_json("t1", {"event": "start_oauth_flow", "data": {}})
+        await manager.send_message_json("t1", token("m2", "x"), droppable=True)
+        await manager.send_message_json("t1", token("m2", "y"), droppable=True)
+
+        assert [frame["data"].get("content") for frame, _ in connection.queue] == ["bcd", None, "xy"]
+        assert connection.coalesced == 3
+        assert manager.metrics()["frames_coalesced"] == 3
+
+        websocket.unblocked.set()
+        for _ in range(100):
+            if len(websocket.sent) == 4:
+                break
+            await asyncio.sleep(0.01)
+        assert len(websocket.sent) == 4
+        assert not connection.closed
+        connection.close()
+
+    asyncio.run(scenario())
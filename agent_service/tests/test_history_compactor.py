@@ -0,0 +1,65 @@
+import asyncio
+import sys
+import types
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.HistoryCompactor import HistoryCompactor
+
+
+class FakeEncoding:
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+def fake_tiktoken(monkeypatch, loads):
+    def get_encoding(name):
+        loads.append(name)
+        return FakeEncoding()
+
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=get_encoding))
+
+
+def history(turns):
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(content=f"question {turn} " * 20, id=f"h{turn}"))
+        messages.append(AIMessage(content=f"answer {turn} " * 20, id=f"a{turn}"))
+    return messages
+
+
+def test_compact_never_loads_the_encoding(monkeypatch):
+    loads = []
+    fake_tiktoken(monkeypatch, loads)
+    compactor = HistoryCompactor(max_tokens=200, keep_recent_turns=1)
+
+    updates = asyncio.run(compactor.compact(history(10)))
+
+    assert updates
+    assert not loads
+    assert not compactor.stats()["exact_counts"]
+
+
+def test_counts_switch_to_the_encoding_once_loaded(monkeypatch):
+    loads = []
+    fake_tiktoken(monkeypatch, loads)
+    compactor = HistoryCompactor()
+    message = HumanMessage(content="one two three four five six seven eight", id="h0")
+    estimate = compactor.count(message)
+
+    compactor.load_encoding()
+    compactor.load_encoding()
+
+    assert loads == ["o200k_base"]
+    # The cached estimate is dropped rather than reused
+    assert compactor.count(message) == 8 + 4 != estimate
+    assert compactor.stats()["exact_counts"]
+
+
+def test_missing_tiktoken_keeps_estimating(monkeypatch):
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    compactor = HistoryCompactor()
+
+    compactor.load_encoding()
+
+    assert compactor.count(HumanMessage(content="x" * 40, id="h0")) == 10 + 4
@@ -0,0 +1,133 @@
+import asyncio
+from typing import Any, Dict
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.LLMResponseCache import CachingChatModel, LLMResponseCache
+
+
+class CountingModel(GenericFakeChatModel):
+    """Answers every call with a fresh "answer <n>", and counts the calls."""
+
+    temperature: float = 0.0
+    calls: int = 0
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(messages=iter(()), **kwargs)
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"temperature": self.temperature}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        self.messages = iter([AIMessage(content=f"answer {self.calls}", id=f"run-{self.calls}")])
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def cached(cache, **model_fields):
+    model = CountingModel(**model_fields)
+    return model, CachingChatModel(model=model, response_cache=cache)
+
+
+PROMPT = [HumanMessage(content="hi")]
+
+
+def test_identical_calls_are_answered_from_the_cache():
+    model, caching = cached(LLMResponseCache())
+
+    async def scenario():
+        first = await caching.ainvoke(PROMPT)
+        second = await caching.ainvoke([HumanMessage(content="hi", id="another-id")])
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.content == second.content == "answer 1"
+    assert model.calls == 1
+    # A replayed message gets an id of its own
+    assert second.id != first.id
+
+
+def test_streamed_responses_are_replayed():
+    model, caching = cached(LLMResponseCache())
+
+    async def scenario():
+        first = [chunk async for chunk in caching.astream(PROMPT)]
+        second = [chunk async for chunk in caching.astream(PROMPT)]
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert "".join(chunk.content for chunk in second) == "".join(chunk.content for chunk in first) == "answer 1"
+    assert model.calls == 1
+
+
+def test_nondeterministic_calls_are_not_cached():
+    cache = LLMResponseCache()
+    model, caching = cached(cache, temperature=0.7)
+
+    async def scenario():
+        return [(await caching.ainvoke(PROMPT)).content for _ in range(2)]
+
+    assert asyncio.run(scenario()) == ["answer 1", "answer 2"]
+    assert cache.stats()["bypassed"] == 2
+
+
+def test_thread_modes():
+    cache = LLMResponseCache()
+    model, caching = cached(cache)
+
+    async def scenario():
+        config = {"metadata": {"thread_id": "t1"}}
+        await caching.ainvoke(PROMPT, config)
+        cache.set_mode("t1", "bypass")
+        bypassed = (await caching.ainvoke(PROMPT, config)).content
+        refreshed = (await caching.ainvoke(PROMPT, {"metadata": {"thread_id": "t1", "llm_cache": "refresh"}})).content
+        cache.set_mode("t1", "use")
+        used = (await caching.ainvoke(PROMPT, config)).content
+        return bypassed, refreshed, used
+
+    assert asyncio.run(scenario()) == ("answer 2", "answer 3", "answer 3")
+    assert model.calls == 3
+
+
+def test_entries_survive_a_reopen_and_disk_is_bounded(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite")
+
+    async def fill():
+        cache = LLMResponseCache(path=path)
+        model, caching = cached(cache)
+        await caching.ainvoke(PROMPT)
+        cache.close()
+
+    async def reopen():
+        cache = LLMResponseCache(path=path)
+        model, caching = cached(cache)
+        content = (await caching.ainvoke(PROMPT)).content
+        stats = cache.stats()
+        cache.close()
+        return model.calls, content, stats
+
+    asyncio.run(fill())
+    calls, content, stats = asyncio.run(reopen())
+    assert (calls, content, stats["disk_hits"]) == (0, "answer 1", 1)
+
+    async def overflow():
+        entry = {"generations": [], "llm_output": None}
+        cache = LLMResponseCache(path=str(tmp_path / "small.sqlite"))
+        await cache.put("key 0", entry)
+        size = cache.stats()["disk_bytes"]
+        cache.close()
+
+        # Room for two entries: the least recently used one goes
+        cache = LLMResponseCache(path=str(tmp_path / "small.sqlite"), max_bytes=2 * size)
+        await cache.put("key 1", entry)
+        await cache.put("key 2", entry)
+        stats = cache.stats()
+        remaining = [key for key in ("key 0", "key 1", "key 2") if cache._disk_get(key) is not None]
+        cache.close()
+        return size, stats, remaining
+
+    size, stats, remaining = asyncio.run(overflow())
+    assert stats["evictions"] == 1 and stats["disk_bytes"] == 2 * size
+    assert remaining == ["key 1", "key 2"]
@@ -0,0 +1,71 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from utils.LLMScheduler import LLMScheduler, SchedulingChatModel
+
+
+class RecordingScheduler(LLMScheduler):
+    def __init__(self):
+        super().__init__()
+        self.callers = []
+
+    async def acquire(self, thread_id: str, priority: int = 0, tokens: int = 0):
+        self.callers.append((thread_id, priority))
+        return await super().acquire(thread_id, priority, tokens)
+
+
+def scheduled(scheduler):
+    model = GenericFakeChatModel(messages=iter([AIMessage(content="hello there")]))
+    return SchedulingChatModel(model=model, scheduler=scheduler)
+
+
+def test_streamed_calls_are_attributed_to_their_thread():
+    scheduler = RecordingScheduler()
+    model = scheduled(scheduler)
+
+    async def node(state, config):
+        # As in a graph node: the model is streamed without the config being passed on
+        return [chunk async for chunk in model.astream([HumanMessage(content="hi")])]
+
+    config = {"metadata": {"thread_id": "thread-1", "llm_priority": 2}}
+    chunks = asyncio.run(RunnableLambda(node).ainvoke({}, config))
+
+    assert "".join(chunk.content for chunk in chunks) == "hello there"
+    assert scheduler.callers == [("thread-1", 2)]
+
+
+def test_streamed_calls_given_a_config_are_attributed_to_their_thread():
+    scheduler = RecordingScheduler()
+    model = scheduled(scheduler)
+
+    async def scenario():
+        config = {"metadata": {"thread_id": "thread-2"}}
+        return [chunk async for chunk in model.astream([HumanMessage(content="hi")], config)]
+
+    asyncio.run(scenario())
+    assert scheduler.callers == [("thread-2", 0)]
+
+
+def test_invoked_calls_are_attributed_to_their_thread():
+    scheduler = RecordingScheduler()
+    model = scheduled(scheduler)
+
+    asyncio.run(model.ainvoke([HumanMessage(content="hi")], {"metadata": {"thread_id": "thread-3", "llm_priority": 1}}))
+    assert scheduler.callers == [("thread-3", 1)]
+
+
+def test_streamed_calls_through_the_response_cache_are_attributed_to_their_thread():
+    from utils.LLMResponseCache import CachingChatModel, LLMResponseCache
+
+    scheduler = RecordingScheduler()
+    model = CachingChatModel(model=scheduled(scheduler), response_cache=LLMResponseCache())
+
+    async def scenario():
+        config = {"metadata": {"thread_id": "thread-4", "llm_priority": 3}}
+        return [chunk async for chunk in model.astream([HumanMessage(content="hi")], config)]
+
+    asyncio.run(scenario())
+    assert scheduler.callers == [("thread-4", 3)]
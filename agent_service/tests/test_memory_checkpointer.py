@@ -0,0 +1,60 @@
+import operator
+from typing import Annotated, List, TypedDict
+
+from langgraph.graph import END, START, StateGraph
+
+from utils.MemoryCheckpointer import MemoryCheckpointer
+
+
+class State(TypedDict):
+    items: Annotated[List[int], operator.add]
+    last: int
+
+
+def build_graph(checkpointer):
+    graph = StateGraph(State)
+    graph.add_node("step", lambda state: {"last": len(state["items"])})
+    graph.add_edge(START, "step")
+    graph.add_edge("step", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+def test_keeps_only_the_newest_checkpoints_of_each_thread():
+    checkpointer = MemoryCheckpointer(keep_last=3)
+    graph = build_graph(checkpointer)
+    for thread_id in ("a", "b"):
+        config = {"configurable": {"thread_id": thread_id}}
+        for turn in range(10):
+            graph.invoke({"items": [turn]}, config)
+
+    for thread_id in ("a", "b"):
+        config = {"configurable": {"thread_id": thread_id}}
+        assert len(list(checkpointer.list(config))) == 3
+        # The retained checkpoints still resolve every channel value
+        assert graph.get_state(config).values == {"items": list(range(10)), "last": 10}
+
+    # Writes and channel values of pruned checkpoints are gone too
+    retained, referenced = set(), set()
+    for saved in checkpointer.list(None):
+        configurable = saved.config["configurable"]
+        retained.add((configurable["thread_id"], configurable["checkpoint_ns"], configurable["checkpoint_id"]))
+        referenced.update(
+            (configurable["thread_id"], configurable["checkpoint_ns"], channel, version)
+            for channel, version in saved.checkpoint["channel_versions"].items()
+        )
+    assert set(checkpointer.writes) <= retained
+    assert set(checkpointer.blobs) == referenced
+
+
+def test_delete_thread_forgets_its_index():
+    checkpointer = MemoryCheckpointer(keep_last=2)
+    graph = build_graph(checkpointer)
+    config = {"configurable": {"thread_id": "a"}}
+    for turn in range(4):
+        graph.invoke({"items": [turn]}, config)
+
+    checkpointer.delete_thread("a")
+
+    assert not list(checkpointer.list(config))
+    assert not checkpointer.blobs
+    assert not checkpointer._versions and not checkpointer._blob_keys
@@ -0,0 +1,22 @@
+import pytest
+
+from utils.Metrics import Registry, _Metric
+
+
+def test_metric_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        _Metric("m", "help")
+
+
+def test_render_exposes_each_metric_type():
+    registry = Registry()
+    registry.counter("requests_total", "Requests.", ["route"]).inc(route="/run")
+    registry.gauge("depth", "Depth.").set(3)
+    registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0)).observe(0.5)
+
+    text = registry.render()
+
+    assert "# TYPE requests_total counter" in text and 'requests_total{route="/run"} 1.0' in text
+    assert "depth 3" in text
+    assert 'latency_seconds_bucket{le="0.1"} 0' in text and 'latency_seconds_bucket{le="1.0"} 1' in text
+    assert "latency_seconds_count 1" in text
@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import pytest
+
+from utils.Offload import LoopLagMonitor, Offloader
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def test_calls_run_on_a_worker_thread_with_the_callers_context():
+    offloader = Offloader(max_workers=2)
+
+    async def scenario():
+        request_id.set("r1")
+        return await offloader.run(lambda: (threading.get_ident(), request_id.get()))
+
+    thread, seen = asyncio.run(scenario())
+    assert thread != threading.get_ident()
+    assert seen == "r1"
+    offloader.shutdown()
+
+
+def test_callers_past_the_pending_limit_wait_without_blocking_the_loop():
+    offloader = Offloader(max_workers=1, max_pending=1)
+    running = []
+    peak = []
+
+    def work():
+        running.append(1)
+        peak.append(len(running))
+        time.sleep(0.02)
+        running.pop()
+
+    async def scenario():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.create_task(tick())
+        await asyncio.gather(*(offloader.run(work) for _ in range(4)))
+        ticker.cancel()
+        return ticks
+
+    ticks = asyncio.run(scenario())
+    assert max(peak) == 1
+    assert ticks > 5
+    assert offloader.stats()["completed"] == 4
+    offloader.shutdown()
+
+
+def test_errors_propagate_and_are_counted():
+    offloader = Offloader()
+
+    def fail():
+        raise ValueError("bad payload")
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await offloader.run(fail)
+
+    asyncio.run(scenario())
+    assert offloader.stats()["errors"] == 1
+    offloader.shutdown()
+
+
+def blocking_handler():
+    time.sleep(0.4)
+
+
+def test_a_blocked_loop_is_reported_with_its_stack():
+    monitor = LoopLagMonitor(interval=0.02, stall_threshold=0.1)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        blocking_handler()
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(scenario())
+    assert monitor.stall_count == 1
+    stall = monitor.recent_stalls()[0]
+    assert "blocking_handler" in stall["stack"]
+    # Updated with the full duration once the loop ran again
+    assert stall["blocked_s"] >= 0.35
+    assert monitor.stats()["max_lag_ms"] >= 350
@@ -0,0 +1,104 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.errors import NodeInterrupt
+from langgraph.graph import END, START, MessagesState, StateGraph
+
+from utils.ParallelToolNode import ParallelToolNode, parallelize_tool_node
+
+
+class FakeTools:
+    """A tools node whose gmail tool needs OAuth and whose slack tool has a side effect."""
+
+    def __init__(self):
+        self.authorized = False
+        self.slack_sent = 0
+        self.started = []
+
+    async def __call__(self, state: MessagesState):
+        call = state["messages"][-1].tool_calls[0]
+        self.started.append(call["name"])
+        if call["name"] == "gmail" and not self.authorized:
+            raise NodeInterrupt({"api_service": "gmail"})
+        if call["name"] == "slack":
+            await asyncio.sleep(0.01)
+            self.slack_sent += 1
+        return {"messages": [ToolMessage(content=f"{call['name']} done", tool_call_id=call["id"], name=call["name"])]}
+
+
+def build_graph(tools, max_concurrency=8):
+    def agent(state: MessagesState):
+        if isinstance(state["messages"][-1], ToolMessage):
+            return {"messages": [AIMessage(content="All done.")]}
+        return {"messages": [AIMessage(content="", tool_calls=[
+            {"name": "gmail", "args": {}, "id": "call_gmail"},
+            {"name": "slack", "args": {}, "id": "call_slack"},
+        ])]}
+
+    def route(state: MessagesState):
+        return "tools" if state["messages"][-1].tool_calls else END
+
+    graph = StateGraph(MessagesState)
+    graph.add_node("agent", agent)
+    graph.add_node("tools", tools)
+    graph.add_edge(START, "agent")
+    graph.add_conditional_edges("agent", route, ["tools", END])
+    graph.add_edge("tools", "agent")
+    return parallelize_tool_node(graph.compile(checkpointer=MemorySaver()), max_concurrency=max_concurrency)
+
+
+async def interrupt_then_resume(graph, tools):
+    config = {"configurable": {"thread_id": "t1"}}
+    await graph.ainvoke({"messages": [HumanMessage(content="mail and ping")]}, config)
+    snapshot = await graph.aget_state(config)
+    assert snapshot.next == ("tools",)
+    assert snapshot.tasks[0].interrupts[0].value == {"api_service": "gmail"}
+
+    tools.authorized = True
+    # Like process_agent_request: the resume writes a checkpoint of its own before streaming
+    await graph.aupdate_state(config, {"messages": []})
+    final = await graph.ainvoke(None, config)
+    return final["messages"]
+
+
+def test_calls_that_finished_before_an_interrupt_are_not_rerun_on_resume():
+    tools = FakeTools()
+    graph = build_graph(tools)
+
+    messages = asyncio.run(interrupt_then_resume(graph, tools))
+
+    assert tools.slack_sent == 1
+    assert tools.started == ["gmail", "slack", "gmail"]
+    results = [message for message in messages if isinstance(message, ToolMessage)]
+    # In the order of the tool calls, the replayed result included
+    assert [message.tool_call_id for message in results] == ["call_gmail", "call_slack"]
+    assert messages[-1].content == "All done."
+
+
+def test_calls_not_started_when_another_is_interrupted_run_on_resume():
+    tools = FakeTools()
+    graph = build_graph(tools, max_concurrency=1)
+
+    messages = asyncio.run(interrupt_then_resume(graph, tools))
+
+    # Like the sequential node: slack waits for gmail's authorization, then runs once
+    assert tools.started == ["gmail", "gmail", "slack"]
+    assert tools.slack_sent == 1
+    assert messages[-1].content == "All done."
+
+
+def test_remembered_results_are_dropped_once_the_node_completes():
+    tools = FakeTools()
+    graph = build_graph(tools)
+    asyncio.run(interrupt_then_resume(graph, tools))
+
+    node = graph.builder.nodes["tools"].runnable.afunc.__self__
+    assert not node._finished
+
+
+def test_remembered_results_are_keyed_without_task_ids():
+    call = {"name": "slack", "args": {}, "id": "call_slack"}
+    first = {"configurable": {"thread_id": "t1", "checkpoint_ns": "outer:1f2e|tools:3a4b"}}
+    rerun = {"configurable": {"thread_id": "t1", "checkpoint_ns": "outer:5c6d|tools:7e8f"}}
+    assert ParallelToolNode._key(first, call) == ParallelToolNode._key(rerun, call) == ("t1", "outer|tools", "call_slack")
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+
+import pytest
+
+from utils.RunScheduler import QueueFullError, RunScheduler
+
+
+def test_runs_of_a_thread_execute_in_order_one_at_a_time():
+    async def scenario():
+        scheduler = RunScheduler()
+        events = []
+
+        def job(name):
+            async def run():
+                events.append(f"start {name}")
+                await asyncio.sleep(0.01)
+                events.append(f"end {name}")
+                return name
+            return run
+
+        futures = [scheduler.submit("t1", job(name)) for name in ("a", "b", "c")]
+        assert await asyncio.gather(*futures) == ["a", "b", "c"]
+        assert events == ["start a", "end a", "start b", "end b", "start c", "end c"]
+        assert scheduler.stats()["threads"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_threads_run_in_parallel():
+    async def scenario():
+        scheduler = RunScheduler()
+        both_started = asyncio.Event()
+        started = []
+
+        async def run():
+            started.append(1)
+            if len(started) == 2:
+                both_started.set()
+            await asyncio.wait_for(both_started.wait(), 1)
+
+        await asyncio.gather(scheduler.submit("t1", run), scheduler.submit("t2", run))
+
+    asyncio.run(scenario())
+
+
+def test_queue_full_is_rejected():
+    async def scenario():
+        scheduler = RunScheduler(max_queue_depth=1)
+        release = asyncio.Event()
+
+        async def run():
+            await release.wait()
+
+        first = scheduler.submit("t1", run)
+        await asyncio.sleep(0)
+        second = scheduler.submit("t1", run)
+        with pytest.raises(QueueFullError) as e:
+            scheduler.submit("t1", run)
+        assert e.value.queue_depth == 1
+        release.set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(scenario())
+
+
+def test_interrupt_stops_the_running_job_and_keeps_the_queue():
+    async def scenario():
+        scheduler = RunScheduler()
+
+        async def forever():
+            await asyncio.Event().wait()
+
+        async def done():
+            return "next"
+
+        running = scheduler.submit("t1", forever)
+        queued = scheduler.submit("t1", done)
+        await asyncio.sleep(0)
+        assert scheduler.interrupt("t1")
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        assert await queued == "next"
+
+    asyncio.run(scenario())
+
+
+def test_cancel_drops_queued_runs():
+    async def scenario():
+        scheduler = RunScheduler()
+        ran = []
+
+        async def forever():
+            await asyncio.Event().wait()
+
+        async def queued_job():
+            ran.append(1)
+
+        running = scheduler.submit("t1", forever)
+        queued = scheduler.submit("t1", queued_job)
+        await asyncio.sleep(0)
+        assert scheduler.cancel("t1")
+        await asyncio.gather(running, queued, return_exceptions=True)
+        assert running.cancelled() and queued.cancelled()
+        assert not ran
+
+    asyncio.run(scenario())
+
+
+def test_failure_after_the_caller_stopped_waiting_is_logged(caplog):
+    unretrieved = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unretrieved.append(context))
+        scheduler = RunScheduler()
+        started = asyncio.Event()
+
+        async def failing():
+            started.set()
+            await asyncio.sleep(0.01)
+            raise RuntimeError("tool exploded")
+
+        future = scheduler.submit("t1", failing)
+        await started.wait()
+        future.cancel()
+        while scheduler.stats()["threads"]:
+            await asyncio.sleep(0.01)
+
+    with caplog.at_level(logging.ERROR, logger="utils.RunScheduler"):
+        asyncio.run(scenario())
+
+    assert any(record.exc_info and "tool exploded" in str(record.exc_info[1]) for record in caplog.records)
+    assert not unretrieved
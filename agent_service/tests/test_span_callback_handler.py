@@ -0,0 +1,55 @@
+import asyncio
+import time
+from uuid import uuid4
+
+from langchain_core.tools import tool
+from langgraph.errors import NodeInterrupt
+
+from utils.SpanCallbackHandler import SpanCallbackHandler
+
+
+def test_cancelled_tool_calls_are_forgotten_once_too_old():
+    handler = SpanCallbackHandler(max_age=0.05)
+
+    @tool
+    async def slow_search(query: str) -> str:
+        """Searches slowly."""
+        await asyncio.sleep(10)
+        return query
+
+    async def scenario():
+        run = asyncio.create_task(slow_search.ainvoke({"query": "mail"}, {"callbacks": [handler]}))
+        await asyncio.sleep(0.01)
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+
+    asyncio.run(scenario())
+    # Cancellation reports neither an end nor an error
+    assert len(handler._started) == 1
+
+    time.sleep(0.06)
+    handler.on_tool_start({"name": "other"}, "", run_id=uuid4())
+    assert len(handler._started) == 1 and handler.abandoned == 1
+
+
+def test_open_calls_are_bounded():
+    handler = SpanCallbackHandler(max_open=3)
+    for _ in range(10):
+        handler.on_chat_model_start({"name": "model"}, [], run_id=uuid4())
+    assert len(handler._started) == 3
+    assert handler.abandoned == 7
+
+
+def test_interrupted_tool_calls_are_closed():
+    handler = SpanCallbackHandler()
+
+    @tool
+    def send_mail(to: str) -> str:
+        """Sends mail."""
+        raise NodeInterrupt({"api_service": "gmail"})
+
+    try:
+        send_mail.invoke({"to": "me"}, {"callbacks": [handler]})
+    except NodeInterrupt:
+        pass
+    assert not handler._started
@@ -0,0 +1,141 @@
+import operator
+import sqlite3
+import time
+from typing import Annotated, Any, List, Optional, TypedDict
+
+from langgraph.graph import END, START, StateGraph
+
+from utils.SqliteCheckpointer import SqliteCheckpointer
+
+
+class State(TypedDict):
+    items: Annotated[List[int], operator.add]
+    last: int
+    tool_search_client: Optional[Any]
+
+
+class FakeClient:
+    """Stands in for the ToolSearchClient: no serializer can encode it."""
+
+    def __init__(self):
+        self.token = "oauth-secret"
+
+
+def build_graph(checkpointer):
+    graph = StateGraph(State)
+    graph.add_node("step", lambda state: {"last": len(state["items"])})
+    graph.add_edge(START, "step")
+    graph.add_edge("step", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+def open_checkpointer(path, **kwargs):
+    # No timer flushes unless a test asks for them
+    kwargs.setdefault("flush_interval", 3600.0)
+    return SqliteCheckpointer(str(path), **kwargs)
+
+
+def test_checkpoints_survive_a_reopen(tmp_path):
+    path = tmp_path / "checkpoints.sqlite"
+    checkpointer = open_checkpointer(path)
+    config = {"configurable": {"thread_id": "a"}}
+    for turn in range(3):
+        build_graph(checkpointer).invoke({"items": [turn]}, config)
+    checkpointer.close()
+
+    reopened = open_checkpointer(path)
+    assert build_graph(reopened).get_state(config).values == {"items": [0, 1, 2], "last": 3}
+    reopened.close()
+
+
+def test_keeps_only_the_newest_checkpoints_of_each_thread(tmp_path):
+    checkpointer = open_checkpointer(tmp_path / "checkpoints.sqlite", keep_last=3)
+    graph = build_graph(checkpointer)
+    for thread_id in ("a", "b"):
+        config = {"configurable": {"thread_id": thread_id}}
+        for turn in range(10):
+            graph.invoke({"items": [turn]}, config)
+
+    for thread_id in ("a", "b"):
+        config = {"configurable": {"thread_id": thread_id}}
+        assert len(list(checkpointer.list(config))) == 3
+        assert graph.get_state(config).values == {"items": list(range(10)), "last": 10}
+    # Writes of pruned checkpoints are gone too
+    with checkpointer._lock:
+        orphans = checkpointer._conn.execute(
+            "SELECT COUNT(*) FROM writes WHERE checkpoint_id NOT IN (SELECT checkpoint_id FROM checkpoints)"
+        ).fetchone()[0]
+    assert orphans == 0
+    checkpointer.close()
+
+
+def test_reads_see_checkpoints_not_flushed_yet(tmp_path):
+    checkpointer = open_checkpointer(tmp_path / "checkpoints.sqlite", batch_size=10_000)
+    graph = build_graph(checkpointer)
+    config = {"configurable": {"thread_id": "a"}}
+    graph.invoke({"items": [1]}, config)
+    assert checkpointer.flushes == 0
+
+    assert graph.get_state(config).values == {"items": [1], "last": 1}
+    assert checkpointer.flushes == 1
+    checkpointer.close()
+
+
+def test_a_crash_loses_only_the_batch_still_buffered(tmp_path):
+    path = tmp_path / "checkpoints.sqlite"
+    checkpointer = open_checkpointer(path, batch_size=10_000)
+    graph = build_graph(checkpointer)
+    config = {"configurable": {"thread_id": "a"}}
+    graph.invoke({"items": [1]}, config)
+    checkpointer.flush()
+    graph.invoke({"items": [2]}, config)
+    assert checkpointer._pending_checkpoints
+
+    # Another process opening the file sees what a restart after a crash would
+    after_crash = open_checkpointer(path)
+    assert build_graph(after_crash).get_state(config).values == {"items": [1], "last": 1}
+    after_crash.close()
+
+
+def test_idle_threads_are_flushed_on_a_timer(tmp_path):
+    path = tmp_path / "checkpoints.sqlite"
+    checkpointer = open_checkpointer(path, batch_size=10_000, flush_interval=0.05)
+    build_graph(checkpointer).invoke({"items": [1]}, {"configurable": {"thread_id": "a"}})
+
+    deadline = time.monotonic() + 5
+    while checkpointer._pending_checkpoints and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not checkpointer._pending_checkpoints
+
+    reader = open_checkpointer(path)
+    assert len(list(reader.list({"configurable": {"thread_id": "a"}}))) > 0
+    reader.close()
+    checkpointer.close()
+
+
+def test_tool_search_client_is_not_persisted(tmp_path):
+    path = tmp_path / "checkpoints.sqlite"
+    checkpointer = open_checkpointer(path)
+    graph = build_graph(checkpointer)
+    config = {"configurable": {"thread_id": "a"}}
+    graph.invoke({"items": [1], "tool_search_client": FakeClient()}, config)
+    # How main.py attaches the client again on resume
+    client = FakeClient()
+    graph.update_state(config, {"tool_search_client": client})
+    # This process gets the live client back with the checkpoint
+    assert graph.get_state(config).values["tool_search_client"] is client
+    checkpointer.close()
+
+    conn = sqlite3.connect(str(path))
+    stored = b"".join(
+        blob for (blob,) in conn.execute("SELECT checkpoint FROM checkpoints UNION ALL SELECT value FROM writes") if blob
+    )
+    types = {type_ for (type_,) in conn.execute("SELECT type FROM checkpoints UNION SELECT type FROM writes")}
+    conn.close()
+    assert b"oauth-secret" not in stored
+    assert "pickle" not in types
+
+    reopened = open_checkpointer(path)
+    values = build_graph(reopened).get_state(config).values
+    assert values == {"items": [1], "last": 1}
+    reopened.close()
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from utils.ToolSearchCache import ToolSearchCache
+
+
+class SlowFetch:
+    def __init__(self, result="tools", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return [self.result]
+
+
+def test_cancelling_a_waiting_caller_leaves_the_call_running():
+    async def scenario():
+        cache = ToolSearchCache()
+        fetch = SlowFetch()
+        a = asyncio.create_task(cache.get_or_fetch("gmail", fetch))
+        b = asyncio.create_task(cache.get_or_fetch("gmail", fetch))
+        await asyncio.sleep(0)
+
+        b.cancel()
+        await asyncio.sleep(0)
+        fetch.release.set()
+
+        assert await a == ["tools"]
+        with pytest.raises(asyncio.CancelledError):
+            await b
+        assert fetch.calls == 1 and not fetch.cancelled
+        assert cache.get("gmail") == (True, ["tools"])
+        assert cache.stats()["coalesced"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_the_caller_that_started_the_call_leaves_the_others_waiting():
+    async def scenario():
+        cache = ToolSearchCache()
+        fetch = SlowFetch()
+        first = asyncio.create_task(cache.get_or_fetch("gmail", fetch))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_fetch("gmail", fetch))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.sleep(0)
+        fetch.release.set()
+
+        assert await second == ["tools"]
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert fetch.calls == 1 and not fetch.cancelled
+
+    asyncio.run(scenario())
+
+
+def test_fetch_is_cancelled_once_every_caller_is_gone():
+    async def scenario():
+        cache = ToolSearchCache()
+        fetch = SlowFetch()
+        callers = [asyncio.create_task(cache.get_or_fetch("gmail", fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert fetch.cancelled == 1
+        assert not cache._inflight
+
+        # The next lookup starts a fresh call
+        retry = SlowFetch(result="fresh")
+        retry.release.set()
+        assert await cache.get_or_fetch("gmail", retry) == ["fresh"]
+
+    asyncio.run(scenario())
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    async def scenario():
+        cache = ToolSearchCache()
+        fetch = SlowFetch(error=RuntimeError("search failed"))
+        callers = [asyncio.create_task(cache.get_or_fetch("gmail", fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+        fetch.release.set()
+
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert fetch.calls == 1 and cache.errors == 1
+        assert cache.get("gmail") == (False, None)
+        assert not cache._inflight
+
+    asyncio.run(scenario())
@@ -0,0 +1,47 @@
+import json
+
+from utils.WireProtocol import ProtocolOptions, ToolOutputMode, encode_frame, response_frame
+
+
+def tool_message(content):
+    return {"type": "tool", "content": content, "tool_call_id": "call_1", "name": "gmail"}
+
+
+def encoded_messages(content, **options):
+    frame = response_frame(1, [tool_message(content), {"type": "ai", "content": "x" * 2000}], legacy={})
+    return json.loads(encode_frame(frame, ProtocolOptions(version=2, **options)))["data"]["messages"]
+
+
+def test_string_tool_output_is_truncated():
+    tool, ai = encoded_messages("x" * 2000, tool_output_limit=100)
+    assert tool["content"] == "x" * 100
+    assert tool["content_length"] == 2000 and tool["truncated"]
+    # Only tool messages are shaped
+    assert len(ai["content"]) == 2000
+
+
+def test_structured_tool_output_is_truncated():
+    blocks = [{"type": "text", "text": "y" * 1000}, {"type": "text", "text": "z" * 1000}]
+    tool, _ = encoded_messages(blocks, tool_output_limit=100)
+    assert len(tool["content"]) == 100
+    assert tool["content_length"] == len(json.dumps(blocks, separators=(",", ":")))
+    assert tool["truncated"]
+
+
+def test_small_structured_tool_output_is_sent_as_is():
+    blocks = [{"type": "text", "text": "ok"}]
+    tool, _ = encoded_messages(blocks, tool_output_limit=100)
+    assert tool["content"] == blocks and "truncated" not in tool
+
+
+def test_omit_and_full_modes():
+    blocks = [{"type": "text", "text": "y" * 1000}]
+    omitted, _ = encoded_messages(blocks, tool_output=ToolOutputMode.OMIT)
+    assert omitted["content"] == "" and omitted["truncated"]
+    full, _ = encoded_messages(blocks, tool_output=ToolOutputMode.FULL, tool_output_limit=10)
+    assert full["content"] == blocks
+
+
+def test_protocol_1_gets_the_legacy_body():
+    frame = response_frame(1, [tool_message("x" * 2000)], legacy={"messages": ["legacy"]})
+    assert json.loads(encode_frame(frame, ProtocolOptions(version=1))) == {"messages": ["legacy"]}
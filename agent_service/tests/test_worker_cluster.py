@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.ThreadRegistry import LocalThreadRegistry, SqliteThreadRegistry, ThreadRegistry
+from utils.WorkerBus import LocalWorkerBus, WorkerBus
+from utils.WorkerCluster import WorkerCluster
+
+
+def test_interfaces_are_abstract():
+    with pytest.raises(TypeError):
+        ThreadRegistry()
+    with pytest.raises(TypeError):
+        WorkerBus()
+
+
+def test_resolve_follows_a_takeover(tmp_path):
+    path = str(tmp_path / "registry.sqlite")
+    a = WorkerCluster(SqliteThreadRegistry(path, worker_ttl=0.2), LocalWorkerBus(), worker_id="a")
+    b = WorkerCluster(SqliteThreadRegistry(path, worker_ttl=0.2), LocalWorkerBus(), worker_id="b")
+
+    async def scenario():
+        a.registry.heartbeat("a")
+        b.registry.heartbeat("b")
+        assert await a.resolve("t1") == "a"
+        assert await b.resolve("t1") == "a"
+
+        # a stalls past its TTL and b takes the thread over
+        time.sleep(0.3)
+        b.registry.heartbeat("b")
+        assert await b.resolve("t1") == "b"
+
+        # a recovers: it must not go on serving the thread it used to own
+        a.registry.heartbeat("a")
+        assert await a.resolve("t1") == "b"
+        assert await a.resolve("t2") == "a"
+
+    asyncio.run(scenario())
+
+
+def test_local_registry_claims_and_releases():
+    cluster = WorkerCluster(LocalThreadRegistry(), LocalWorkerBus(), worker_id="a")
+
+    async def scenario():
+        assert await cluster.resolve("t1") == "a"
+        cluster.release("t1")
+        assert cluster.owner("t1") is None
+
+    asyncio.run(scenario())
+
+
+class SlowRegistry(LocalThreadRegistry):
+    """A registry whose writes block, like SqliteThreadRegistry waiting for its write lock."""
+
+    blocking = True
+
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+        self.release_threads = []
+
+    def release(self, thread_id: str, worker_id: str):
+        self.release_threads.append(threading.get_ident())
+        self.unblock.wait(5)
+        super().release(thread_id, worker_id)
+
+
+def test_release_of_a_blocking_registry_runs_off_the_event_loop():
+    registry = SlowRegistry()
+    cluster = WorkerCluster(registry, LocalWorkerBus(), worker_id="a")
+
+    async def scenario():
+        assert await cluster.resolve("t1") == "a"
+        started = time.monotonic()
+        # As AgentPool's evict hook calls it: synchronously, on the loop
+        cluster.release("t1")
+        assert time.monotonic() - started < 1
+        assert cluster.owner("t1") == "a"
+
+        registry.unblock.set()
+        await cluster.stop()
+        assert cluster.owner("t1") is None
+        assert registry.release_threads and threading.get_ident() not in registry.release_threads
+
+    asyncio.run(scenario())
@@ -0,0 +1,186 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from utils.LLMScheduler import TokenBucket
+from utils.Metrics import registry
+
+'''
+AdmissionController bounds how many agent runs execute at once across all
+threads. A run past max_in_flight waits in a FIFO queue of at most max_queue
+runs; a run that would overflow the queue, or that has waited longer than
+queue_timeout (the queue-time SLO), is shed with OverloadedError instead of
+making every conversation slower. Runs that continue work already accepted
+(resuming after OAuth) are never shed, only queued.
+
+Each thread is also limited to messages_per_minute new messages, with bursts of
+up to message_burst. check() applies the rate limit and rejects early when the
+queue is already full, before a run is queued anywhere; slot() holds a run slot
+for the duration of the run. A message that is turned away after its rate
+limit token was taken (shed by slot(), or refused by the caller's own queue)
+gets the token back via refund(), so a client retrying after retry_after isn't
+rate limited for a message that never ran.
+
+OverloadedError carries a reason and a retry_after hint in seconds, estimated
+from the recent run duration and the queue ahead.
+'''
+
+wait_seconds = registry.histogram(
+    "admission_wait_seconds", "Time agent runs waited for a run slot.", ["outcome"]
+)
+rejections = registry.counter(
+    "admission_rejections_total", "Agent runs and messages turned away by admission control.", ["reason"]
+)
+
+
+class OverloadedError(Exception):
+    def __init__(self, reason: str, message: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        max_queue: int = 256,
+        queue_timeout: float = 30.0,
+        messages_per_minute: float = 0.0,
+        message_burst: Optional[float] = None,
+        max_tracked_threads: int = 100_000,
+    ):
+        # 0 admits every run immediately
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.messages_per_minute = messages_per_minute
+        self.message_burst = message_burst
+        self.max_tracked_threads = max_tracked_threads
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # Moving average of run durations, for retry_after
+        self._run_seconds = 0.0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> float:
+        if not self.max_in_flight:
+            return 1.0
+        ahead = self.queued + 1
+        return max(1.0, math.ceil(self._run_seconds * ahead / self.max_in_flight))
+
+    def _reject(self, reason: str, message: str, retry_after: float) -> OverloadedError:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        rejections.inc(reason=reason)
+        return OverloadedError(reason, message, retry_after)
+
+    def check(self, thread_id: str, new_message: bool = True):
+        """Raises OverloadedError if a new run of thread_id shouldn't even be queued."""
+        # Queue first: a message refused because the server is busy must not use up the thread's allowance
+        if new_message and self.max_in_flight and self.in_flight >= self.max_in_flight and self.queued >= self.max_queue:
+            raise self._reject("queue_full", "Server is busy: too many runs in progress.", self.retry_after())
+        if new_message and self.messages_per_minute > 0:
+            bucket = self._buckets.get(thread_id)
+            if bucket is None:
+                bucket = self._buckets[thread_id] = TokenBucket(self.messages_per_minute, self.message_burst)
+                if len(self._buckets) > self.max_tracked_threads:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(thread_id)
+            wait = bucket.wait_time(1, time.monotonic())
+            if wait > 0:
+                raise self._reject(
+                    "rate_limited",
+                    f"Too many messages for thread_id {thread_id}: limit is {self.messages_per_minute:g} per minute.",
+                    math.ceil(wait),
+                )
+            bucket.take(1)
+
+    def refund(self, thread_id: str):
+        """Returns the token check() took for a message of thread_id that was turned away after all."""
+        bucket = self._buckets.get(thread_id)
+        if bucket is not None:
+            bucket.correct(-1)
+
+    @asynccontextmanager
+    async def slot(self, shed: bool = True, thread_id: Optional[str] = None) -> AsyncIterator[None]:
+        try:
+            await self._acquire(shed)
+        except OverloadedError:
+            if thread_id is not None:
+                self.refund(thread_id)
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - started
+            self._run_seconds = duration if not self._run_seconds else 0.8 * self._run_seconds + 0.2 * duration
+            self._release()
+
+    async def _acquire(self, shed: bool):
+        if not self.max_in_flight or (self.in_flight < self.max_in_flight and not self._waiters):
+            self.in_flight += 1
+            self.admitted += 1
+            wait_seconds.observe(0.0, outcome="admitted")
+            return
+        if shed and self.queued >= self.max_queue:
+            raise self._reject("queue_full", "Server is busy: too many runs in progress.", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        enqueued = time.monotonic()
+        try:
+            # shield: a timeout must not cancel the future _release may be handing a slot to
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout if shed and self.queue_timeout > 0 else None)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._waiters.remove(future)
+                wait_seconds.observe(time.monotonic() - enqueued, outcome="timed_out")
+                raise self._reject(
+                    "queue_timeout",
+                    f"Server is busy: no run slot within {self.queue_timeout:g}s.",
+                    self.retry_after(),
+                )
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over as this run was cancelled; pass it on
+                self._release()
+            else:
+                future.cancel()
+                self._waiters.remove(future)
+            raise
+        # Slot handed over by _release: in_flight already counts it
+        self.admitted += 1
+        wait_seconds.observe(time.monotonic() - enqueued, outcome="admitted")
+
+    def _release(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def drop(self, thread_id: str):
+        self._buckets.pop(thread_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": sum(self.rejected.values()),
+            **{f"rejected_{reason}": count for reason, count in self.rejected.items()},
+            "avg_run_seconds": round(self._run_seconds, 3),
+        }
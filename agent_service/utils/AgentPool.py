@@ -0,0 +1,118 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+'''
+AgentPool is a bounded, thread_id keyed cache of per-thread agent entries.
+Entries are evicted least-recently-used first when the pool exceeds its entry
+or memory cap, and entries idle for longer than idle_ttl seconds are dropped.
+The pool never builds entries itself: building an agent blocks, so callers
+build off the event loop (see WarmPool.take_async) and put() the result.
+'''
+
+T = TypeVar("T")
+
+
+def _estimate_size(value: Any, _depth: int = 0) -> int:
+    # Cheap, shallow estimate: good enough to bound the pool, not an exact accounting.
+    size = sys.getsizeof(value)
+    if _depth >= 2:
+        return size
+    if isinstance(value, dict):
+        size += sum(_estimate_size(k, _depth + 1) + _estimate_size(v, _depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(_estimate_size(v, _depth + 1) for v in value)
+    return size
+
+
+class AgentPool(Generic[T]):
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        idle_ttl: Optional[float] = 3600.0,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[T], int] = _estimate_size,
+        on_evict: Optional[Callable[[str, T], None]] = None,
+    ):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        # Called for entries dropped by eviction or expiry, not for explicit pop()
+        self.on_evict = on_evict
+        # thread_id -> (entry, last_used, size)
+        self._entries: "OrderedDict[str, Tuple[T, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __contains__(self, thread_id: str) -> bool:
+        return thread_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, thread_id: str) -> Optional[T]:
+        self.expire()
+        item = self._entries.get(thread_id)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry, _, size = item
+        self._entries[thread_id] = (entry, time.monotonic(), size)
+        self._entries.move_to_end(thread_id)
+        return entry
+
+    def put(self, thread_id: str, entry: T):
+        self.pop(thread_id)
+        size = self.sizeof(entry) if self.max_bytes is not None else 0
+        self._entries[thread_id] = (entry, time.monotonic(), size)
+        self._bytes += size
+        self._enforce_caps()
+
+    def pop(self, thread_id: str) -> Optional[T]:
+        item = self._entries.pop(thread_id, None)
+        if item is None:
+            return None
+        self._bytes -= item[2]
+        return item[0]
+
+    def expire(self):
+        if self.idle_ttl is None:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        # Entries are kept in recency order, so the idle ones are at the front.
+        while self._entries:
+            thread_id, (_, last_used, _) = next(iter(self._entries.items()))
+            if last_used > cutoff:
+                break
+            self._evicted(thread_id, self.pop(thread_id))
+            self.expirations += 1
+
+    def _enforce_caps(self):
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1
+        ):
+            thread_id = next(iter(self._entries))
+            self._evicted(thread_id, self.pop(thread_id))
+            self.evictions += 1
+
+    def _evicted(self, thread_id: str, entry: T):
+        if self.on_evict is not None:
+            self.on_evict(thread_id, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -1,38 +1,252 @@
+import asyncio
+import logging
+from collections import deque
+from enum import Enum
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union
+
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict
+
+from utils.Metrics import registry
+from utils.WireProtocol import ProtocolOptions, encode_frame
 
 '''
 ConnectionManager is a class that manages the connections to the websocket.
 It allows for sending messages to a specific thread or broadcasting to all threads.
+
+Every socket gets a bounded outbound queue drained by its own writer task, so
+sending never waits on the network and one slow client can't stall the others.
+A thread_id may have several sockets open at once (e.g. a reconnect racing the
+old connection); messages for the thread go to all of them. Dict frames are
+encoded by each socket's writer for the protocol that socket negotiated; with
+an offload hook set, agent responses (whole runs of messages) are encoded
+through it, off the event loop. With the coalesce policy, a droppable frame that
+a coalesce hook can merge into the droppable frame at the end of the queue (e.g.
+the next token delta of the same message) replaces it instead of taking a slot.
 '''
 
+Frame = Union[str, bytes, dict]
+
+logger = logging.getLogger(__name__)
+
+send_seconds = registry.histogram("ws_send_seconds", "Latency of individual WebSocket sends.")
+
+
+class SlowConsumerPolicy(str, Enum):
+    # What to do when a socket's outbound queue is full. Only frames sent with
+    # droppable=True (e.g. streaming deltas) are ever dropped; if there is
+    # nothing droppable to shed the socket is disconnected.
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    DISCONNECT = "disconnect"
+    # Merges droppable frames while the writer is behind, then sheds like drop_oldest
+    COALESCE = "coalesce"
+
+
+class Connection:
+    def __init__(
+        self,
+        manager: "ConnectionManager",
+        thread_id: str,
+        websocket: WebSocket,
+        max_queue: int,
+        send_timeout: float,
+        policy: SlowConsumerPolicy,
+        options: Optional[ProtocolOptions] = None,
+    ):
+        self.manager = manager
+        self.thread_id = thread_id
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.policy = policy
+        self.options = options or ProtocolOptions()
+        self.queue: Deque[Tuple[Frame, bool]] = deque()
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame: Frame, droppable: bool = False) -> bool:
+        if self.closed:
+            return False
+        if droppable and self.policy == SlowConsumerPolicy.COALESCE and self._coalesce(frame):
+            return True
+        if len(self.queue) >= self.max_queue and not self._shed(droppable):
+            self.dropped += 1
+            return False
+        self.queue.append((frame, droppable))
+        self._ready.set()
+        return True
+
+    def _coalesce(self, frame: Frame) -> bool:
+        # Only the tail: the writer pops from the front, so a queued tail frame isn't being sent
+        coalesce = self.manager.coalesce
+        if coalesce is None or not self.queue or not self.queue[-1][1]:
+            return False
+        merged = coalesce(self.queue[-1][0], frame)
+        if merged is None:
+            return False
+        self.queue[-1] = (merged, True)
+        self.coalesced += 1
+        return True
+
+    def _shed(self, incoming_droppable: bool) -> bool:
+        """Make room for one frame. Returns False if the incoming frame should be dropped instead."""
+        if self.policy == SlowConsumerPolicy.DISCONNECT:
+            self.close(slow=True)
+            return False
+        if self.policy == SlowConsumerPolicy.DROP_NEWEST and incoming_droppable:
+            return False
+        for index, (_, droppable) in enumerate(self.queue):
+            if droppable:
+                del self.queue[index]
+                self.dropped += 1
+                return True
+        if incoming_droppable:
+            return False
+        # Queue is full of frames the client must not miss: it can't keep up.
+        self.close(slow=True)
+        return False
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                frame, _ = self.queue.popleft()
+                with send_seconds.time():
+                    await asyncio.wait_for(self._send(frame), timeout=self.send_timeout)
+                self.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            logger.warning("Send timed out after %ss, dropping connection", self.send_timeout, extra={"thread_id": self.thread_id})
+            self.close(slow=True)
+        except (WebSocketDisconnect, RuntimeError, ConnectionError) as e:
+            logger.info("Send failed, dropping connection: %r", e, extra={"thread_id": self.thread_id})
+            self.close()
+        except Exception:
+            # e.g. a frame that can't be encoded; without a writer the socket would only look alive
+            logger.exception("Writer failed, dropping connection", extra={"thread_id": self.thread_id})
+            self.close(error=True)
+
+    async def _send(self, frame: Frame):
+        if isinstance(frame, dict):
+            if self.manager.offload is not None and frame.get("event") == "agent_response":
+                frame = await self.manager.offload(encode_frame, frame, self.options)
+            else:
+                frame = encode_frame(frame, self.options)
+        if isinstance(frame, bytes):
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+
+    def close(self, slow: bool = False, error: bool = False):
+        if self.closed:
+            return
+        self.closed = True
+        self._ready.set()
+        self.manager._remove(self)
+        if slow:
+            self.manager.slow_disconnects += 1
+            asyncio.create_task(self._close_socket(1013))  # Try again later
+        elif error:
+            asyncio.create_task(self._close_socket(1011))  # Internal error
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    def __init__(
+        self,
+        max_queue: int = 256,
+        send_timeout: float = 10.0,
+        policy: SlowConsumerPolicy = SlowConsumerPolicy.DROP_OLDEST,
+    ):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.policy = SlowConsumerPolicy(policy)
+        self.active_connections: Dict[str, List[Connection]] = {}
+        # Optional hook called with every frame sent to a thread, e.g. to forward it
+        # to sockets of the same thread_id held by another worker process
+        self.relay: Optional[Callable[[str, Frame, bool], None]] = None
+        # Optional hook that runs a sync call off the event loop, used to encode large frames
+        self.offload: Optional[Callable[..., Awaitable[Any]]] = None
+        # Optional hook for the coalesce policy: returns one frame superseding (older, newer), or None
+        self.coalesce: Optional[Callable[[Frame, Frame], Optional[Frame]]] = None
+        self.slow_disconnects = 0
+        self._dropped_closed = 0
+        self._sent_closed = 0
+        self._coalesced_closed = 0
 
-    async def connect(self, thread_id: str, websocket: WebSocket):
+    async def connect(self, thread_id: str, websocket: WebSocket, options: Optional[ProtocolOptions] = None) -> Connection:
         await websocket.accept()
-        self.active_connections[thread_id] = websocket
-        print(f"Client connected: {thread_id}")
-
-    def disconnect(self, thread_id: str):
-        if thread_id in self.active_connections:
-            del self.active_connections[thread_id]
-            print(f"Client disconnected: {thread_id}")
-
-    async def send_message(self, thread_id: str, message: str):
-        websocket = self.active_connections.get(thread_id)
-        if websocket:
-            await websocket.send_text(message)
-            print(f"Sent message to {thread_id}: {message}")
-            
-    async def send_message_json(self, thread_id: str, message: dict):
-        websocket = self.active_connections.get(thread_id)
-        if websocket:
-            await websocket.send_json(message)
-            print(f"Sent message to {thread_id}: {message}")
-
-    async def broadcast(self, message: str):
-        for thread_id, websocket in self.active_connections.items():
-            await websocket.send_text(message)
-            print(f"Broadcast message to {thread_id}: {message}")
\ No newline at end of file
+        connection = Connection(self, thread_id, websocket, self.max_queue, self.send_timeout, self.policy, options)
+        self.active_connections.setdefault(thread_id, []).append(connection)
+        connection.start()
+        logger.info("Client connected", extra={"thread_id": thread_id})
+        return connection
+
+    def disconnect(self, thread_id: str, websocket: Optional[WebSocket] = None):
+        for connection in list(self.active_connections.get(thread_id, [])):
+            if websocket is None or connection.websocket is websocket:
+                connection.close()
+        logger.info("Client disconnected", extra={"thread_id": thread_id})
+
+    def _remove(self, connection: Connection):
+        connections = self.active_connections.get(connection.thread_id, [])
+        if connection in connections:
+            connections.remove(connection)
+            self._dropped_closed += connection.dropped
+            self._sent_closed += connection.sent
+            self._coalesced_closed += connection.coalesced
+        if not connections:
+            self.active_connections.pop(connection.thread_id, None)
+
+    async def send_message(self, thread_id: str, message: Union[str, bytes], droppable: bool = False):
+        self.deliver(thread_id, message, droppable)
+        if self.relay is not None:
+            self.relay(thread_id, message, droppable)
+
+    async def send_message_json(self, thread_id: str, message: dict, droppable: bool = False):
+        self.deliver(thread_id, message, droppable)
+        if self.relay is not None:
+            self.relay(thread_id, message, droppable)
+
+    def deliver(self, thread_id: str, message: Frame, droppable: bool = False):
+        """Enqueue a frame on this process's sockets for thread_id only."""
+        for connection in self.active_connections.get(thread_id, []):
+            connection.enqueue(message, droppable)
+
+    async def broadcast(self, message: str, droppable: bool = False):
+        # Enqueueing never blocks; each socket's writer sends concurrently with its own timeout
+        for connections in list(self.active_connections.values()):
+            for connection in connections:
+                connection.enqueue(message, droppable)
+
+    def metrics(self) -> Dict[str, Any]:
+        connections = [c for cs in self.active_connections.values() for c in cs]
+        depths = [len(c.queue) for c in connections]
+        return {
+            "threads": len(self.active_connections),
+            "connections": len(connections),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "frames_sent": self._sent_closed + sum(c.sent for c in connections),
+            "frames_dropped": self._dropped_closed + sum(c.dropped for c in connections),
+            "frames_coalesced": self._coalesced_closed + sum(c.coalesced for c in connections),
+            "slow_disconnects": self.slow_disconnects,
+        }
@@ -0,0 +1,231 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pydantic_core
+from langchain_core.messages import BaseMessage, ChatMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+
+'''
+HistoryCompactor keeps a thread's message history within a token budget before
+each run. Leading system messages and the last keep_recent_turns turns (a turn
+starts at a user message) are never touched. When the history is over budget:
+
+1. tool outputs in older turns are cut to tool_output_limit characters;
+2. if that isn't enough, the oldest turns are dropped whole, so tool calls and
+   their results go together, and replaced by one summary message: a running
+   summary written by `summarize` when one is configured, otherwise a note that
+   earlier messages were removed.
+
+compact() returns the message updates for the "messages" channel (edited copies
+under the same ids, RemoveMessage for dropped ones), which the caller writes to
+the checkpoint so the work is done once rather than on every turn. The summary
+takes over the id of the first message it replaces, so it stays in place.
+
+Token counts are cached per message id and content length; only messages that
+are new or were edited since the last call are counted. Tokens are counted with
+tiktoken once load_encoding() has run, which may download the vocabulary and so
+must be called off the event loop; until then they are estimated from length.
+'''
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_NAME = "conversation_summary"
+
+# (previous summary or "", messages being dropped) -> new summary
+Summarizer = Callable[[str, List[BaseMessage]], Awaitable[str]]
+
+
+def _content_text(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else pydantic_core.to_json(message.content).decode()
+
+
+def _is_user_message(message: BaseMessage) -> bool:
+    return isinstance(message, HumanMessage) or (isinstance(message, ChatMessage) and message.role == "user")
+
+
+def _is_summary(message: BaseMessage) -> bool:
+    return isinstance(message, SystemMessage) and message.name == SUMMARY_NAME
+
+
+class HistoryCompactor:
+    def __init__(
+        self,
+        max_tokens: int = 32000,
+        keep_recent_turns: int = 4,
+        tool_output_limit: int = 2000,
+        summarize: Optional[Summarizer] = None,
+        max_cached: int = 100_000,
+    ):
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.tool_output_limit = tool_output_limit
+        self.summarize = summarize
+        self.max_cached = max_cached
+        self._counts: "OrderedDict[Tuple[Any, str, int], int]" = OrderedDict()
+        self._encoding = None
+        self._encoding_lock = threading.Lock()
+        self._encoding_loaded = False
+        # Whether cached counts came from the encoding rather than the estimate
+        self._counts_exact = False
+        self.compactions = 0
+        self.tokens_removed = 0
+        self.count_hits = 0
+        self.count_misses = 0
+
+    def load_encoding(self):
+        """Blocking: loads the tokenizer, downloading its vocabulary on a cold cache."""
+        with self._encoding_lock:
+            if self._encoding_loaded:
+                return
+            try:
+                import tiktoken
+
+                self._encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # tiktoken may be missing or unable to fetch its vocabulary; estimate instead
+                logger.info("Counting tokens by estimate: %s", e)
+            self._encoding_loaded = True
+
+    def _encode_length(self, text: str) -> int:
+        encoding = self._encoding
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return len(text) // 4
+
+    def count(self, message: BaseMessage) -> int:
+        if self._encoding is not None and not self._counts_exact:
+            # The encoding just became available: recount instead of reusing estimates
+            self._counts.clear()
+            self._counts_exact = True
+        text = _content_text(message)
+        key = (message.id, message.type, len(text))
+        cached = self._counts.get(key) if message.id is not None else None
+        if cached is not None:
+            self.count_hits += 1
+            self._counts.move_to_end(key)
+            return cached
+        self.count_misses += 1
+        tokens = self._encode_length(text) + 4
+        tool_calls = getattr(message, "tool_calls", None)
+        if tool_calls:
+            tokens += self._encode_length(pydantic_core.to_json(tool_calls).decode())
+        if message.id is not None:
+            self._counts[key] = tokens
+            if len(self._counts) > self.max_cached:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def total(self, messages: List[BaseMessage]) -> int:
+        return sum(self.count(message) for message in messages)
+
+    def _split(self, messages: List[BaseMessage]) -> Tuple[int, int]:
+        """Index where the history after the system prompt starts, and where the recent turns start."""
+        start = 0
+        while start < len(messages) and isinstance(messages[start], SystemMessage) and not _is_summary(messages[start]):
+            start += 1
+        recent = len(messages)
+        turns = 0
+        for index in range(len(messages) - 1, start - 1, -1):
+            if _is_user_message(messages[index]):
+                turns += 1
+                recent = index
+                if turns >= self.keep_recent_turns:
+                    break
+        return start, recent
+
+    def _truncated(self, message: BaseMessage) -> Optional[BaseMessage]:
+        if not isinstance(message, ToolMessage) or not isinstance(message.content, str):
+            return None
+        if len(message.content) <= self.tool_output_limit:
+            return None
+        elided = len(message.content) - self.tool_output_limit
+        content = f"{message.content[:self.tool_output_limit]}\n[... {elided} characters of tool output elided]"
+        return message.model_copy(update={"content": content})
+
+    async def compact(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """Updates that bring messages within max_tokens; empty when they already fit."""
+        total = before = self.total(messages)
+        if total <= self.max_tokens:
+            return []
+
+        start, recent = self._split(messages)
+        history = list(messages)
+        updates: Dict[str, BaseMessage] = {}
+
+        for index in range(start, recent):
+            truncated = self._truncated(history[index])
+            if truncated is not None:
+                total += self.count(truncated) - self.count(history[index])
+                history[index] = truncated
+                updates[truncated.id] = truncated
+
+        if total > self.max_tokens:
+            # Drop whole turns, oldest first, until the rest fits
+            end = start
+            remaining = total
+            while end < recent and remaining > self.max_tokens:
+                remaining -= self.count(history[end])
+                end += 1
+                while end < recent and not _is_user_message(history[end]):
+                    remaining -= self.count(history[end])
+                    end += 1
+            dropped = history[start:end]
+            if dropped:
+                summary = await self._summary(dropped)
+                total += self.count(summary) - self.total(dropped)
+                for message in dropped:
+                    updates[message.id] = RemoveMessage(id=message.id)
+                updates[summary.id] = summary
+
+        if not updates:
+            # Only the protected messages are left; nothing more to take out
+            return []
+        self.compactions += 1
+        self.tokens_removed += before - total
+        logger.info("Compacted history", extra={"tokens_before": before, "tokens_after": total})
+        return list(updates.values())
+
+    async def _summary(self, dropped: List[BaseMessage]) -> SystemMessage:
+        previous = next((message for message in dropped if _is_summary(message)), None)
+        previous_text = _content_text(previous) if previous is not None else ""
+        rest = [message for message in dropped if message is not previous]
+        text = None
+        if self.summarize is not None:
+            try:
+                text = await self.summarize(previous_text, rest)
+            except Exception:
+                logger.exception("Summarizing history failed")
+        if text is not None:
+            return SystemMessage(content=text, name=SUMMARY_NAME, id=dropped[0].id)
+
+        # No summary: leave a note, carrying over an earlier written summary if there is one
+        removed = len(rest)
+        if previous is not None and "removed_messages" in previous.additional_kwargs:
+            removed += previous.additional_kwargs["removed_messages"]
+            previous_text = ""
+        note = f"[{removed} earlier messages of this conversation were removed to fit the context window.]"
+        content = f"{previous_text}\n{note}" if previous_text else note
+        return SystemMessage(content=content, name=SUMMARY_NAME, id=dropped[0].id, additional_kwargs={"removed_messages": removed})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "compactions": self.compactions,
+            "tokens_removed": self.tokens_removed,
+            "count_cache_size": len(self._counts),
+            "count_cache_hits": self.count_hits,
+            "count_cache_misses": self.count_misses,
+            "exact_counts": self._encoding is not None,
+        }
+
+
+async def summarize_with_model(model: Any, previous_summary: str, messages: List[BaseMessage]) -> str:
+    transcript = "\n".join(f"{message.type}: {_content_text(message)}" for message in messages if not isinstance(message, SystemMessage))
+    prompt = (
+        "Summarize this conversation between a user and an assistant using tools, so the assistant can "
+        "continue it without the original messages. Keep names, facts, decisions and open requests.\n\n"
+        + (f"Summary so far:\n{previous_summary}\n\n" if previous_summary else "")
+        + f"Conversation:\n{transcript}"
+    )
+    response = await model.ainvoke([HumanMessage(content=prompt)])
+    return _content_text(response)
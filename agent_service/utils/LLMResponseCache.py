@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import pydantic_core
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from utils.LLMScheduler import RunMetadataChatModel, run_metadata
+
+'''
+LLMResponseCache stores chat model responses under a hash of everything that
+determines them: the model and its parameters, the call kwargs (bound tool
+schemas, tool_choice, ...), stop words and the messages, minus their ids and
+response metadata. Recent entries live in an in-memory LRU; with a path, every
+entry is also written to a SQLite file whose least recently used rows are
+evicted past max_bytes, so the cache survives restarts.
+
+CachingChatModel wraps a chat model with a cache. Only deterministic calls
+(temperature 0 or unset) are cached. Streamed responses are stored as their
+chunks and replayed without delay. A thread's mode, set with set_mode() or for
+one run with the llm_cache run metadata, is "use" (the default), "refresh"
+(call the model and overwrite the entry) or "bypass" (no reads or writes).
+'''
+
+logger = logging.getLogger(__name__)
+
+CACHE_MODES = ("use", "refresh", "bypass")
+
+
+class LLMResponseCache:
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None, max_bytes: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._modes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    used_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS llm_responses_used_at ON llm_responses (used_at);
+                """
+            )
+            self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def mode(self, thread_id: str) -> str:
+        return self._modes.get(thread_id, "use")
+
+    def set_mode(self, thread_id: str, mode: str):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unsupported llm_cache mode: {mode}")
+        if mode == "use":
+            self._modes.pop(thread_id, None)
+        else:
+            self._modes[thread_id] = mode
+
+    def drop(self, thread_id: str):
+        self._modes.pop(thread_id, None)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        blob = self._entries.get(key)
+        if blob is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+        elif self._conn is not None:
+            blob = await asyncio.to_thread(self._disk_get, key)
+            if blob is not None:
+                self._remember(key, blob)
+                self.disk_hits += 1
+        if blob is None:
+            self.misses += 1
+            return None
+        return pickle.loads(blob)
+
+    async def put(self, key: str, entry: Dict[str, Any]):
+        blob = pickle.dumps(entry)
+        self._remember(key, blob)
+        self.stores += 1
+        if self._conn is not None:
+            await asyncio.to_thread(self._disk_put, key, blob)
+
+    def _remember(self, key: str, blob: bytes):
+        self._entries[key] = blob
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE llm_responses SET used_at = ? WHERE key = ?", (time.time(), key))
+            return row[0] if row is not None else None
+
+    def _disk_put(self, key: str, blob: bytes):
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, value, size, used_at) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time()),
+            )
+            self._disk_bytes += len(blob) - (row[0] if row is not None else 0)
+            while self._disk_bytes > self.max_bytes:
+                oldest = self._conn.execute(
+                    "SELECT key, size FROM llm_responses ORDER BY used_at LIMIT 64"
+                ).fetchall()
+                if not oldest:
+                    break
+                for old_key, size in oldest:
+                    if self._disk_bytes <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (old_key,))
+                    self._disk_bytes -= size
+                    self.evictions += 1
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "disk_bytes": self._disk_bytes,
+            "threads_not_using_cache": len(self._modes),
+        }
+
+
+def _message_key(message: BaseMessage) -> Dict[str, Any]:
+    # Ids and provider metadata differ between otherwise identical conversations
+    return message.model_dump(exclude={"id", "response_metadata", "usage_metadata"})
+
+
+def _to_chunk(generation: ChatGeneration) -> ChatGenerationChunk:
+    message = generation.message
+    return ChatGenerationChunk(
+        message=AIMessageChunk(
+            content=message.content,
+            additional_kwargs=message.additional_kwargs,
+            response_metadata=message.response_metadata,
+            usage_metadata=getattr(message, "usage_metadata", None),
+            tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+                for index, call in enumerate(getattr(message, "tool_calls", None) or [])
+            ],
+        ),
+        generation_info=generation.generation_info,
+    )
+
+
+def _without_ids(generations: List[Any]) -> List[Any]:
+    # A replayed message must not reuse the cached id, or it would replace the original in the thread's state
+    for generation in generations:
+        generation.message.id = None
+    return generations
+
+
+class CachingChatModel(RunMetadataChatModel):
+    model: BaseChatModel
+    response_cache: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return self.model._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.model._identifying_params
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        bound = self.model.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    def _mode(self, run_manager: Any) -> str:
+        metadata = run_metadata(run_manager)
+        if self._identifying_params.get("temperature") not in (None, 0):
+            return "bypass"
+        if metadata.get("llm_cache") in CACHE_MODES:
+            return metadata["llm_cache"]
+        return self.response_cache.mode(str(metadata.get("thread_id", "")))
+
+    def _key(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> str:
+        payload = {
+            "llm": self._llm_type,
+            "params": self._identifying_params,
+            "stop": stop,
+            "kwargs": kwargs,
+            "messages": [_message_key(message) for message in messages],
+        }
+        return hashlib.sha256(pydantic_core.to_json(payload, fallback=repr)).hexdigest()
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        return self.model._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        mode = self._mode(run_manager)
+        if mode == "bypass":
+            self.response_cache.bypassed += 1
+            return await self.model._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        key = self._key(messages, stop, kwargs)
+        entry = await self.response_cache.get(key) if mode == "use" else None
+        if entry is not None:
+            if "chunks" in entry:
+                return generate_from_stream(iter(_without_ids(entry["chunks"])))
+            return ChatResult(generations=_without_ids(entry["generations"]), llm_output=entry["llm_output"])
+
+        result = await self.model._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        await self.response_cache.put(key, {"generations": result.generations, "llm_output": result.llm_output})
+        return result
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        mode = self._mode(run_manager)
+        if mode == "bypass":
+            self.response_cache.bypassed += 1
+            async for chunk in self.model._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+
+        key = self._key(messages, stop, kwargs)
+        entry = await self.response_cache.get(key) if mode == "use" else None
+        if entry is not None:
+            chunks = entry["chunks"] if "chunks" in entry else [_to_chunk(generation) for generation in entry["generations"]]
+            for chunk in _without_ids(chunks):
+                yield chunk
+            return
+
+        chunks = []
+        async for chunk in self.model._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        # Only a stream that ran to completion is stored
+        await self.response_cache.put(key, {"chunks": chunks})
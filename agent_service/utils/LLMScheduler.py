@@ -0,0 +1,401 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import pydantic_core
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import ensure_config, var_child_runnable_config
+
+from utils.Metrics import registry
+
+'''
+LLMScheduler admits every chat model call in the process through one queue.
+Calls wait until three things allow them: the request and token budgets
+(token buckets refilled per minute, 0 disables either), and the concurrency
+limit. Waiting calls are served highest priority first and round-robin across
+thread_ids within a priority, so one busy thread can't starve the others.
+
+The concurrency limit adapts (AIMD): it grows by 1/limit per successful call,
+halves on a rate limit error and shrinks by 10% when a call exceeds the latency
+target. A rate limit error also pauses dispatch for its Retry-After (or an
+exponential backoff), then the call is retried from the queue.
+
+SchedulingChatModel wraps a chat model so its calls go through a scheduler. It
+reads thread_id and llm_priority from the run metadata, which LangGraph fills in
+from the run config.
+'''
+
+queue_wait_seconds = registry.histogram(
+    "llm_queue_wait_seconds", "Time chat model calls waited for the LLM scheduler.", ["priority"]
+)
+call_seconds = registry.histogram(
+    "llm_call_seconds", "Latency of chat model calls admitted by the LLM scheduler.", ["outcome"]
+)
+
+RATE_LIMIT_STATUS = 429
+TRANSIENT_ERRORS = ("APIConnectionError", "APITimeoutError", "InternalServerError")
+
+
+def run_metadata(run_manager: Any) -> Dict[str, Any]:
+    """
+    Metadata of the chat model run being executed. BaseChatModel doesn't hand the
+    run manager to _astream, so fall back to the config of the calling runnable.
+    """
+    metadata = getattr(run_manager, "metadata", None)
+    if metadata is None:
+        metadata = (var_child_runnable_config.get() or {}).get("metadata")
+    return metadata or {}
+
+
+class RunMetadataChatModel(BaseChatModel):
+    """
+    Base of the wrapper models whose _astream reads run_metadata. Called without a
+    parent runnable (e.g. model.astream(messages, config)), there is no calling
+    config to fall back to, so astream makes the call's own config current while
+    _astream runs, as a parent runnable would.
+    """
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        config = ensure_config(config)
+        current = {key: value for key, value in config.items() if key != "run_id"}
+        stream = super().astream(input, config, **kwargs)
+        try:
+            while True:
+                # Set per step: the consumer may resume this generator from another context
+                token = var_child_runnable_config.set(current)
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    var_child_runnable_config.reset(token)
+                yield chunk
+        finally:
+            await stream.aclose()
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken. A request larger than the bucket waits for a full one."""
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if self.enabled:
+            self.tokens -= amount
+
+    def correct(self, amount: float):
+        # The actual usage differed from the estimate taken up front; may go negative (a debt)
+        if self.enabled:
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _Waiter:
+    __slots__ = ("thread_id", "priority", "tokens", "future", "enqueued")
+
+    def __init__(self, thread_id: str, priority: int, tokens: int, future: asyncio.Future):
+        self.thread_id = thread_id
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 64,
+        latency_target: float = 0.0,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        # Seconds; a slower successful call counts as congestion. 0 disables it.
+        self.latency_target = latency_target
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.in_flight = 0
+        # priority -> thread_id -> waiting calls of that thread, in rotation order
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Waiter]]"] = {}
+        self._waiting = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._rate_limit_streak = 0
+        self.granted = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.errors = 0
+
+    async def acquire(self, thread_id: str, priority: int = 0, tokens: int = 0):
+        """Wait for a slot; every acquire must be followed by release()."""
+        waiter = _Waiter(thread_id, priority, tokens, asyncio.get_running_loop().create_future())
+        level = self._queues.setdefault(priority, OrderedDict())
+        level.setdefault(thread_id, deque()).append(waiter)
+        self._waiting += 1
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller went away
+                self.in_flight -= 1
+                self._dispatch()
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self, started: float, estimated: int, used: Optional[int] = None,
+                error: Optional[BaseException] = None) -> Optional[float]:
+        """
+        Record how an admitted call went and free its slot. Returns the delay
+        before retrying it, or None when the error (if any) isn't retryable.
+        """
+        now = time.monotonic()
+        latency = now - started
+        self.in_flight -= 1
+        if used is not None:
+            self.tokens.correct(used - estimated)
+
+        retry_delay = None
+        if error is None:
+            self._rate_limit_streak = 0
+            call_seconds.observe(latency, outcome="ok")
+            if self.latency_target and latency > self.latency_target:
+                self._decrease(0.9, started)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        elif _status_code(error) == RATE_LIMIT_STATUS:
+            self.rate_limited += 1
+            self._rate_limit_streak += 1
+            call_seconds.observe(latency, outcome="rate_limited")
+            self._decrease(0.5, started)
+            delay = _retry_after(error) or self.backoff * 2 ** min(self._rate_limit_streak - 1, 6)
+            # Everyone waits out a rate limit, not only the call that hit it
+            self._paused_until = max(self._paused_until, now + delay)
+            retry_delay = 0.0
+        elif not isinstance(error, Exception):
+            # Cancelled, or the stream was closed by its consumer
+            call_seconds.observe(latency, outcome="cancelled")
+        else:
+            self.errors += 1
+            call_seconds.observe(latency, outcome="error")
+            status = _status_code(error)
+            if (status is not None and status >= 500) or type(error).__name__ in TRANSIENT_ERRORS:
+                retry_delay = self.backoff
+        self._dispatch()
+        return retry_delay
+
+    def _decrease(self, factor: float, started: float):
+        # Calls that started before the last decrease saw the old limit; count congestion once per window
+        if started < self._last_decrease:
+            return
+        self.limit = max(self.min_concurrency, self.limit * factor)
+        self._last_decrease = time.monotonic()
+
+    def _remove(self, waiter: _Waiter):
+        level = self._queues.get(waiter.priority)
+        waiters = level.get(waiter.thread_id) if level is not None else None
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        self._waiting -= 1
+        if not waiters:
+            del level[waiter.thread_id]
+            if not level:
+                del self._queues[waiter.priority]
+
+    def _next(self) -> Tuple[int, str, _Waiter]:
+        priority = max(self._queues)
+        thread_id, waiters = next(iter(self._queues[priority].items()))
+        return priority, thread_id, waiters[0]
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiting and self.in_flight < int(self.limit):
+            now = time.monotonic()
+            priority, thread_id, waiter = self._next()
+            wait = max(self._paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(waiter.tokens, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            level = self._queues[priority]
+            level[thread_id].popleft()
+            self._waiting -= 1
+            if level[thread_id]:
+                level.move_to_end(thread_id)
+            else:
+                del level[thread_id]
+                if not level:
+                    del self._queues[priority]
+
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            self.in_flight += 1
+            self.granted += 1
+            queue_wait_seconds.observe(now - waiter.enqueued, priority=priority)
+            waiter.future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": self._waiting,
+            "granted": self.granted,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "errors": self.errors,
+            "paused_seconds": round(max(0.0, self._paused_until - time.monotonic()), 3),
+            "request_budget": round(self.requests.tokens, 1) if self.requests.enabled else None,
+            "token_budget": round(self.tokens.tokens) if self.tokens.enabled else None,
+        }
+
+
+def estimate_tokens(messages: List[BaseMessage], tools: Any = None) -> int:
+    # ~4 characters per token; only has to be close enough for budgeting
+    chars = sum(len(message.content) if isinstance(message.content, str) else len(pydantic_core.to_json(message.content))
+                for message in messages)
+    chars += sum(len(pydantic_core.to_json(getattr(message, "tool_calls", None) or [])) for message in messages)
+    if tools:
+        chars += len(pydantic_core.to_json(tools, fallback=str))
+    return chars // 4 + 4 * len(messages)
+
+
+def _result_tokens(result: ChatResult) -> Optional[int]:
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    if usage.get("total_tokens") is not None:
+        return usage["total_tokens"]
+    totals = [getattr(generation.message, "usage_metadata", None) for generation in result.generations]
+    if totals and all(totals):
+        return sum(usage["total_tokens"] for usage in totals)
+    return None
+
+
+class SchedulingChatModel(RunMetadataChatModel):
+    model: BaseChatModel
+    scheduler: Any
+    # Completion tokens budgeted per call before the real usage is known
+    expected_output_tokens: int = 256
+
+    @property
+    def _llm_type(self) -> str:
+        return self.model._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.model._identifying_params
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        # Let the wrapped model format the tools, then bind the resulting call kwargs to the wrapper
+        bound = self.model.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    def _caller(self, run_manager: Any) -> Tuple[str, int]:
+        metadata = run_metadata(run_manager)
+        return str(metadata.get("thread_id", "")), int(metadata.get("llm_priority", 0))
+
+    def _estimate(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> int:
+        return estimate_tokens(messages, kwargs.get("tools")) + self.expected_output_tokens
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        # The scheduler lives on the event loop; synchronous calls bypass it
+        return self.model._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        thread_id, priority = self._caller(run_manager)
+        estimated = self._estimate(messages, kwargs)
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(thread_id, priority, estimated)
+            started = time.monotonic()
+            try:
+                result = await self.model._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except BaseException as e:
+                delay = self.scheduler.release(started, estimated, error=e)
+                if delay is None or attempt >= self.scheduler.max_retries:
+                    raise
+                attempt += 1
+                self.scheduler.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            self.scheduler.release(started, estimated, used=_result_tokens(result))
+            return result
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        thread_id, priority = self._caller(run_manager)
+        estimated = self._estimate(messages, kwargs)
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(thread_id, priority, estimated)
+            started = time.monotonic()
+            used = None
+            streamed = False
+            try:
+                async for chunk in self.model._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    streamed = True
+                    usage = getattr(chunk.message, "usage_metadata", None)
+                    if usage:
+                        used = (used or 0) + usage.get("total_tokens", 0)
+                    yield chunk
+            except BaseException as e:
+                delay = self.scheduler.release(started, estimated, error=e)
+                # Once chunks have gone out the call can't be replayed
+                if delay is None or streamed or attempt >= self.scheduler.max_retries:
+                    raise
+                attempt += 1
+                self.scheduler.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            self.scheduler.release(started, estimated, used=used)
+            return
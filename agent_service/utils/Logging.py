@@ -0,0 +1,49 @@
+import json
+import logging
+from typing import Any, Dict
+
+'''
+Logging setup for the agent service. Log calls pass structured fields through
+`extra={...}`; StructuredFormatter appends them as key=value pairs, or emits
+one JSON object per line with LOG_FORMAT=json.
+'''
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED}
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, as_json: bool = False):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+        self.as_json = as_json
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not self.as_json:
+            line = super().format(record)
+            fields = _fields(record)
+            if fields:
+                line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+            return line
+
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def configure_logging(level: str = "INFO", fmt: str = "text"):
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(as_json=fmt.lower() == "json"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
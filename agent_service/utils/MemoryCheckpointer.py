@@ -0,0 +1,73 @@
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata
+from langgraph.checkpoint.memory import MemorySaver
+
+'''
+MemoryCheckpointer is LangGraph's in-process MemorySaver with the same
+retention as SqliteCheckpointer: only the newest keep_last checkpoints of each
+thread are retained, along with their pending writes and the channel values
+they still reference. Without it every super-step of every thread stays in
+memory for the life of the process.
+'''
+
+
+class MemoryCheckpointer(MemorySaver):
+    def __init__(self, keep_last: Optional[int] = 20, serde: Optional[object] = None):
+        super().__init__(serde=serde)
+        self.keep_last = keep_last
+        self._lock = threading.Lock()
+        # Channel versions of each stored checkpoint, and the blobs stored per thread and namespace,
+        # so pruning doesn't have to decode checkpoints or scan every thread's blobs
+        self._versions: Dict[Tuple[str, str, str], ChannelVersions] = {}
+        self._blob_keys: Dict[Tuple[str, str], Set[Tuple[str, object]]] = {}
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+            self._versions[(thread_id, checkpoint_ns, checkpoint["id"])] = dict(checkpoint["channel_versions"])
+            self._blob_keys.setdefault((thread_id, checkpoint_ns), set()).update(new_versions.items())
+            if self.keep_last:
+                self._prune(thread_id, checkpoint_ns)
+            return next_config
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_last:
+            return
+        # Checkpoint ids sort by creation time
+        checkpoint_ids = sorted(checkpoints, reverse=True)
+        for checkpoint_id in checkpoint_ids[self.keep_last:]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        referenced = set()
+        for checkpoint_id in checkpoint_ids[:self.keep_last]:
+            versions = self._versions.get((thread_id, checkpoint_ns, checkpoint_id))
+            if versions is None:
+                # Stored some other way; its blobs are unknown, so keep them all
+                return
+            referenced.update(versions.items())
+        blob_keys = self._blob_keys[(thread_id, checkpoint_ns)]
+        for channel, version in blob_keys - referenced:
+            self.blobs.pop((thread_id, checkpoint_ns, channel, version), None)
+        blob_keys &= referenced
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            for key in [key for key in self._versions if key[0] == thread_id]:
+                del self._versions[key]
+            for key in [key for key in self._blob_keys if key[0] == thread_id]:
+                del self._blob_keys[key]
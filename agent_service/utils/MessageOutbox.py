@@ -0,0 +1,79 @@
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List
+
+'''
+MessageOutbox numbers the messages each thread sends to its clients with a
+per-thread sequence number. A message that was already sent (the same id shows
+up again in a later run, e.g. the tool call an interrupted run resumes from) is
+not numbered twice, so protocol v2 responses only carry what is new. Messages
+stay buffered until the client acknowledges their seq, which lets a client that
+reconnects ask for everything after the last seq it saw.
+'''
+
+
+class _ThreadLog:
+    def __init__(self, max_entries: int):
+        self.last_seq = 0
+        self.acked = 0
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=max_entries)
+        # Ids of messages already numbered; bounded, only recent runs can repeat a message
+        self.seen: "OrderedDict[str, None]" = OrderedDict()
+
+
+class MessageOutbox:
+    def __init__(self, max_entries: int = 256, max_seen: int = 1024):
+        self.max_entries = max_entries
+        self.max_seen = max_seen
+        self._threads: Dict[str, _ThreadLog] = {}
+
+    def _log(self, thread_id: str) -> _ThreadLog:
+        log = self._threads.get(thread_id)
+        if log is None:
+            log = self._threads[thread_id] = _ThreadLog(self.max_entries)
+        return log
+
+    def append(self, thread_id: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Number the messages not sent before. Returns copies of them with "seq" set."""
+        log = self._log(thread_id)
+        added = []
+        for message in messages:
+            message_id = message.get("id")
+            if message_id is not None:
+                if message_id in log.seen:
+                    continue
+                log.seen[message_id] = None
+                if len(log.seen) > self.max_seen:
+                    log.seen.popitem(last=False)
+            log.last_seq += 1
+            entry = {"seq": log.last_seq, **message}
+            log.entries.append(entry)
+            added.append(entry)
+        return added
+
+    def since(self, thread_id: str, seq: int) -> List[Dict[str, Any]]:
+        log = self._threads.get(thread_id)
+        if log is None:
+            return []
+        return [entry for entry in log.entries if entry["seq"] > seq]
+
+    def ack(self, thread_id: str, seq: int) -> int:
+        log = self._threads.get(thread_id)
+        if log is None:
+            return 0
+        log.acked = max(log.acked, min(seq, log.last_seq))
+        while log.entries and log.entries[0]["seq"] <= log.acked:
+            log.entries.popleft()
+        return log.acked
+
+    def last_seq(self, thread_id: str) -> int:
+        log = self._threads.get(thread_id)
+        return log.last_seq if log is not None else 0
+
+    def drop(self, thread_id: str):
+        self._threads.pop(thread_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threads": len(self._threads),
+            "buffered_messages": sum(len(log.entries) for log in self._threads.values()),
+        }
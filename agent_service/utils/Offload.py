@@ -0,0 +1,165 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+from utils.Metrics import registry
+
+'''
+Offloader runs synchronous work (SDK callbacks, agent construction, encoding
+large responses) on a bounded thread pool so it doesn't stall every other
+connection on the event loop. At most max_workers calls run at once and at
+most max_pending wait for a worker; further callers wait on the loop, without
+blocking it, until there is room. Context variables (log context) are carried
+over like asyncio.to_thread does.
+
+LoopLagMonitor measures how late the event loop runs a periodic heartbeat and
+exports it as a histogram. A watchdog thread checks the heartbeat too: when the
+loop hasn't run it for stall_threshold seconds, the loop is blocked, and the
+watchdog captures the loop thread's current stack, i.e. whatever blocking call
+the running coroutine is stuck in, logs it and keeps the latest ones for
+/health.
+'''
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+offload_wait_seconds = registry.histogram(
+    "offload_wait_seconds", "Time offloaded calls waited for a worker thread.", ["call"], buckets=LAG_BUCKETS
+)
+offload_seconds = registry.histogram(
+    "offload_seconds", "Run time of calls offloaded from the event loop.", ["call"]
+)
+loop_lag_seconds = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop ran its heartbeat.", buckets=LAG_BUCKETS
+)
+loop_stalls = registry.counter(
+    "event_loop_stalls_total", "Times the event loop was blocked for longer than the stall threshold."
+)
+
+
+class Offloader:
+    def __init__(self, max_workers: int = 8, max_pending: int = 256, thread_name_prefix: str = "offload"):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.completed = 0
+        self.errors = 0
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers + self.max_pending)
+        name = getattr(fn, "__qualname__", None) or type(fn).__name__
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        submitted = time.perf_counter()
+
+        def timed() -> T:
+            started = time.perf_counter()
+            offload_wait_seconds.observe(started - submitted, call=name)
+            try:
+                return call()
+            finally:
+                offload_seconds.observe(time.perf_counter() - started, call=name)
+
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "errors": self.errors,
+        }
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.1, stall_threshold: float = 0.5, keep_stalls: int = 10, max_stack_frames: int = 30):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.max_stack_frames = max_stack_frames
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=keep_stalls)
+        self._beat = time.monotonic()
+        self._reported_beat: Optional[float] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self.max_lag = 0.0
+        self.stall_count = 0
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True).start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            loop_lag_seconds.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if self._reported_beat == self._beat and self.stalls:
+                # The stall the watchdog reported is over: record how long it lasted
+                self.stalls[-1]["blocked_s"] = round(now - self._beat, 4)
+            self._beat = now
+
+    def _watch(self):
+        # Checks often enough to catch a stall while it is still going on
+        check_every = min(self.interval, self.stall_threshold) / 2
+        while not self._stop.wait(check_every):
+            beat = self._beat
+            behind = time.monotonic() - beat - self.interval
+            if behind < self.stall_threshold or self._reported_beat == beat:
+                continue
+            self._reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame, limit=self.max_stack_frames)) if frame is not None else ""
+            self.stall_count += 1
+            loop_stalls.inc()
+            self.stalls.append({"at": time.time(), "blocked_s": round(behind, 4), "stack": stack})
+            logger.warning("Event loop blocked for %.3fs at:\n%s", behind, stack)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "stalls": self.stall_count,
+        }
+
+    def recent_stalls(self):
+        return list(self.stalls)
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from langgraph.constants import NS_END, NS_SEP
+from langgraph.errors import GraphInterrupt, NodeInterrupt
+from langgraph.utils.runnable import coerce_to_runnable
+
+from utils.Metrics import registry
+
+'''
+parallelize_tool_node recompiles a graph so that its tool node runs the tool
+calls of one AI message concurrently. The original node is reused as is: it is
+invoked once per tool call, each time with a copy of the state whose last AI
+message carries only that call, so the node needs no changes and keeps its own
+auth and error handling.
+
+At most max_concurrency calls of a message run at once, and each is cancelled
+after timeout seconds (0 disables) and answered with an error ToolMessage so the
+model can carry on. Results are merged in the order of the tool calls, whatever
+order they finish in. Any error other than an interrupt fails the node as before.
+
+If calls raise interrupts (e.g. OAuth required), calls that haven't started yet
+are not started, calls already running finish, and the interrupts are raised
+together, as one interrupt whose value is the list of their values, so every
+missing authorization is asked for at once. LangGraph reruns the whole node on
+resume, so the results of the calls that did finish are remembered, per thread,
+node path and tool call id, and replayed on the rerun instead of running those calls (and
+their side effects, e.g. sending a message) a second time. They are kept in
+memory, for at most remember_for seconds: a rerun on a restarted process runs
+them again.
+
+Messages with a single tool call go straight to the original node.
+'''
+
+logger = logging.getLogger(__name__)
+
+tool_call_seconds = registry.histogram(
+    "tool_call_seconds", "Latency of tool calls run by the parallel tool node.", ["outcome"]
+)
+
+
+def _messages(state: Any) -> List[BaseMessage]:
+    return state["messages"] if isinstance(state, dict) else state.messages
+
+
+def _with_messages(state: Any, messages: List[BaseMessage]) -> Any:
+    if isinstance(state, dict):
+        return {**state, "messages": messages}
+    return state.model_copy(update={"messages": messages})
+
+
+def _single_call(message: AIMessage, call: Dict[str, Any]) -> AIMessage:
+    additional_kwargs = dict(message.additional_kwargs)
+    if "tool_calls" in additional_kwargs:
+        # The provider's raw copy of the calls, read by nodes that parse it themselves
+        additional_kwargs["tool_calls"] = [raw for raw in additional_kwargs["tool_calls"] if raw.get("id") == call["id"]]
+    return message.model_copy(update={"tool_calls": [call], "additional_kwargs": additional_kwargs})
+
+
+# Stands in for the result of a call not started because another call was interrupted
+_NOT_STARTED = object()
+
+
+class ParallelToolNode:
+    def __init__(self, node: Runnable, max_concurrency: int = 8, timeout: float = 60.0,
+                 remember_for: float = 3600.0, max_remembered: int = 10_000):
+        self.node = node
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.remember_for = remember_for
+        self.max_remembered = max_remembered
+        # (thread_id, node path, tool_call_id) -> (expires_at, result) of calls that finished
+        # in a run that was interrupted, oldest first
+        self._finished: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    async def __call__(self, state: Any, config: RunnableConfig) -> Any:
+        messages = _messages(state)
+        last = messages[-1] if messages else None
+        tool_calls = getattr(last, "tool_calls", None) or []
+        if len(tool_calls) < 2:
+            return await self.node.ainvoke(state, config)
+
+        keys = [self._key(config, call) for call in tool_calls]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        interrupted = asyncio.Event()
+        results = await asyncio.gather(
+            *(self._run_call(state, messages, last, call, key, semaphore, interrupted, config) for call, key in zip(tool_calls, keys)),
+            return_exceptions=True,
+        )
+
+        interrupts = []
+        for result in results:
+            if isinstance(result, GraphInterrupt):
+                interrupts.extend(interrupt.value for interrupt in result.args[0])
+            elif isinstance(result, BaseException):
+                raise result
+        if interrupts:
+            for key, result in zip(keys, results):
+                if key is not None and result is not _NOT_STARTED and not isinstance(result, BaseException):
+                    self._remember(key, result)
+            # A task keeps only one interrupt in the checkpoint, so several are raised as a list
+            raise NodeInterrupt(interrupts[0] if len(interrupts) == 1 else interrupts)
+        for key in keys:
+            if key is not None:
+                self._finished.pop(key, None)
+        return self._merge(results)
+
+    @staticmethod
+    def _key(config: RunnableConfig, call: Dict[str, Any]) -> Optional[Hashable]:
+        configurable = config.get("configurable") or {}
+        thread_id = configurable.get("thread_id")
+        if thread_id is None or not call.get("id"):
+            # Without a thread there is no checkpoint to resume from
+            return None
+        # checkpoint_ns is "node:<task_id>" per level, and the task ids change with every checkpoint
+        # (e.g. the one aupdate_state writes before a resume), so only the node names are kept
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        path = NS_SEP.join(part.split(NS_END, 1)[0] for part in checkpoint_ns.split(NS_SEP)) if checkpoint_ns else ""
+        return thread_id, path, call["id"]
+
+    def _remember(self, key: Hashable, result: Any):
+        now = time.monotonic()
+        self._finished[key] = (now + self.remember_for, result)
+        self._finished.move_to_end(key)
+        while self._finished:
+            oldest_key, (expires_at, _) = next(iter(self._finished.items()))
+            if len(self._finished) <= self.max_remembered and expires_at > now:
+                break
+            del self._finished[oldest_key]
+
+    def _recall(self, key: Optional[Hashable]) -> Any:
+        if key is None:
+            return None
+        item = self._finished.get(key)
+        if item is None or item[0] <= time.monotonic():
+            return None
+        return item[1]
+
+    async def _run_call(self, state: Any, messages: List[BaseMessage], last: AIMessage, call: Dict[str, Any],
+                        key: Optional[Hashable], semaphore: asyncio.Semaphore, interrupted: asyncio.Event,
+                        config: RunnableConfig) -> Any:
+        remembered = self._recall(key)
+        if remembered is not None:
+            # Finished before the run was interrupted; running it again would repeat its side effects
+            tool_call_seconds.observe(0.0, outcome="replayed")
+            return remembered
+        async with semaphore:
+            if interrupted.is_set():
+                # Runs when the node is resumed, like the calls after an interrupt of the sequential node
+                return _NOT_STARTED
+            started = time.perf_counter()
+            sub_state = _with_messages(state, [*messages[:-1], _single_call(last, call)])
+            outcome = "error"
+            try:
+                if self.timeout > 0:
+                    result = await asyncio.wait_for(self.node.ainvoke(sub_state, config), self.timeout)
+                else:
+                    result = await self.node.ainvoke(sub_state, config)
+                outcome = "ok"
+                return result
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                logger.warning("Tool call timed out", extra={"tool": call["name"], "timeout": self.timeout})
+                return {"messages": [ToolMessage(
+                    content=f"Error: {call['name']} did not finish within {self.timeout:g} seconds and was cancelled.",
+                    tool_call_id=call["id"], name=call["name"], status="error",
+                )]}
+            except GraphInterrupt:
+                outcome = "interrupted"
+                interrupted.set()
+                raise
+            finally:
+                tool_call_seconds.observe(time.perf_counter() - started, outcome=outcome)
+
+    @staticmethod
+    def _merge(results: List[Any]) -> Dict[str, Any]:
+        merged: Dict[str, Any] = {}
+        messages: List[BaseMessage] = []
+        for result in results:
+            if not result:
+                continue
+            if not isinstance(result, dict):
+                result = {"messages": result.messages} if hasattr(result, "messages") else {}
+            for key, value in result.items():
+                if key == "messages":
+                    messages.extend(value if isinstance(value, list) else [value])
+                else:
+                    # Other keys don't depend on the call; later calls win, in call order
+                    merged[key] = value
+        merged["messages"] = messages
+        return merged
+
+
+def parallelize_tool_node(graph: Any, node_name: str = "tools", max_concurrency: int = 8, timeout: float = 60.0) -> Any:
+    """
+    Returns graph recompiled with node_name wrapped by ParallelToolNode and the same
+    checkpointer, store and interrupt settings, or graph itself if it has no such node.
+    """
+    builder = getattr(graph, "builder", None)
+    spec = getattr(builder, "nodes", {}).get(node_name)
+    if spec is None:
+        logger.warning("No %r node to parallelize, tool calls stay sequential", node_name)
+        return graph
+
+    parallel = ParallelToolNode(spec.runnable, max_concurrency=max_concurrency, timeout=timeout)
+    builder = _copy_builder(builder)
+    builder.nodes = {**builder.nodes, node_name: spec._replace(runnable=coerce_to_runnable(parallel.__call__, name=node_name, trace=False))}
+    return builder.compile(
+        checkpointer=graph.checkpointer,
+        store=getattr(graph, "store", None),
+        interrupt_before=graph.interrupt_before_nodes or None,
+        interrupt_after=graph.interrupt_after_nodes or None,
+        debug=graph.debug,
+    )
+
+
+def _copy_builder(builder: Any) -> Any:
+    # The original builder stays untouched, along with the graph compiled from it
+    copy = builder.__class__.__new__(builder.__class__)
+    copy.__dict__.update(builder.__dict__)
+    copy.compiled = False
+    return copy
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+'''
+RunScheduler serializes agent runs per thread_id. Each thread gets a bounded
+queue drained by a single worker task, so two runs on the same thread (and so
+the same checkpoint) never execute concurrently, while different threads run
+in parallel. The in-flight run of a thread can be interrupted or cancelled.
+'''
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class QueueFullError(Exception):
+    def __init__(self, thread_id: str, queue_depth: int):
+        super().__init__(f"Run queue for thread_id {thread_id} is full ({queue_depth} pending).")
+        self.thread_id = thread_id
+        self.queue_depth = queue_depth
+
+
+class _ThreadRuns:
+    def __init__(self):
+        self.pending: Deque[Tuple[Job, asyncio.Future]] = deque()
+        self.current: Optional[asyncio.Task] = None
+        self.worker: Optional[asyncio.Task] = None
+
+
+class RunScheduler:
+    def __init__(self, max_queue_depth: int = 8):
+        # Number of runs allowed to wait behind the in-flight one, per thread.
+        self.max_queue_depth = max_queue_depth
+        self._threads: Dict[str, _ThreadRuns] = {}
+        self.submitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def submit(self, thread_id: str, job: Job) -> asyncio.Future:
+        """
+        Queue job to run after every earlier job of this thread has finished.
+        Returns a future resolved with the job's result; raises QueueFullError
+        when the thread already has max_queue_depth runs waiting.
+        """
+        runs = self._threads.setdefault(thread_id, _ThreadRuns())
+        if len(runs.pending) >= self.max_queue_depth:
+            self.rejected += 1
+            raise QueueFullError(thread_id, len(runs.pending))
+
+        future = asyncio.get_running_loop().create_future()
+        runs.pending.append((job, future))
+        self.submitted += 1
+        if runs.worker is None:
+            runs.worker = asyncio.create_task(self._drain(thread_id, runs))
+        return future
+
+    def interrupt(self, thread_id: str) -> bool:
+        """Stop the in-flight run of thread_id; queued runs still execute."""
+        runs = self._threads.get(thread_id)
+        if runs is None or runs.current is None or runs.current.done():
+            return False
+        runs.current.cancel()
+        self.cancelled += 1
+        return True
+
+    def cancel(self, thread_id: str) -> bool:
+        """Stop the in-flight run of thread_id and drop everything queued behind it."""
+        runs = self._threads.get(thread_id)
+        if runs is None:
+            return False
+        dropped = 0
+        while runs.pending:
+            _, future = runs.pending.popleft()
+            future.cancel()
+            dropped += 1
+        self.cancelled += dropped
+        return self.interrupt(thread_id) or dropped > 0
+
+    def is_running(self, thread_id: str) -> bool:
+        runs = self._threads.get(thread_id)
+        return runs is not None and runs.current is not None and not runs.current.done()
+
+    def queue_depth(self, thread_id: str) -> int:
+        runs = self._threads.get(thread_id)
+        return len(runs.pending) if runs else 0
+
+    async def _drain(self, thread_id: str, runs: _ThreadRuns):
+        try:
+            while runs.pending:
+                job, future = runs.pending.popleft()
+                if future.cancelled():
+                    continue
+                runs.current = asyncio.create_task(job())
+                # asyncio.wait doesn't propagate the run's cancellation into the worker.
+                await asyncio.wait({runs.current})
+                if runs.current.cancelled():
+                    future.cancel()
+                elif future.cancelled():
+                    # Nobody is waiting for the outcome any more: a failure would otherwise go unreported
+                    error = runs.current.exception()
+                    if error is not None:
+                        logger.error("Run failed after its caller stopped waiting", exc_info=error, extra={"thread_id": thread_id})
+                elif runs.current.exception() is not None:
+                    future.set_exception(runs.current.exception())
+                else:
+                    future.set_result(runs.current.result())
+        finally:
+            if runs.current is not None and not runs.current.done():
+                runs.current.cancel()
+            runs.current = None
+            runs.worker = None
+            if not runs.pending and self._threads.get(thread_id) is runs:
+                del self._threads[thread_id]
+
+    async def shutdown(self):
+        for thread_id in list(self._threads):
+            self.cancel(thread_id)
+        workers = [runs.worker for runs in self._threads.values() if runs.worker is not None]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threads": len(self._threads),
+            "running": sum(1 for thread_id in self._threads if self.is_running(thread_id)),
+            "queued": sum(len(runs.pending) for runs in self._threads.values()),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.errors import GraphInterrupt
+
+from utils.Metrics import registry
+
+'''
+SpanCallbackHandler times every tool call and chat model call made inside an
+agent run into Prometheus histograms. Pass it in the run config's callbacks.
+
+Calls that never report an end, because their run was cancelled or the client
+went away mid-stream, are forgotten after max_age seconds, or oldest first once
+more than max_open calls are open, and counted as abandoned.
+'''
+
+tool_seconds = registry.histogram("agent_tool_seconds", "Latency of tool calls.", ["tool", "status"])
+llm_seconds = registry.histogram("agent_llm_seconds", "Latency of chat model calls.", ["model", "status"])
+abandoned_spans = registry.counter(
+    "agent_spans_abandoned_total", "Tool and chat model calls that never reported an end (e.g. cancelled runs)."
+)
+
+
+class SpanCallbackHandler(BaseCallbackHandler):
+    # Bookkeeping only, so run in the caller's context instead of an executor
+    run_inline = True
+
+    def __init__(self, max_open: int = 10_000, max_age: float = 3600.0):
+        self.max_open = max_open
+        self.max_age = max_age
+        # run_id -> (label, started), oldest first
+        self._started: "OrderedDict[UUID, tuple]" = OrderedDict()
+        self.abandoned = 0
+
+    def _start(self, run_id: UUID, name: str):
+        now = time.perf_counter()
+        self._started[run_id] = (name, now)
+        while self._started:
+            _, (_, started_at) = next(iter(self._started.items()))
+            if len(self._started) <= self.max_open and now - started_at <= self.max_age:
+                break
+            self._started.popitem(last=False)
+            self.abandoned += 1
+            abandoned_spans.inc()
+
+    def on_tool_start(self, serialized: Optional[Dict[str, Any]], input_str: str, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, (serialized or {}).get("name", "unknown"))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(tool_seconds, run_id, "ok", "tool")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        # e.g. OAuth required: the tool reruns once the run resumes
+        status = "interrupted" if isinstance(error, GraphInterrupt) else "error"
+        self._finish(tool_seconds, run_id, status, "tool")
+
+    def on_chat_model_start(self, serialized: Optional[Dict[str, Any]], messages: Any, *, run_id: UUID, **kwargs: Any):
+        model = (kwargs.get("invocation_params") or {}).get("model") or (serialized or {}).get("name", "unknown")
+        self._start(run_id, model)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(llm_seconds, run_id, "ok", "model")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(llm_seconds, run_id, "error", "model")
+
+    def _finish(self, histogram, run_id: UUID, status: str, label: str):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        name, started_at = started
+        histogram.observe(time.perf_counter() - started_at, **{label: name, "status": status})
@@ -0,0 +1,456 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+'''
+SqliteCheckpointer is a durable checkpoint saver backed by a local SQLite file.
+Checkpoints and pending writes are buffered in memory and written in a single
+transaction per batch (WAL mode), so the many super-steps of one agent turn
+cost one commit instead of one per step. A batch is written once it holds
+batch_size rows, and a background thread writes whatever is buffered every
+flush_interval seconds, so a thread that goes idle reaches disk too: a crash
+loses at most the last flush_interval seconds. Reads of a thread with buffered
+writes flush first, so readers always see their own writes. Only the newest
+keep_last checkpoints of each thread are retained.
+
+The channels in transient_channels are never written: by default
+tool_search_client, which carries the thread's OAuth credentials. Their latest
+value per thread is held in memory instead (weakly, so it goes with the thread's
+agent entry) and put back into checkpoints loaded by this process; after a
+restart they are empty and the caller attaches the live object again. Nothing
+is pickled, so the file holds no credentials and loading it can't run code.
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteCheckpointer(BaseCheckpointSaver):
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+        keep_last: Optional[int] = 20,
+        serde: Optional[Any] = None,
+        transient_channels: Iterable[str] = ("tool_search_client",),
+    ):
+        super().__init__(serde=serde or JsonPlusSerializer())
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.keep_last = keep_last
+        self.transient_channels = frozenset(transient_channels)
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                type TEXT,
+                checkpoint BLOB,
+                metadata_type TEXT,
+                metadata BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT,
+                value BLOB,
+                task_path TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            """
+        )
+
+        self._pending_checkpoints: List[tuple] = []
+        self._pending_writes: List[tuple] = []
+        self._dirty: Set[Tuple[str, str]] = set()
+        # (thread_id, checkpoint_ns, channel) -> latest value of a transient channel
+        self._transient: "weakref.WeakValueDictionary[Tuple[str, str, str], Any]" = weakref.WeakValueDictionary()
+        self._last_flush = time.monotonic()
+        self.flushes = 0
+
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_periodically, name="checkpoint-flush", daemon=True)
+            self._flusher.start()
+
+    # Write path
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        next_config = self._buffer_checkpoint(config, checkpoint, metadata)
+        if self._should_flush():
+            self.flush()
+        return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        self._buffer_writes(config, writes, task_id, task_path)
+        if self._should_flush():
+            self.flush()
+
+    def _buffer_checkpoint(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        if self.transient_channels:
+            for channel in self.transient_channels.intersection(checkpoint["channel_values"]):
+                self._keep_transient(thread_id, checkpoint_ns, channel, checkpoint["channel_values"][channel])
+            checkpoint = {**checkpoint, "channel_values": {
+                channel: self._without_transient(value) for channel, value in checkpoint["channel_values"].items()
+                if channel not in self.transient_channels
+            }}
+            if metadata.get("writes"):
+                # The metadata repeats each node's (and the input's) update
+                metadata = {**metadata, "writes": {
+                    node: [self._without_transient(item) for item in update] if isinstance(update, list)
+                    else self._without_transient(update)
+                    for node, update in metadata["writes"].items()
+                }}
+        type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(metadata)
+        with self._lock:
+            self._pending_checkpoints.append((
+                thread_id,
+                checkpoint_ns,
+                checkpoint["id"],
+                config["configurable"].get("checkpoint_id"),
+                type_,
+                serialized_checkpoint,
+                metadata_type,
+                serialized_metadata,
+            ))
+            self._dirty.add((thread_id, checkpoint_ns))
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def _buffer_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str,
+    ):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            if channel in self.transient_channels:
+                self._keep_transient(thread_id, checkpoint_ns, channel, value)
+                continue
+            type_, serialized_value = self.serde.dumps_typed(self._without_transient(value))
+            rows.append((
+                thread_id,
+                checkpoint_ns,
+                checkpoint_id,
+                task_id,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                type_,
+                serialized_value,
+                task_path,
+            ))
+        with self._lock:
+            self._pending_writes.extend(rows)
+            self._dirty.add((thread_id, checkpoint_ns))
+
+    def _keep_transient(self, thread_id: str, checkpoint_ns: str, channel: str, value: Any):
+        with self._lock:
+            try:
+                self._transient[(thread_id, checkpoint_ns, channel)] = value
+            except TypeError:
+                # Can't be referenced weakly (e.g. None): nothing to put back
+                self._transient.pop((thread_id, checkpoint_ns, channel), None)
+
+    def _without_transient(self, value: Any) -> Any:
+        # Graph input (e.g. the initial state) reaches the start channel as one dict
+        if isinstance(value, dict) and not self.transient_channels.isdisjoint(value):
+            return {key: item for key, item in value.items() if key not in self.transient_channels}
+        return value
+
+    def _should_flush(self) -> bool:
+        return (
+            len(self._pending_checkpoints) + len(self._pending_writes) >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # The batch stays buffered, the next tick retries it
+                logger.exception("Failed to flush checkpoints to %s", self.path)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending_checkpoints and not self._pending_writes:
+                self._last_flush = time.monotonic()
+                return
+            checkpoints, self._pending_checkpoints = self._pending_checkpoints, []
+            writes, self._pending_writes = self._pending_writes, []
+            dirty, self._dirty = self._dirty, set()
+
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)", checkpoints
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", writes
+                )
+                if self.keep_last:
+                    for thread_id, checkpoint_ns in dirty:
+                        self._prune(thread_id, checkpoint_ns)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                # Keep the batch so the next flush retries it
+                self._pending_checkpoints[:0] = checkpoints
+                self._pending_writes[:0] = writes
+                self._dirty |= dirty
+                raise
+            self._last_flush = time.monotonic()
+            self.flushes += 1
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        keep = """
+            SELECT checkpoint_id FROM checkpoints
+            WHERE thread_id = ? AND checkpoint_ns = ?
+            ORDER BY checkpoint_id DESC LIMIT ?
+        """
+        params = (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_last)
+        self._conn.execute(
+            f"DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ({keep})",
+            params,
+        )
+        self._conn.execute(
+            f"DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ({keep})",
+            params,
+        )
+
+    # Read path
+
+    def _flush_if_dirty(self, thread_id: Optional[str], checkpoint_ns: Optional[str]):
+        with self._lock:
+            dirty = any(
+                (thread_id is None or t == thread_id) and (checkpoint_ns is None or ns == checkpoint_ns)
+                for t, ns in self._dirty
+            )
+        if dirty:
+            self.flush()
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        self._flush_if_dirty(thread_id, checkpoint_ns)
+        checkpoint_id = get_checkpoint_id(config)
+        query = "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        params: tuple = (thread_id, checkpoint_ns)
+        if checkpoint_id:
+            query += " AND checkpoint_id = ?"
+            params += (checkpoint_id,)
+        else:
+            # Resuming only needs the newest checkpoint, never the whole history
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+            return self._to_tuple(row) if row else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"] if config else None
+        checkpoint_ns = config["configurable"].get("checkpoint_ns") if config else None
+        self._flush_if_dirty(thread_id, checkpoint_ns)
+
+        clauses, params = [], []
+        if thread_id is not None:
+            clauses.append("thread_id = ?")
+            params.append(thread_id)
+        if checkpoint_ns is not None:
+            clauses.append("checkpoint_ns = ?")
+            params.append(checkpoint_ns)
+        if config and get_checkpoint_id(config):
+            clauses.append("checkpoint_id = ?")
+            params.append(get_checkpoint_id(config))
+        if before and get_checkpoint_id(before):
+            clauses.append("checkpoint_id < ?")
+            params.append(get_checkpoint_id(before))
+        query = "SELECT * FROM checkpoints"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY checkpoint_id DESC"
+        # Metadata filters are applied after decoding, so LIMIT can only be pushed down without them
+        if limit is not None and not filter:
+            query += f" LIMIT {int(limit)}"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        returned = 0
+        for row in rows:
+            with self._lock:
+                checkpoint_tuple = self._to_tuple(row)
+            if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            yield checkpoint_tuple
+            returned += 1
+            if limit is not None and returned >= limit:
+                break
+
+    def _to_tuple(self, row: tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self._conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        checkpoint = self.serde.loads_typed((type_, checkpoint))
+        for channel in self.transient_channels:
+            value = self._transient.get((thread_id, checkpoint_ns, channel))
+            if value is not None:
+                checkpoint["channel_values"][channel] = value
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint=checkpoint,
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_id,
+                    }
+                }
+                if parent_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((value_type, value)))
+                for task_id, channel, value_type, value in writes
+            ],
+        )
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._pending_checkpoints = [c for c in self._pending_checkpoints if c[0] != thread_id]
+            self._pending_writes = [w for w in self._pending_writes if w[0] != thread_id]
+            self._dirty = {d for d in self._dirty if d[0] != thread_id}
+            for key in [key for key in self._transient.keys() if key[0] == thread_id]:
+                self._transient.pop(key, None)
+            self._conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    # Async API: buffering is in-memory, only flushes and reads touch the disk,
+    # and those run in a worker thread so they don't block the event loop.
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        next_config = self._buffer_checkpoint(config, checkpoint, metadata)
+        if self._should_flush():
+            await asyncio.to_thread(self.flush)
+        return next_config
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        self._buffer_writes(config, writes, task_id, task_path)
+        if self._should_flush():
+            await asyncio.to_thread(self.flush)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoints = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint_tuple in checkpoints:
+            yield checkpoint_tuple
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
@@ -0,0 +1,127 @@
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+'''
+ThreadRegistry records which worker process owns a thread_id, i.e. holds its
+per-thread agent state. LocalThreadRegistry is the single-worker default;
+SqliteThreadRegistry shares ownership between the uvicorn workers of a host
+through a SQLite file. A worker whose heartbeat is older than worker_ttl
+seconds is considered dead and its threads can be claimed by another worker.
+'''
+
+
+class ThreadRegistry(ABC):
+    # Lookups go to storage shared with other processes, so callers run them off the event loop
+    blocking = True
+
+    @abstractmethod
+    def claim(self, thread_id: str, worker_id: str) -> str:
+        """Take ownership of thread_id unless a live worker owns it. Returns the owner."""
+
+    @abstractmethod
+    def owner(self, thread_id: str) -> Optional[str]:
+        """The live worker owning thread_id, if any."""
+
+    @abstractmethod
+    def release(self, thread_id: str, worker_id: str):
+        """Give up thread_id if worker_id still owns it."""
+
+    def heartbeat(self, worker_id: str):
+        pass
+
+    def release_worker(self, worker_id: str):
+        pass
+
+
+class LocalThreadRegistry(ThreadRegistry):
+    blocking = False
+
+    def __init__(self):
+        self._owners: Dict[str, str] = {}
+
+    def claim(self, thread_id: str, worker_id: str) -> str:
+        return self._owners.setdefault(thread_id, worker_id)
+
+    def owner(self, thread_id: str) -> Optional[str]:
+        return self._owners.get(thread_id)
+
+    def release(self, thread_id: str, worker_id: str):
+        if self._owners.get(thread_id) == worker_id:
+            del self._owners[thread_id]
+
+    def release_worker(self, worker_id: str):
+        self._owners = {t: w for t, w in self._owners.items() if w != worker_id}
+
+
+class SqliteThreadRegistry(ThreadRegistry):
+    def __init__(self, path: str, worker_ttl: float = 15.0):
+        self.path = path
+        self.worker_ttl = worker_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS thread_owners (
+                thread_id TEXT PRIMARY KEY,
+                worker_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS thread_owners_worker ON thread_owners (worker_id);
+            """
+        )
+
+    def _live_owner(self, thread_id: str) -> Optional[str]:
+        row = self._conn.execute(
+            """
+            SELECT t.worker_id FROM thread_owners t JOIN workers w ON w.worker_id = t.worker_id
+            WHERE t.thread_id = ? AND w.heartbeat >= ?
+            """,
+            (thread_id, time.time() - self.worker_ttl),
+        ).fetchone()
+        return row[0] if row else None
+
+    def claim(self, thread_id: str, worker_id: str) -> str:
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two workers can't both claim
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                owner = self._live_owner(thread_id)
+                if owner is None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO thread_owners (thread_id, worker_id) VALUES (?, ?)",
+                        (thread_id, worker_id),
+                    )
+                    owner = worker_id
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return owner
+
+    def owner(self, thread_id: str) -> Optional[str]:
+        with self._lock:
+            return self._live_owner(thread_id)
+
+    def release(self, thread_id: str, worker_id: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM thread_owners WHERE thread_id = ? AND worker_id = ?", (thread_id, worker_id)
+            )
+
+    def heartbeat(self, worker_id: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, heartbeat) VALUES (?, ?)", (worker_id, time.time())
+            )
+
+    def release_worker(self, worker_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM thread_owners WHERE worker_id = ?", (worker_id,))
+            self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
@@ -0,0 +1,149 @@
+import asyncio
+import copy
+import logging
+import os
+import pickle
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+'''
+ToolSearchCache is a process-wide cache for tool search results. Queries are
+normalized before keying, entries expire after ttl seconds and the least
+recently used ones are evicted past max_entries. Concurrent lookups of the
+same key share a single remote call (single-flight). The call runs in its own
+task, so a caller that is cancelled only stops waiting; the call itself is
+cancelled once no caller is left. The cache can be saved to and loaded from
+disk so a restarted worker starts warm.
+'''
+
+logger = logging.getLogger(__name__)
+
+_STOPWORDS = frozenset({"a", "an", "the", "please", "can", "you", "i", "want"})
+_NON_WORD = re.compile(r"[^\w\s]+")
+
+
+def normalize_query(query: str) -> str:
+    words = _NON_WORD.sub(" ", query.lower()).split()
+    return " ".join(word for word in words if word not in _STOPWORDS) or query.strip().lower()
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class ToolSearchCache:
+    def __init__(self, max_entries: int = 4096, ttl: float = 900.0, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist_path = persist_path
+        # key -> (expires_at wall clock, value); wall clock so persisted entries keep their expiry
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        item = self._entries.get(key)
+        if item is None:
+            return False, None
+        expires_at, value = item
+        if expires_at < time.time():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def put(self, key: Hashable, value: Any):
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return copy.copy(value)
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.misses += 1
+            flight = self._inflight[key] = _Flight(asyncio.create_task(self._fetch(key, fetch)))
+            # Retrieve the outcome even when every caller has left, so errors aren't reported as unhandled
+            flight.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            # shield: cancelling one caller (e.g. its run) must not cancel the call the others wait on
+            value = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Every caller is gone, nobody needs the result
+                flight.task.cancel()
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+        return copy.copy(value)
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+        except Exception:
+            self.errors += 1
+            # Every waiter gets the same error; nothing is cached
+            raise
+        finally:
+            flight = self._inflight.get(key)
+            if flight is not None and flight.task is asyncio.current_task():
+                del self._inflight[key]
+        self.put(key, value)
+        return value
+
+    def load(self):
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "rb") as f:
+                entries = pickle.load(f)
+        except Exception as e:
+            logger.warning("Ignoring unreadable tool search cache %s: %s", self.persist_path, e)
+            return
+        now = time.time()
+        for key, (expires_at, value) in entries.items():
+            if expires_at >= now:
+                self._entries[key] = (expires_at, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def save(self):
+        if not self.persist_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.persist_path))
+        # Write then rename so a crash mid-save never leaves a truncated file
+        with tempfile.NamedTemporaryFile("wb", dir=directory, delete=False) as f:
+            pickle.dump(dict(self._entries), f)
+        os.replace(f.name, self.persist_path)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Generic, Optional, TypeVar
+
+'''
+WarmPool keeps a number of ready-made items (per-thread agent entries) built
+ahead of demand, so a thread's first message doesn't pay for construction.
+Items are built on a worker thread and the pool is refilled in the background
+after every take_async(). An optional warmup callable runs once before the first
+build, e.g. to compile the shared graph. When the pool is empty take_async()
+builds on a worker thread, as if there were no pool; there is no synchronous
+take(), so a build can't block the event loop.
+'''
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class WarmPool(Generic[T]):
+    def __init__(self, factory: Callable[[], T], size: int, warmup: Optional[Callable[[], Any]] = None, retry_delay: float = 5.0):
+        self.factory = factory
+        self.size = size
+        self.warmup = warmup
+        self.retry_delay = retry_delay
+        self._items: Deque[T] = deque()
+        self._wanted: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.warmed_up = warmup is None
+        # Filled to size at least once; what readiness reports
+        self.warm = False
+        self.hits = 0
+        self.misses = 0
+        self.built = 0
+        self.errors = 0
+
+    def start(self):
+        self._wanted = asyncio.Event()
+        self._wanted.set()
+        self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def take_async(self, offload: Optional[Callable[..., Any]] = None) -> T:
+        if self._items:
+            self.hits += 1
+            item = self._items.popleft()
+        else:
+            self.misses += 1
+            item = await (offload or asyncio.to_thread)(self.factory)
+        if self._wanted is not None:
+            self._wanted.set()
+        return item
+
+    @property
+    def ready(self) -> bool:
+        return self.warmed_up and (self.warm or self.size == 0)
+
+    async def _refill_loop(self):
+        while True:
+            await self._wanted.wait()
+            self._wanted.clear()
+            try:
+                if not self.warmed_up:
+                    await asyncio.to_thread(self.warmup)
+                    self.warmed_up = True
+                while len(self._items) < self.size:
+                    self._items.append(await asyncio.to_thread(self.factory))
+                    self.built += 1
+                self.warm = True
+            except Exception:
+                self.errors += 1
+                logger.exception("Building warm pool items failed, retrying in %ss", self.retry_delay)
+                await asyncio.sleep(self.retry_delay)
+                self._wanted.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": len(self._items),
+            "size": self.size,
+            "warm": self.ready,
+            "hits": self.hits,
+            "misses": self.misses,
+            "built": self.built,
+            "errors": self.errors,
+        }
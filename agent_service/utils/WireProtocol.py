@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, List, Mapping, Optional, Union
+
+import pydantic_core
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, clients then negotiate json
+    msgpack = None
+
+'''
+Per-connection wire protocol, negotiated with query parameters on the WebSocket
+URL, e.g. /ws/{thread_id}?protocol=2&encoding=msgpack&tool_output=truncate.
+
+protocol=1 (default) is the original protocol: every run ends with the
+RunAgentResponse JSON of all messages collected during the run.
+
+protocol=2 ends a run with an "agent_response" event carrying only messages the
+thread hasn't sent before, each numbered with a per-thread "seq". Clients send
+{"event": "ack", "data": {"seq": n}} and can reconnect with resume_from=n to
+receive what they missed. Tool message content is truncated to tool_output_limit
+characters (tool_output=truncate, the default), dropped (omit) or sent as is
+(full). Structured content (a list of content blocks) is measured and truncated
+as its JSON text, so it is bounded the same way. With encoding=msgpack, frames the server builds as dicts (responses,
+deltas, hello) are sent as binary msgpack frames; other events stay JSON text.
+'''
+
+RESPONSE_EVENT = "agent_response"
+SUPPORTED_VERSIONS = (1, 2)
+
+
+class ToolOutputMode(str, Enum):
+    FULL = "full"
+    TRUNCATE = "truncate"
+    OMIT = "omit"
+
+
+class Encoding(str, Enum):
+    JSON = "json"
+    MSGPACK = "msgpack"
+
+
+@dataclass
+class ProtocolOptions:
+    version: int = 1
+    encoding: Encoding = Encoding.JSON
+    tool_output: ToolOutputMode = ToolOutputMode.TRUNCATE
+    tool_output_limit: int = 512
+
+    @classmethod
+    def from_query(cls, params: Mapping[str, str], default_tool_output_limit: int = 512) -> "ProtocolOptions":
+        """Raises ValueError for options this server doesn't support."""
+        version = int(params.get("protocol", 1))
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported protocol version: {version}")
+        encoding = Encoding(params.get("encoding", Encoding.JSON.value))
+        if encoding == Encoding.MSGPACK and msgpack is None:
+            raise ValueError("msgpack encoding is not available on this server")
+        return cls(
+            version=version,
+            encoding=encoding,
+            tool_output=ToolOutputMode(params.get("tool_output", ToolOutputMode.TRUNCATE.value)),
+            tool_output_limit=int(params.get("tool_output_limit", default_tool_output_limit)),
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "protocol": self.version,
+            "encoding": self.encoding.value,
+            "tool_output": self.tool_output.value,
+            "tool_output_limit": self.tool_output_limit,
+        }
+
+
+def response_frame(
+    seq: int,
+    messages: List[Dict[str, Any]],
+    legacy: Optional[Dict[str, Any]] = None,
+    wildcard_event: Optional[Dict[str, Any]] = None,
+    **fields: Any,
+) -> Dict[str, Any]:
+    """
+    The end-of-run frame. `legacy` is the protocol 1 RunAgentResponse body, sent
+    as is to protocol 1 connections of the same thread.
+    """
+    frame = {"event": RESPONSE_EVENT, "seq": seq, "data": {"messages": messages, "wildcard_event": wildcard_event}, **fields}
+    if legacy is not None:
+        frame["legacy"] = legacy
+    return frame
+
+
+def _shape_tool_output(message: Dict[str, Any], options: ProtocolOptions) -> Dict[str, Any]:
+    if message.get("type") != "tool" or options.tool_output == ToolOutputMode.FULL:
+        return message
+    content = message.get("content")
+    text = content if isinstance(content, str) else pydantic_core.to_json(content).decode()
+    if options.tool_output == ToolOutputMode.OMIT:
+        return {**message, "content": "", "content_length": len(text), "truncated": True}
+    if len(text) <= options.tool_output_limit:
+        return message
+    return {**message, "content": text[:options.tool_output_limit], "content_length": len(text), "truncated": True}
+
+
+def encode_frame(frame: Dict[str, Any], options: ProtocolOptions) -> Union[str, bytes]:
+    if frame.get("event") == RESPONSE_EVENT:
+        if options.version == 1:
+            return pydantic_core.to_json(frame["legacy"]).decode()
+        data = frame["data"]
+        frame = {key: value for key, value in frame.items() if key != "legacy"}
+        frame["data"] = {**data, "messages": [_shape_tool_output(m, options) for m in data["messages"]]}
+    if options.encoding == Encoding.MSGPACK:
+        return msgpack.packb(frame, use_bin_type=True)
+    return pydantic_core.to_json(frame).decode()
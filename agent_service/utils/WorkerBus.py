@@ -0,0 +1,157 @@
+import asyncio
+import itertools
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+'''
+WorkerBus carries messages between the worker processes of one host, so a
+request that lands on a worker that doesn't own a thread can be handed to the
+one that does. LocalWorkerBus is the single-worker default and never has a
+peer. UnixSocketWorkerBus gives every worker a Unix domain socket in a shared
+directory and speaks newline-delimited JSON over it.
+'''
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class WorkerBusError(Exception):
+    pass
+
+
+class WorkerBus(ABC):
+    @abstractmethod
+    async def start(self, handler: Handler):
+        """Start receiving messages from other workers, answered by handler."""
+
+    @abstractmethod
+    async def request(self, worker_id: str, message: Dict[str, Any], timeout: float = 10.0) -> Dict[str, Any]:
+        """Send message to worker_id and wait for the handler's reply."""
+
+    @abstractmethod
+    def post(self, worker_id: str, message: Dict[str, Any]):
+        """Fire-and-forget send. Messages posted to the same worker arrive in order."""
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+
+class LocalWorkerBus(WorkerBus):
+    async def start(self, handler: Handler):
+        pass
+
+    async def request(self, worker_id: str, message: Dict[str, Any], timeout: float = 10.0) -> Dict[str, Any]:
+        raise WorkerBusError(f"No route to worker {worker_id}")
+
+    def post(self, worker_id: str, message: Dict[str, Any]):
+        raise WorkerBusError(f"No route to worker {worker_id}")
+
+    async def close(self):
+        pass
+
+
+class _Peer:
+    def __init__(self, path: str, max_queue: int):
+        self.path = path
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+
+class UnixSocketWorkerBus(WorkerBus):
+    def __init__(self, directory: str, worker_id: str, max_queue: int = 1024):
+        self.directory = directory
+        self.worker_id = worker_id
+        self.max_queue = max_queue
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handler: Optional[Handler] = None
+        self._peers: Dict[str, _Peer] = {}
+        self._ids = itertools.count()
+
+    def _path(self, worker_id: str) -> str:
+        return os.path.join(self.directory, f"{worker_id}.sock")
+
+    async def start(self, handler: Handler):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._handler = handler
+        self._server = await asyncio.start_unix_server(self._serve, path=path, limit=2 ** 24)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                try:
+                    result = await self._handler(message)
+                except Exception as e:
+                    result = {"error": str(e)}
+                # Requests carry an id and get a reply; posted messages don't
+                if "id" in message:
+                    writer.write(json.dumps({"id": message["id"], "result": result}).encode() + b"\n")
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # CancelledError: the server is shutting down; end this connection quietly
+            pass
+        finally:
+            writer.close()
+
+    async def request(self, worker_id: str, message: Dict[str, Any], timeout: float = 10.0) -> Dict[str, Any]:
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self._path(worker_id), limit=2 ** 24), timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise WorkerBusError(f"Worker {worker_id} is unreachable: {e}") from e
+        try:
+            writer.write(json.dumps({**message, "id": next(self._ids)}).encode() + b"\n")
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
+                raise WorkerBusError(f"Worker {worker_id} closed the connection")
+            return json.loads(line)["result"]
+        finally:
+            writer.close()
+
+    def post(self, worker_id: str, message: Dict[str, Any]):
+        peer = self._peers.get(worker_id)
+        if peer is None:
+            peer = self._peers[worker_id] = _Peer(self._path(worker_id), self.max_queue)
+        if peer.task is None or peer.task.done():
+            peer.task = asyncio.create_task(self._drain(peer))
+        try:
+            peer.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            peer.dropped += 1
+
+    async def _drain(self, peer: _Peer):
+        # One persistent connection per peer keeps posted messages ordered
+        writer = None
+        try:
+            while True:
+                message = await peer.queue.get()
+                if writer is None:
+                    _, writer = await asyncio.open_unix_connection(peer.path)
+                writer.write(json.dumps(message).encode() + b"\n")
+                await writer.drain()
+        except OSError:
+            peer.dropped += peer.queue.qsize() + 1
+            while not peer.queue.empty():
+                peer.queue.get_nowait()
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def close(self):
+        for peer in self._peers.values():
+            if peer.task is not None:
+                peer.task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            path = self._path(self.worker_id)
+            if os.path.exists(path):
+                os.unlink(path)
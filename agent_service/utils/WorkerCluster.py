@@ -0,0 +1,217 @@
+import asyncio
+import base64
+import logging
+import os
+import socket
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Union
+
+from utils.ThreadRegistry import LocalThreadRegistry, SqliteThreadRegistry, ThreadRegistry
+from utils.WorkerBus import LocalWorkerBus, UnixSocketWorkerBus, WorkerBus, WorkerBusError
+
+'''
+WorkerCluster ties a ThreadRegistry and a WorkerBus together for one worker
+process: it answers "which worker owns this thread", forwards requests to the
+owner, dispatches messages from other workers to registered handlers, and
+relays the owner's outbound frames to workers holding that thread's sockets.
+With the default local registry every thread is owned by this worker and
+nothing ever leaves the process.
+'''
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class WorkerCluster:
+    def __init__(
+        self,
+        registry: ThreadRegistry,
+        bus: WorkerBus,
+        worker_id: Optional[str] = None,
+        heartbeat_interval: float = 5.0,
+    ):
+        self.registry = registry
+        self.bus = bus
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat_interval = heartbeat_interval
+        self._handlers: Dict[str, Handler] = {}
+        # thread_id -> workers holding sockets for a thread this worker owns
+        self._subscribers: Dict[str, Set[str]] = {}
+        # thread_id -> owner this worker forwarded the thread's runs to
+        self._forwarded: Dict[str, str] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+        # Releases written to a blocking registry from a worker thread, still running
+        self._releases: Set[asyncio.Task] = set()
+        # Set by the app: hands a frame relayed from the owner to this worker's sockets
+        self.deliver_local: Optional[Callable[[str, Union[str, bytes, dict], bool], None]] = None
+        self.forwarded_requests = 0
+        self.relayed_frames = 0
+
+    @classmethod
+    def from_env(cls) -> "WorkerCluster":
+        backend = os.getenv("WORKER_REGISTRY", "local").lower()
+        if backend == "local":
+            return cls(LocalThreadRegistry(), LocalWorkerBus())
+        if backend == "sqlite":
+            worker_id = f"{socket.gethostname()}-{os.getpid()}"
+            registry = SqliteThreadRegistry(
+                os.getenv("WORKER_REGISTRY_PATH", "/tmp/wildcard-agent-registry.sqlite"),
+                worker_ttl=float(os.getenv("WORKER_TTL", "15")),
+            )
+            bus = UnixSocketWorkerBus(os.getenv("WORKER_BUS_DIR", "/tmp/wildcard-agent-bus"), worker_id)
+            return cls(registry, bus, worker_id=worker_id)
+        raise ValueError(f"Unsupported WORKER_REGISTRY: {backend}")
+
+    def on(self, kind: str, handler: Handler):
+        self._handlers[kind] = handler
+
+    async def start(self):
+        await asyncio.to_thread(self.registry.heartbeat, self.worker_id)
+        await self.bus.start(self._dispatch)
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        if self._releases:
+            await asyncio.gather(*self._releases, return_exceptions=True)
+        await asyncio.to_thread(self.registry.release_worker, self.worker_id)
+        await self.bus.close()
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await asyncio.to_thread(self.registry.heartbeat, self.worker_id)
+            except Exception as e:
+                logger.warning("Worker heartbeat failed: %s", e)
+
+    async def _dispatch(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        kind = message.get("kind")
+        if kind == "deliver":
+            self._deliver(message)
+            return None
+        if kind == "unsubscribe":
+            self._subscribers.get(message["thread_id"], set()).discard(message["origin"])
+            return None
+        handler = self._handlers.get(kind)
+        if handler is None:
+            return {"error": f"Unsupported bus message: {kind}"}
+        if message.get("subscribe"):
+            self._subscribers.setdefault(message["thread_id"], set()).add(message["origin"])
+        return await handler(message)
+
+    # Ownership
+
+    def is_local(self, owner: str) -> bool:
+        return owner == self.worker_id
+
+    def claim(self, thread_id: str) -> str:
+        return self.registry.claim(thread_id, self.worker_id)
+
+    def owner(self, thread_id: str) -> Optional[str]:
+        return self.registry.owner(thread_id)
+
+    async def resolve(self, thread_id: str) -> str:
+        """
+        The live owner of thread_id, claimed for this worker if nobody owns it. Always
+        asks the registry: state this worker still holds for a thread another worker
+        has taken over (e.g. after this one missed its heartbeats) must not be served.
+        """
+        if not self.registry.blocking:
+            return self._resolve(thread_id)
+        return await asyncio.to_thread(self._resolve, thread_id)
+
+    def _resolve(self, thread_id: str) -> str:
+        # A read first: claiming takes the registry's write lock
+        owner = self.registry.owner(thread_id)
+        return owner if owner is not None else self.registry.claim(thread_id, self.worker_id)
+
+    def release(self, thread_id: str):
+        """
+        Gives up ownership of thread_id. Called from synchronous hooks on the event loop
+        (e.g. agent pool evictions), so a blocking registry is written from a worker thread.
+        """
+        self._subscribers.pop(thread_id, None)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or not self.registry.blocking:
+            self._release(thread_id)
+            return
+        task = loop.create_task(asyncio.to_thread(self._release, thread_id))
+        self._releases.add(task)
+        task.add_done_callback(self._releases.discard)
+
+    def _release(self, thread_id: str):
+        try:
+            self.registry.release(thread_id, self.worker_id)
+        except Exception as e:
+            # The claim expires with this worker's heartbeats
+            logger.warning("Failed to release thread %s: %s", thread_id, e)
+
+    # Forwarding
+
+    async def forward(
+        self, owner: str, kind: str, thread_id: str, subscribe: bool = False, timeout: float = 10.0, **payload: Any
+    ) -> Dict[str, Any]:
+        """
+        Hand a request for thread_id to its owner. With subscribe=True the owner also
+        relays the thread's outbound frames back here, for sockets connected to this worker.
+        timeout bounds the wait for the owner's reply.
+        """
+        self.forwarded_requests += 1
+        if subscribe:
+            self._forwarded[thread_id] = owner
+        try:
+            result = await self.bus.request(owner, {
+                "kind": kind,
+                "thread_id": thread_id,
+                "origin": self.worker_id,
+                "subscribe": subscribe,
+                **payload,
+            }, timeout=timeout)
+        except WorkerBusError as e:
+            return {"error": str(e)}
+        return result or {}
+
+    def socket_closed(self, thread_id: str):
+        """The last local socket of thread_id closed: stop relaying its frames here."""
+        owner = self._forwarded.pop(thread_id, None)
+        if owner is not None:
+            try:
+                self.bus.post(owner, {"kind": "unsubscribe", "thread_id": thread_id, "origin": self.worker_id})
+            except WorkerBusError:
+                pass
+
+    # Frame relay
+
+    def relay(self, thread_id: str, frame: Union[str, bytes, dict], droppable: bool):
+        subscribers = self._subscribers.get(thread_id)
+        if not subscribers:
+            return
+        if isinstance(frame, bytes):
+            encoded: Dict[str, Any] = {"b64": base64.b64encode(frame).decode()}
+        else:
+            encoded = {"frame": frame}
+        for worker_id in list(subscribers):
+            try:
+                self.bus.post(worker_id, {"kind": "deliver", "thread_id": thread_id, "droppable": droppable, **encoded})
+                self.relayed_frames += 1
+            except WorkerBusError:
+                subscribers.discard(worker_id)
+
+    def _deliver(self, message: Dict[str, Any]):
+        if self.deliver_local is None:
+            return
+        frame = base64.b64decode(message["b64"]) if "b64" in message else message["frame"]
+        self.deliver_local(message["thread_id"], frame, message.get("droppable", False))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "forwarded_requests": self.forwarded_requests,
+            "relayed_frames": self.relayed_frames,
+            "relay_threads": len(self._subscribers),
+        }
@@ -1,14 +1,21 @@
+import argparse
 import asyncio
-import websockets
 import json
+import os
+import random
+import ssl
+import statistics
+import sys
+import time
 import uuid
 import webbrowser
-import ssl
-import certifi
-import os
-from typing import Optional
+from collections import deque
 from enum import Enum
+from typing import Any, Deque, Dict, List, Optional
+
+import certifi
 import dotenv
+import websockets
 
 DEBUG = False
 dotenv.load_dotenv()
@@ -19,97 +26,296 @@ class MessageType(Enum):
     TOOL = "tool"
     HUMAN = "human"
 
-class ChatClient:
+class LineReader:
+    """
+    Reads stdin lines without blocking the event loop: through the loop's pipe
+    transport where stdin supports it, otherwise on a dedicated thread.
+    """
     def __init__(self):
-        self.server_url = os.getenv("SERVER_URL", "").replace("https:", "wss:")
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._pipe_unsupported = False
+
+    async def readline(self) -> Optional[str]:
+        if self._reader is None and not self._pipe_unsupported:
+            loop = asyncio.get_running_loop()
+            reader = asyncio.StreamReader()
+            try:
+                await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+                self._reader = reader
+            except (ValueError, OSError, NotImplementedError):
+                # Regular files and Windows consoles can't be read through a pipe transport
+                self._pipe_unsupported = True
+        if self._reader is not None:
+            line = await self._reader.readline()
+            return line.decode() if line else None
+        line = await asyncio.to_thread(sys.stdin.readline)
+        return line or None
+
+class ChatClient:
+    def __init__(self, thread_id: Optional[str] = None, server_url: Optional[str] = None, stream: bool = True):
+        server_url = server_url or os.getenv("SERVER_URL", "")
+        self.server_url = server_url.replace("https:", "wss:").replace("http:", "ws:")
         self.ws_url = f"{self.server_url}/ws/"
-        self.thread_id = str(uuid.uuid4())
-        self._is_waiting = False
+        # Reconnects reuse the thread_id, so the conversation survives a dropped connection
+        self.thread_id = thread_id or str(uuid.uuid4())
         self.in_oauth_flow = False  # Flag to track OAuth flow state
         self.loading_symbols = ["⌛", "⏳", "⌛", "⏳"]  # Loading hourglass symbols
-        self.loading_index = 0
+        self.stream = stream  # Ask the server for incremental agent_delta frames
+        self.streaming_message_id: Optional[str] = None  # AI message currently being printed
+        self.streamed_message_ids = set()  # Already rendered, skip them in the final response
+        self.rendered_message_ids = set()  # Also skipped when a reconnect replays them
+        # Protocol 2: responses carry only new messages; tool outputs aren't rendered, so skip them
+        self.protocol_query = "protocol=2&tool_output=omit"
+        self.last_seq = 0  # Highest message seq received, acknowledged back to the server
+        self.quiet = False  # Scripted mode prints results, not the conversation
+        self.reconnect_backoff = (0.5, 10.0)  # First and longest delay between reconnect attempts
+
+        self.outstanding = 0  # Messages sent whose turn hasn't finished yet
+        self.sent = 0
+        self.sent_at_ping: Optional[int] = None
+        self.turns: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()  # Finished turns, for scripted mode
+        self.turn_first_frame_at: Optional[float] = None
+        self.websocket = None
+        self.connected = asyncio.Event()
+        self.closing = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._busy = asyncio.Event()
 
     @property
     def is_waiting(self) -> bool:
-        return self._is_waiting
+        return self._busy.is_set()
 
     @is_waiting.setter
     def is_waiting(self, value: bool):
-        self._is_waiting = value
+        if value:
+            self._idle.clear()
+            self._busy.set()
+        else:
+            self._busy.clear()
+            self._idle.set()
+
+    def say(self, *args, **kwargs):
+        if not self.quiet:
+            print(*args, **kwargs)
 
     def clear_line(self):
-        print("\r" + " " * 60 + "\r", end="", flush=True)
+        self.say("\r" + " " * 60 + "\r", end="", flush=True)
 
     async def handle_event(self, websocket, message: str):
         try:
             data = json.loads(message)
             event = data.get("event")
             event_data = data.get("data", {})
+            if self.outstanding and self.turn_first_frame_at is None and event not in ("hello", "pong"):
+                self.turn_first_frame_at = time.perf_counter()
 
             if event == "start_oauth_flow":
                 self.in_oauth_flow = True  # Entering OAuth flow
                 authorization_url = event_data.get("authorization_url")
                 if authorization_url:
-                    print("\n\n🔐 [OAuth Required]\n")
-                    print(f"Please authorize by visiting: {authorization_url}\n")
-                    webbrowser.open(authorization_url)
+                    if self.quiet:
+                        print(f"OAuth required: {authorization_url}", file=sys.stderr)
+                    else:
+                        print("\n\n🔐 [OAuth Required]\n")
+                        print(f"Please authorize by visiting: {authorization_url}\n")
+                        webbrowser.open(authorization_url)
                     # During OAuth flow, set is_waiting to True to prevent prompts
                     self.is_waiting = True
 
             elif event == "end_oauth_flow":
+                pending_services = event_data.get("pending_services", [])
+                if pending_services:
+                    # Other services of the same run still need authorizing
+                    self.say(f"\n🎉 [Authentication Successful] Still waiting for: {', '.join(pending_services)}\n")
+                    return
                 self.in_oauth_flow = False  # Exiting OAuth flow
-                print("\n🎉 [Authentication Successful] Resuming chat...\n")
-                resume_data = event_data.get("data", {})
-                await websocket.send(json.dumps({
-                    "event": "resume_execution",
-                    "data": resume_data
-                }))
-                # After sending resume_execution, set is_waiting to True to wait for server response
+                self.say("\n🎉 [Authentication Successful] Resuming chat...\n")
+                if not event_data.get("auto_resume"):
+                    # Older servers wait for the client to resume the run
+                    resume_data = event_data.get("data", {})
+                    await websocket.send(json.dumps({
+                        "event": "resume_execution",
+                        "data": resume_data,
+                        "stream": self.stream
+                    }))
+                # Wait for the response of the resumed run
                 self.is_waiting = True
 
-            elif event == "error":
+            elif event == "agent_delta":
+                self.handle_delta(event_data)
+
+            elif event in ("busy", "cancelled", "error"):
+                self.end_streaming()
                 error_msg = event_data.get("error", "Unknown error.")
-                print(f"\n❌ Error: {error_msg}\n")
-                # On error, reset is_waiting to allow user to input again
-                self.is_waiting = False
+                if event == "busy":
+                    retry_after = event_data.get("retry_after")
+                    retry_hint = f" Try again in {retry_after}s." if retry_after else ""
+                    self.say(f"\n⏸️  Assistant is busy: {event_data.get('error', 'too many pending messages.')}{retry_hint}\n")
+                elif event == "cancelled":
+                    self.say("\n🛑 Request cancelled.\n")
+                else:
+                    self.say(f"\n❌ Error: {error_msg}\n")
+                # Rejected on arrival, so it answers the latest message; a run shed after
+                # waiting for a slot (queue_timeout) was the oldest one
+                rejected = event == "busy" and event_data.get("reason") != "queue_timeout"
+                self.finish_turn(error=f"{event}: {error_msg}" if event != "cancelled" else "cancelled", rejected=rejected)
+
+            elif event == "hello":
+                server_seq = event_data.get("last_seq", 0)
+                if server_seq < self.last_seq:
+                    # The server lost the thread's outbox (e.g. restarted); follow its numbering
+                    self.last_seq = server_seq
+                if self.outstanding:
+                    # Anything missed is replayed right after hello; the pong tells whether a run is still going
+                    self.sent_at_ping = self.sent
+                    await websocket.send(json.dumps({"event": "ping"}))
+
+            elif event == "pong":
+                # Only conclusive if nothing was sent after the ping
+                checked, self.sent_at_ping = self.sent_at_ping == self.sent, None
+                if checked and self.outstanding and not self.in_oauth_flow and not event_data.get("running") and not event_data.get("queued"):
+                    self.say("\n⚠️  The last message didn't reach the assistant, please send it again.\n")
+                    while self.outstanding:
+                        self.finish_turn(error="lost while disconnected")
+
+            elif event == "agent_response":
+                seq = data.get("seq", 0)
+                if seq > self.last_seq:
+                    self.last_seq = seq
+                    await websocket.send(json.dumps({"event": "ack", "data": {"seq": seq}}))
+                messages = event_data.get("messages", [])
+                self.render_messages(messages)
+                if event_data.get("replay"):
+                    # Missed responses merged into one frame: a turn ended at each final answer
+                    for msg in messages:
+                        if self.is_final_answer(msg):
+                            self.finish_turn(content=msg.get("content", ""))
+                elif not self.in_oauth_flow:
+                    # One frame per run; a run interrupted for OAuth continues in a later one
+                    self.finish_turn(content=self.last_ai_content(messages))
+
+            elif event in ("cancel", "interrupt", "llm_cache"):
+                pass  # Acknowledgements of control events, nothing to render
 
             else:
-                messages = data.get("messages", [])
-                ai_messages = [
-                    msg for msg in messages 
-                    if msg.get("type") == MessageType.AI.value
-                ]
-                for msg in ai_messages:
-                    content = msg.get("content", "").strip()
-                    tool_calls = msg.get("additional_kwargs", {}).get("tool_calls", [])
-                    
-                    if tool_calls:
-                        for call in tool_calls:
-                            function = call.get("function", {})
-                            name = function.get("name")
-                            args = function.get("arguments", "{}")
-                            try:
-                                formatted_args = json.dumps(json.loads(args), indent=2)
-                                if DEBUG == True:
-                                    print(f"\n\n🔧 Assistant is executing: {name}")
-                                    print(f"   with arguments:\n{formatted_args}\n")
-                            except json.JSONDecodeError:
-                                if DEBUG == True:
-                                    print(f"\n\n🔧 Assistant is executing: {name}\n")
-                    
-                    if content:
-                        print(f"\n\n🤖 Assistant: {content}\n")
-                # After processing AI messages, reset is_waiting
-                self.is_waiting = False
+                # Protocol 1 response
+                self.render_messages(data.get("messages", []))
+                self.finish_turn()
 
         except json.JSONDecodeError:
-            print("\n❌ Error: Received invalid JSON data.\n")
+            self.say("\n❌ Error: Received invalid JSON data.\n")
+            self.finish_turn(error="invalid JSON from server")
+
+    @staticmethod
+    def is_final_answer(msg: dict) -> bool:
+        return (
+            msg.get("type") == MessageType.AI.value
+            and not msg.get("additional_kwargs", {}).get("tool_calls")
+            and msg.get("response_metadata", {}).get("finish_reason") != "tool_calls"
+        )
+
+    @staticmethod
+    def last_ai_content(messages: list) -> Optional[str]:
+        ai_messages = [msg for msg in messages if msg.get("type") == MessageType.AI.value]
+        return ai_messages[-1].get("content", "") if ai_messages else None
+
+    def finish_turn(self, content: Optional[str] = None, error: Optional[str] = None, rejected: bool = False):
+        if self.outstanding:
+            self.outstanding -= 1
+            self.turns.put_nowait({
+                "ok": error is None,
+                "content": content,
+                "error": error,
+                "rejected": rejected,
+                "first_frame_at": self.turn_first_frame_at,
+                "finished_at": time.perf_counter(),
+            })
+            self.turn_first_frame_at = None
+        if not self.outstanding and not self.in_oauth_flow:
             self.is_waiting = False
 
-    async def send_message(self, websocket, message: str):
+    def render_messages(self, messages: list):
+        ai_messages = [
+            msg for msg in messages
+            if msg.get("type") == MessageType.AI.value
+        ]
+        self.end_streaming()
+        for msg in ai_messages:
+            if msg.get("id") in self.streamed_message_ids or msg.get("id") in self.rendered_message_ids:
+                continue
+            self.rendered_message_ids.add(msg.get("id"))
+            content = msg.get("content", "").strip()
+            tool_calls = msg.get("additional_kwargs", {}).get("tool_calls", [])
+
+            if tool_calls:
+                for call in tool_calls:
+                    function = call.get("function", {})
+                    name = function.get("name")
+                    args = function.get("arguments", "{}")
+                    try:
+                        formatted_args = json.dumps(json.loads(args), indent=2)
+                        if DEBUG == True:
+                            self.say(f"\n\n🔧 Assistant is executing: {name}")
+                            self.say(f"   with arguments:\n{formatted_args}\n")
+                    except json.JSONDecodeError:
+                        if DEBUG == True:
+                            self.say(f"\n\n🔧 Assistant is executing: {name}\n")
+
+            if content:
+                self.say(f"\n\n🤖 Assistant: {content}\n")
+
+    def handle_delta(self, delta: dict):
+        delta_type = delta.get("type")
+        message_id = delta.get("message_id")
+
+        if delta_type == "token":
+            if self.streaming_message_id != message_id:
+                self.end_streaming()
+                self.clear_line()
+                self.say("\n\n🤖 Assistant: ", end="", flush=True)
+                self.streaming_message_id = message_id
+                self.streamed_message_ids.add(message_id)
+            self.say(delta.get("content", ""), end="", flush=True)
+
+        elif delta_type == "final":
+            if self.streaming_message_id == message_id:
+                self.end_streaming()
+
+        elif delta_type == "tool_call_start":
+            if DEBUG == True:
+                self.end_streaming()
+                self.say(f"\n\n🔧 Assistant is executing: {delta.get('name')}")
+
+        elif delta_type == "tool_call_end":
+            if DEBUG == True:
+                self.say(f"\n✅ {delta.get('name')} finished ({delta.get('status')})")
+
+    def end_streaming(self):
+        if self.streaming_message_id is not None:
+            self.say("\n", flush=True)
+            self.streaming_message_id = None
+
+    async def send_message(self, websocket, message: str, stream: Optional[bool] = None):
+        self.outstanding += 1
         self.is_waiting = True
-        payload = {"message": message}
-        await websocket.send(json.dumps(payload))
+        payload = {"message": message, "stream": self.stream if stream is None else stream}
+        try:
+            await websocket.send(json.dumps(payload))
+            self.sent += 1
+        except websockets.exceptions.ConnectionClosed:
+            self.outstanding -= 1
+            raise
+
+    async def submit(self, message: str, stream: Optional[bool] = None):
+        """Send once connected; a message that couldn't be sent is sent again after reconnecting."""
+        while True:
+            await self.connected.wait()
+            try:
+                await self.send_message(self.websocket, message, stream)
+                return
+            except websockets.exceptions.ConnectionClosed:
+                self.connected.clear()
 
     async def listen_messages(self, websocket):
         try:
@@ -118,50 +324,181 @@ class ChatClient:
         except asyncio.CancelledError:
             pass  # Handle task cancellation gracefully
 
+    async def connect_forever(self):
+        """Keep a connection to the thread open, reconnecting with backoff and resuming from last_seq."""
+        first_delay, max_delay = self.reconnect_backoff
+        attempt = 0
+        while not self.closing:
+            uri = f"{self.ws_url}{self.thread_id}?{self.protocol_query}&resume_from={self.last_seq}"
+            ssl_context = ssl.create_default_context(cafile=certifi.where()) if uri.startswith("wss:") else None
+            try:
+                async with websockets.connect(uri=uri, ssl=ssl_context, max_size=None) as websocket:
+                    attempt = 0
+                    self.websocket = websocket
+                    self.connected.set()
+                    await self.listen_messages(websocket)
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                if attempt == 0:
+                    self.say(f"\n❌ Connection lost: {e}\n")
+            finally:
+                self.connected.clear()
+                self.websocket = None
+            if self.closing:
+                break
+            delay = min(max_delay, first_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            attempt += 1
+            self.clear_line()
+            self.say(f"\r🔌 Reconnecting in {delay:.1f}s...", end="", flush=True)
+            await asyncio.sleep(delay)
+
     async def display_loading(self):
-        self.clear_line()
-        symbol = self.loading_symbols[self.loading_index % len(self.loading_symbols)]
-        print(f"\r{symbol} Waiting for assistant's response...", end="", flush=True)
-        self.loading_index += 1
-        await asyncio.sleep(0.5)  # Adjusted sleep for smoother animation
+        # Animates only while a response is awaited; idles on the events otherwise
+        index = 0
+        while True:
+            await self._busy.wait()
+            if self.streaming_message_id is None and not self.in_oauth_flow:
+                symbol = self.loading_symbols[index % len(self.loading_symbols)]
+                self.say(f"\r{symbol} Waiting for assistant's response...", end="", flush=True)
+                index += 1
+            try:
+                await asyncio.wait_for(self._idle.wait(), 0.5)
+                if self.streaming_message_id is None:
+                    self.clear_line()
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        self.closing = True
+        if self.websocket is not None:
+            await self.websocket.close()
 
     async def run(self):
         print(f"\n\n🚀 Starting chat session with thread_id: {self.thread_id}\n")
-        uri = f"{self.ws_url}{self.thread_id}"
+        connection = asyncio.create_task(self.connect_forever())
+        spinner = asyncio.create_task(self.display_loading())
+        stdin = LineReader()
+        try:
+            await self.connected.wait()
+            print("✨ Connected! You can start typing your messages. To exit, type 'exit'.\n")
+            while True:
+                await self._idle.wait()
+                self.clear_line()
+                print("👤 You: ", end="", flush=True)
+                user_input = await stdin.readline()
+
+                if user_input is None or user_input.strip().lower() == 'exit':
+                    print("\n👋 Exiting chat... Bye!\n")
+                    break
+
+                if not user_input.strip():
+                    print("\nPlease enter a message.\n")
+                    continue
+
+                await self.submit(user_input.strip())
+        finally:
+            spinner.cancel()
+            await self.close()
+            connection.cancel()
 
+    async def run_script(self, prompts: List[Dict[str, Any]], pipeline: int = 1, turn_timeout: float = 120.0) -> int:
+        """
+        Send prompts with up to `pipeline` of them in flight, print one JSON line per
+        finished turn and a latency summary on stderr. Returns the number of failed turns.
+        """
+        self.quiet = True
+        connection = asyncio.create_task(self.connect_forever())
+        window = asyncio.Semaphore(pipeline)
+        # Sent prompts whose turn hasn't finished, oldest first
+        pending: Deque[Dict[str, Any]] = deque()
+
+        async def send_all():
+            for index, prompt in enumerate(prompts):
+                await window.acquire()
+                await asyncio.sleep(prompt.get("think_time", 0))
+                request = {"index": index, "prompt": prompt["message"], "sent_at": None}
+                pending.append(request)
+                await self.submit(prompt["message"], prompt.get("stream"))
+                # Timed from when the message went out, not from waiting for a connection
+                request["sent_at"] = time.perf_counter()
+
+        sender = asyncio.create_task(send_all())
+        latencies = []
+        previous_finished = 0.0
         try:
-            ssl_context = ssl.create_default_context(cafile=certifi.where())
-            async with websockets.connect(uri=uri, ssl=ssl_context) as websocket:
-                print("✨ Connected! You can start typing your messages. To exit, type 'exit'.\n")
-                listen_task = asyncio.create_task(self.listen_messages(websocket))
-
-                while True:
-                    if not self.is_waiting and not self.in_oauth_flow:
-                        self.clear_line()
-                        user_input = await asyncio.get_event_loop().run_in_executor(
-                            None, input, "👤 You: "
-                        )
-                        
-                        if user_input.strip().lower() == 'exit':
-                            print("\n👋 Exiting chat... Bye!\n")
-                            listen_task.cancel()
-                            await websocket.close()
-                            break
-                        
-                        if not user_input.strip():
-                            print("\nPlease enter a message.\n")
-                            continue
-                        
-                        await self.send_message(websocket, user_input)
-                    else:
-                        await self.display_loading()
+            for _ in prompts:
+                try:
+                    turn = await asyncio.wait_for(self.turns.get(), turn_timeout)
+                except asyncio.TimeoutError:
+                    turn = {"ok": False, "error": f"timeout after {turn_timeout}s", "content": None,
+                            "rejected": False, "first_frame_at": None, "finished_at": time.perf_counter()}
+                if not pending:
+                    break
+                request = pending.pop() if turn["rejected"] else pending.popleft()
+                request["sent_at"] = request["sent_at"] or turn["finished_at"]
+                window.release()
+                # Pipelined turns queue behind each other on the server; time each from when it could start
+                started = max(request["sent_at"], previous_finished)
+                if not turn["rejected"]:
+                    previous_finished = turn["finished_at"]
+                latency = turn["finished_at"] - request["sent_at"]
+                result = {
+                    "index": request["index"],
+                    "thread_id": self.thread_id,
+                    "prompt": request["prompt"],
+                    "ok": turn["ok"],
+                    "latency_ms": round(latency * 1000, 1),
+                    "ttfb_ms": round((turn["first_frame_at"] - started) * 1000, 1) if turn["first_frame_at"] else None,
+                    "response": turn["content"],
+                    "error": turn["error"],
+                }
+                print(json.dumps(result), flush=True)
+                if turn["ok"]:
+                    latencies.append(latency)
+                elif turn["error"] and turn["error"].startswith("timeout"):
+                    break
+        finally:
+            sender.cancel()
+            await self.close()
+            connection.cancel()
 
-        except Exception as e:
-            print(f"\n❌ Failed to connect to WebSocket: {e}\n")
+        failures = len(prompts) - len(latencies)
+        summary = {"turns": len(prompts), "ok": len(latencies), "failed": failures}
+        if latencies:
+            latencies.sort()
+            summary.update({
+                "latency_p50_ms": round(statistics.median(latencies) * 1000, 1),
+                "latency_p95_ms": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000, 1),
+                "latency_max_ms": round(latencies[-1] * 1000, 1),
+            })
+        print(json.dumps(summary), file=sys.stderr)
+        return failures
+
+def read_prompts(path: str) -> List[Dict[str, Any]]:
+    """One prompt per line: plain text, or a JSON object {"message", "stream"?, "think_time"?}."""
+    lines = sys.stdin.read().splitlines() if path == "-" else open(path).read().splitlines()
+    prompts = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        prompts.append(json.loads(line) if line.startswith("{") else {"message": line})
+    return prompts
 
 def main():
-    client = ChatClient()
+    parser = argparse.ArgumentParser(description="Chat with the agent service over its WebSocket API.")
+    parser.add_argument("--server-url", help="Defaults to SERVER_URL")
+    parser.add_argument("--thread-id", help="Continue an existing conversation")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="Wait for whole responses")
+    parser.add_argument("--script", metavar="FILE", help="Non-interactive: send the prompts in FILE (text or JSONL, - for stdin) and print results as JSON lines")
+    parser.add_argument("--pipeline", type=int, default=1, help="Prompts in flight at once in scripted mode")
+    parser.add_argument("--turn-timeout", type=float, default=120.0, help="Seconds to wait for a turn in scripted mode")
+    args = parser.parse_args()
+
+    client = ChatClient(thread_id=args.thread_id, server_url=args.server_url, stream=args.stream)
+    if args.script:
+        prompts = read_prompts(args.script)
+        sys.exit(1 if asyncio.run(client.run_script(prompts, args.pipeline, args.turn_timeout)) else 0)
     asyncio.run(client.run())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()